@@ -0,0 +1,23 @@
+/**
+ * 設備階層APIルート
+ */
+
+import { NextRequest, NextResponse } from 'next/server';
+import { ragClient } from '@/lib/api/rag-client';
+
+export async function GET(request: NextRequest) {
+  try {
+    const { searchParams } = request.nextUrl;
+    const path = searchParams.getAll('path');
+    const offset = Number(searchParams.get('offset') ?? 0);
+    const limit = Number(searchParams.get('limit') ?? 200);
+    const children = await ragClient.getHierarchyChildren(path, offset, limit);
+    return NextResponse.json(children);
+  } catch (error) {
+    console.error('[API /api/search/hierarchy] エラー:', error);
+    return NextResponse.json(
+      { error: '設備階層の取得に失敗しました' },
+      { status: 500 }
+    );
+  }
+}
@@ -0,0 +1,22 @@
+/**
+ * 入力補完APIルート
+ */
+
+import { NextRequest, NextResponse } from 'next/server';
+import { ragClient } from '@/lib/api/rag-client';
+
+export async function GET(request: NextRequest) {
+  try {
+    const { searchParams } = request.nextUrl;
+    const q = searchParams.get('q') ?? '';
+    const limit = Number(searchParams.get('limit') ?? 8);
+    const response = await ragClient.suggest(q, limit);
+    return NextResponse.json(response);
+  } catch (error) {
+    console.error('[API /api/suggest] エラー:', error);
+    return NextResponse.json(
+      { error: '入力補完の取得に失敗しました' },
+      { status: 500 }
+    );
+  }
+}
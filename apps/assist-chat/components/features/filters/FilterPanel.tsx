@@ -8,12 +8,16 @@
  * 4. 工場
  * 5. 生産ライン (工場に依存)
  * 6. 設備階層（設備1 → 設備2 → 設備3） (ラインに依存)
+ *
+ * メタデータには工場だけが入っているので、ライン以下は選択に合わせて
+ * /api/search/hierarchy から子を取得する（取得済みの枝はキャッシュ）。
  */
 
 'use client';
 
-import { useMemo } from 'react';
-import { SearchFilters, FilterMetadata, HierarchyNode } from '@/types';
+import { useCallback, useEffect, useMemo, useRef, useState } from 'react';
+import { SearchFilters, FilterMetadata, HierarchyChildren } from '@/types';
+import { searchService } from '@/lib/api/search.service';
 import { Card } from '@/components/ui/card';
 import { Button } from '@/components/ui/button';
 import { Separator } from '@/components/ui/separator';
@@ -27,6 +31,13 @@ import { Equipment2Filter } from './Equipment2Filter';
 import { Equipment3Filter } from './Equipment3Filter';
 import { RotateCcw } from 'lucide-react';
 
+type HierarchyChild = HierarchyChildren['children'][number];
+
+// 1つの階層で同時に開く枝の上限。これを超えたら全件のリストを出す（全部の枝を取りに行かない）
+const MAX_FANOUT = 20;
+
+const pathKey = (path: string[]) => path.join('\u0000');
+
 interface FilterPanelProps {
   filters: SearchFilters;
   onChange: (filters: SearchFilters) => void;
@@ -77,114 +88,117 @@ export function FilterPanel({ filters, onChange, metadata, onReset }: FilterPane
 
   // ==================== カスケードロジック ====================
 
-  // 1. 利用可能な工場（ルート）
-  const availableLocations = useMemo(() => {
-    if (!metadata.hierarchy) return [];
-    return metadata.hierarchy.map(node => node.id).sort();
-  }, [metadata.hierarchy]);
-
-  // 2. 利用可能なライン（工場に依存）
-  const availableLines = useMemo(() => {
-    if (!metadata.hierarchy) return metadata.productionLines;
-    
-    const selectedLocs = filters.locations || [];
-    let lines: Set<string> = new Set();
-
-    metadata.hierarchy.forEach(locNode => {
-      // ロケーションが選択されていない(全表示) または 選択されている場合
-      if (selectedLocs.length === 0 || selectedLocs.includes(locNode.id)) {
-        locNode.children.forEach(lineNode => lines.add(lineNode.id));
+  // 取得済みの子ノード（キー: 親のパス）
+  const [childrenCache, setChildrenCache] = useState<Record<string, HierarchyChild[]>>({});
+  const requested = useRef<Set<string>>(new Set());
+
+  // インデックスが切り替わったらキャッシュを捨てる
+  useEffect(() => {
+    requested.current = new Set();
+    setChildrenCache({});
+  }, [metadata]);
+
+  const loadChildren = useCallback((path: string[]) => {
+    const key = pathKey(path);
+    if (requested.current.has(key)) return;
+    requested.current.add(key);
+    searchService
+      .getHierarchyChildren(path)
+      .then((children) => setChildrenCache((prev) => ({ ...prev, [key]: children })))
+      .catch((error) => {
+        console.error('設備階層の取得に失敗:', error);
+        requested.current.delete(key);
+      });
+  }, []);
+
+  const selections = [
+    filters.locations || [],
+    filters.productionLines || [],
+    filters.equipment1s || [],
+    filters.equipment2s || [],
+    filters.equipment3s || [],
+  ];
+
+  // 各階層の選択肢。上の階層で選ばれている枝（未選択なら全部の枝）の子を集める。
+  // 枝がまだ取れていない・多すぎるときは、メタデータの全件のリストを出す
+  const { available, missing } = useMemo(() => {
+    const flat = [
+      [],
+      metadata.productionLines,
+      metadata.equipment1s,
+      metadata.equipment2s,
+      metadata.equipment3s,
+    ];
+    const top = metadata.hierarchy || [];
+    const available: string[][] = [top.map((node) => node.id).sort()];
+    const missing: string[][] = [];
+
+    let frontier: string[][] | null = metadata.hierarchy
+      ? top
+          .filter((node) => node.hasChildren !== false)
+          .filter((node) => selections[0].length === 0 || selections[0].includes(node.id))
+          .map((node) => [node.id])
+      : null;
+
+    for (let depth = 1; depth < selections.length; depth++) {
+      if (frontier === null || frontier.length > MAX_FANOUT) {
+        available.push(flat[depth]);
+        frontier = null;
+        continue;
       }
-    });
-
-    return Array.from(lines).sort();
-  }, [metadata.hierarchy, metadata.productionLines, filters.locations]);
-
-  // 3. 利用可能な設備1（ラインに依存）
-  const availableEquipment1s = useMemo(() => {
-    if (!metadata.hierarchy) return metadata.equipment1s;
-
-    const selectedLocs = filters.locations || [];
-    const selectedLines = filters.productionLines || [];
-    let eq1s: Set<string> = new Set();
 
-    // ラインが選択されてない場合、全部の設備1を表示するとごちゃごちゃするかも
-    // でも、カスケードルールに従って、選択された工場（または全部）の設備1を表示する
-    // 多すぎるかもしれないけど、今のロジックのまま：現在の制約下で利用可能なものを全部表示
-
-    metadata.hierarchy.forEach(locNode => {
-      if (selectedLocs.length === 0 || selectedLocs.includes(locNode.id)) {
-        locNode.children.forEach(lineNode => {
-          if (selectedLines.length === 0 || selectedLines.includes(lineNode.id)) {
-             lineNode.children.forEach(eq1Node => eq1s.add(eq1Node.id));
+      const labels = new Set<string>();
+      const next: string[][] = [];
+      let loaded = true;
+      for (const path of frontier) {
+        const children = childrenCache[pathKey(path)];
+        if (!children) {
+          missing.push(path);
+          loaded = false;
+          continue;
+        }
+        for (const child of children) {
+          labels.add(child.id);
+          const selected = selections[depth];
+          if (child.hasChildren && (selected.length === 0 || selected.includes(child.id))) {
+            next.push([...path, child.id]);
           }
-        });
+        }
       }
-    });
-
-    return Array.from(eq1s).sort();
-  }, [metadata.hierarchy, metadata.equipment1s, filters.locations, filters.productionLines]);
-
-  // 4. 利用可能な設備2（設備1に依存）
-  const availableEquipment2s = useMemo(() => {
-    if (!metadata.hierarchy) return metadata.equipment2s;
 
-    const selectedLocs = filters.locations || [];
-    const selectedLines = filters.productionLines || [];
-    const selectedEq1s = filters.equipment1s || [];
-    let eq2s: Set<string> = new Set();
-
-    // カスケードルール：設備1が選択されてる場合だけ設備2を表示？
-    // それとも利用可能な設備1に属する設備2を表示？
-    // 現在のロジック：利用可能な制約下の設備2を全部表示
-    
-    metadata.hierarchy.forEach(locNode => {
-      if (selectedLocs.length === 0 || selectedLocs.includes(locNode.id)) {
-        locNode.children.forEach(lineNode => {
-          if (selectedLines.length === 0 || selectedLines.includes(lineNode.id)) {
-             lineNode.children.forEach(eq1Node => {
-               if (selectedEq1s.length === 0 || selectedEq1s.includes(eq1Node.id)) {
-                 eq1Node.children.forEach(eq2Node => eq2s.add(eq2Node.id));
-               }
-             });
-          }
-        });
-      }
-    });
-
-    return Array.from(eq2s).sort();
-  }, [metadata.hierarchy, metadata.equipment2s, filters.locations, filters.productionLines, filters.equipment1s]);
-
-  // 5. 利用可能な設備3
-  const availableEquipment3s = useMemo(() => {
-    if (!metadata.hierarchy) return metadata.equipment3s;
-
-    const selectedLocs = filters.locations || [];
-    const selectedLines = filters.productionLines || [];
-    const selectedEq1s = filters.equipment1s || [];
-    const selectedEq2s = filters.equipment2s || [];
-    let eq3s: Set<string> = new Set();
-
-    metadata.hierarchy.forEach(locNode => {
-      if (selectedLocs.length === 0 || selectedLocs.includes(locNode.id)) {
-        locNode.children.forEach(lineNode => {
-          if (selectedLines.length === 0 || selectedLines.includes(lineNode.id)) {
-             lineNode.children.forEach(eq1Node => {
-               if (selectedEq1s.length === 0 || selectedEq1s.includes(eq1Node.id)) {
-                 eq1Node.children.forEach(eq2Node => {
-                   if (selectedEq2s.length === 0 || selectedEq2s.includes(eq2Node.id)) {
-                      eq2Node.children.forEach(eq3Node => eq3s.add(eq3Node.id));
-                   }
-                 });
-               }
-             });
-          }
-        });
+      if (!loaded) {
+        available.push(flat[depth]);
+        frontier = null;
+        continue;
       }
-    });
+      available.push(Array.from(labels).sort());
+      frontier = next;
+    }
 
-    return Array.from(eq3s).sort();
-  }, [metadata.hierarchy, metadata.equipment3s, filters.locations, filters.productionLines, filters.equipment1s, filters.equipment2s]);
+    return { available, missing };
+    // selectionsは毎回新しい配列なので、元のフィルターの値で依存を取る
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [
+    metadata,
+    childrenCache,
+    filters.locations,
+    filters.productionLines,
+    filters.equipment1s,
+    filters.equipment2s,
+    filters.equipment3s,
+  ]);
+
+  useEffect(() => {
+    missing.forEach(loadChildren);
+  }, [missing, loadChildren]);
+
+  const [
+    availableLocations,
+    availableLines,
+    availableEquipment1s,
+    availableEquipment2s,
+    availableEquipment3s,
+  ] = available;
 
 
   return (
@@ -1,10 +1,19 @@
 'use client';
 
+import { useEffect, useRef, useState } from 'react';
 import { Search, X } from 'lucide-react';
 import { Input } from '@/components/ui/input';
 import { Button } from '@/components/ui/button';
 import { cn } from '@/lib/utils';
 import { SEARCH_CONFIG } from '@/lib/constants';
+import { searchService } from '@/lib/api/search.service';
+import type { Suggestion } from '@/types';
+
+const SUGGESTION_KIND_LABELS: Record<Suggestion['kind'], string> = {
+  equipment: '設備',
+  code: 'コード',
+  term: '単語',
+};
 
 interface SearchInputProps {
   value: string;
@@ -23,10 +32,64 @@ export function SearchInput({
   placeholder = '故障内容や設備名で検索...',
   className,
 }: SearchInputProps) {
-  const handleKeyPress = (e: React.KeyboardEvent<HTMLInputElement>) => {
-    if (e.key === 'Enter' && !isLoading) {
+  const [suggestions, setSuggestions] = useState<Suggestion[]>([]);
+  const [activeIndex, setActiveIndex] = useState(-1);
+  const [showSuggestions, setShowSuggestions] = useState(false);
+  const requestId = useRef(0);
+
+  // 入力補完。最後の単語（空白より後ろ）で前方一致の候補を取る
+  useEffect(() => {
+    const lastWord = value.split(/\s+/).pop() ?? '';
+    const id = ++requestId.current;
+    if (!lastWord) {
+      setSuggestions([]);
+      return;
+    }
+    const timer = setTimeout(async () => {
+      try {
+        const items = await searchService.suggest(lastWord, SEARCH_CONFIG.SUGGEST_LIMIT);
+        // 遅れて返ってきた古い入力の分は捨てる
+        if (id === requestId.current) {
+          setSuggestions(items);
+          setActiveIndex(-1);
+        }
+      } catch {
+        // 補完が取れなくても検索はできるので何もしない
+      }
+    }, SEARCH_CONFIG.SUGGEST_DEBOUNCE_DELAY);
+    return () => clearTimeout(timer);
+  }, [value]);
+
+  const applySuggestion = (suggestion: Suggestion) => {
+    const words = value.split(/\s+/);
+    words[words.length - 1] = suggestion.text;
+    onChange(words.join(' '));
+    setShowSuggestions(false);
+  };
+
+  const suggestionsOpen = showSuggestions && suggestions.length > 0;
+
+  const handleKeyDown = (e: React.KeyboardEvent<HTMLInputElement>) => {
+    if (e.nativeEvent.isComposing) return; // IMEの変換中は触らない
+
+    if (suggestionsOpen && (e.key === 'ArrowDown' || e.key === 'ArrowUp')) {
+      e.preventDefault();
+      const step = e.key === 'ArrowDown' ? 1 : -1;
+      setActiveIndex((i) => (i + step + suggestions.length) % suggestions.length);
+      return;
+    }
+    if (e.key === 'Escape') {
+      setShowSuggestions(false);
+      return;
+    }
+    if (e.key === 'Enter') {
       e.preventDefault(); // フォーム送信を防ぐ
-      onSearch();
+      if (suggestionsOpen && activeIndex >= 0) {
+        applySuggestion(suggestions[activeIndex]);
+      } else if (!isLoading) {
+        setShowSuggestions(false);
+        onSearch();
+      }
     }
   };
 
@@ -41,8 +104,15 @@ export function SearchInput({
         <Input
           type="text"
           value={value} // propsから直接値を使用
-          onChange={(e) => onChange(e.target.value)} // propsから直接onChangeを呼び出し
-          onKeyPress={handleKeyPress}
+          onChange={(e) => {
+            onChange(e.target.value); // propsから直接onChangeを呼び出し
+            setShowSuggestions(true);
+          }}
+          onKeyDown={handleKeyDown}
+          onBlur={() => setShowSuggestions(false)}
+          role="combobox"
+          aria-expanded={suggestionsOpen}
+          aria-autocomplete="list"
           placeholder={placeholder}
           disabled={isLoading}
           className="pl-10 pr-24 sm:pr-28 h-12 text-base sm:text-base" // モバイルではボタンが少し小さめになるように調整
@@ -69,6 +139,34 @@ export function SearchInput({
           </Button>
         </div>
       </div>
+      {suggestionsOpen && (
+        <ul
+          role="listbox"
+          className="absolute z-20 mt-1 w-full overflow-hidden rounded-md border border-slate-200 bg-white shadow-md"
+        >
+          {suggestions.map((suggestion, i) => (
+            <li
+              key={`${suggestion.kind}-${suggestion.text}`}
+              role="option"
+              aria-selected={i === activeIndex}
+              // onBlurより先に選ばれるようにmousedownで拾う
+              onMouseDown={(e) => {
+                e.preventDefault();
+                applySuggestion(suggestion);
+              }}
+              className={cn(
+                'flex cursor-pointer items-center justify-between px-3 py-2 text-sm',
+                i === activeIndex ? 'bg-slate-100' : 'hover:bg-slate-50'
+              )}
+            >
+              <span>{suggestion.text}</span>
+              <span className="text-xs text-slate-400">
+                {SUGGESTION_KIND_LABELS[suggestion.kind]} · {suggestion.count}件
+              </span>
+            </li>
+          ))}
+        </ul>
+      )}
     </div>
   );
 }
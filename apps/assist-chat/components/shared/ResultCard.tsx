@@ -5,7 +5,7 @@
 import { SearchResult } from '@/types';
 import { Card } from '@/components/ui/card';
 import { Badge } from '@/components/ui/badge';
-import { Calendar, MapPin, Wrench } from 'lucide-react';
+import { Calendar, Copy, MapPin, Wrench } from 'lucide-react';
 import { cn } from '@/lib/utils';
 import { getCategoryColor, getCategoryIcon } from '@/lib/utils/category';
 import { formatDate } from '@/lib/utils/date';
@@ -86,6 +86,13 @@ export function ResultCard({
               {getCategoryIcon(result.category)} {result.category}
             </Badge>
           )}
+          {/* 号機違いなど、ほぼ同じ記録をまとめた件数 */}
+          {!!result.duplicate_count && (
+            <span className="flex items-center gap-1 text-xs text-slate-500">
+              <Copy className="h-3 w-3" />
+              似た記録{result.duplicate_count}件
+            </span>
+          )}
         </div>
       </div>
     </Card>
@@ -6,6 +6,8 @@ import {
   SearchResponse,
   DocumentDetail,
   FilterMetadata,
+  HierarchyChildren,
+  SuggestResponse,
   ApiError,
   FeedbackRequest,
 } from '@/types';
@@ -104,6 +106,25 @@ class RagApiClient {
     return this.fetch<FilterMetadata>(API_ENDPOINTS.FILTER_METADATA);
   }
 
+  // 設備階層のノードの子（pathは工場, ライン, 設備1, ... のラベル）
+  async getHierarchyChildren(
+    path: string[],
+    offset = 0,
+    limit = 200
+  ): Promise<HierarchyChildren> {
+    const params = new URLSearchParams();
+    path.forEach((label) => params.append('path', label));
+    params.set('offset', String(offset));
+    params.set('limit', String(limit));
+    return this.fetch<HierarchyChildren>(`${API_ENDPOINTS.HIERARCHY}?${params}`);
+  }
+
+  // 入力補完（前方一致の候補を件数順に）
+  async suggest(q: string, limit = 8): Promise<SuggestResponse> {
+    const params = new URLSearchParams({ q, limit: String(limit) });
+    return this.fetch<SuggestResponse>(`${API_ENDPOINTS.SUGGEST}?${params}`);
+  }
+
   // フィードバック送信
   async submitFeedback(request: FeedbackRequest): Promise<void> {
     return this.fetch<void>(API_ENDPOINTS.FEEDBACK, {
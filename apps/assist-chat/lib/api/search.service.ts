@@ -1,7 +1,7 @@
 // 検索サービス
 // ragClientをラップしてる。将来的にキャッシュとか追加するかも
 
-import { SearchRequest, SearchResponse, FilterMetadata } from '@/types';
+import { SearchRequest, SearchResponse, FilterMetadata, HierarchyChildren, Suggestion } from '@/types';
 import { ragClient } from './rag-client';
 
 export class SearchService {
@@ -12,6 +12,23 @@ export class SearchService {
   async getFilterMetadata(): Promise<FilterMetadata> {
     return ragClient.getFilterMetadata();
   }
+
+  // 設備階層のノードの子を全部取る（多いときはページを続けて取る）
+  async getHierarchyChildren(path: string[]): Promise<HierarchyChildren['children']> {
+    const first = await ragClient.getHierarchyChildren(path);
+    const children = [...first.children];
+    while (children.length < first.total) {
+      const page = await ragClient.getHierarchyChildren(path, children.length);
+      if (page.children.length === 0) break;
+      children.push(...page.children);
+    }
+    return children;
+  }
+
+  async suggest(q: string, limit?: number): Promise<Suggestion[]> {
+    const response = await ragClient.suggest(q, limit);
+    return response.suggestions;
+  }
 }
 
 export const searchService = new SearchService();
@@ -20,6 +20,8 @@ export const SEARCH_CONFIG = {
   MAX_QUERY_LENGTH: 200,
   MAX_SNIPPET_LENGTH: 200,
   MAX_SUMMARY_LENGTH: 150,
+  SUGGEST_DEBOUNCE_DELAY: 100,  // 入力補完は検索より短い間隔で取る
+  SUGGEST_LIMIT: 8,
 } as const;
 
 // ==================== 重要度 ====================
@@ -157,6 +159,8 @@ export const API_ENDPOINTS = {
   SEARCH: '/api/search',
   DOCUMENT: '/api/docs',
   FILTER_METADATA: '/api/search/metadata',
+  HIERARCHY: '/api/search/hierarchy',
+  SUGGEST: '/api/suggest',
   FEEDBACK: '/api/feedback',
   HEALTH: '/health',
 } as const;
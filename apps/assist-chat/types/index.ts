@@ -59,6 +59,12 @@ export interface SearchResult {
   
   /** 作業者 (匿名化済み、オプション) */
   operator?: string;
+
+  /** ヒットしたチャンクのID */
+  chunk_id?: string;
+
+  /** インデックス構築時にまとめたほぼ同じ記録の件数 (/api/docs/{doc_id}/duplicates で取得) */
+  duplicate_count?: number;
 }
 
 /**
@@ -230,8 +236,60 @@ export interface HierarchyNode {
   /** 表示ラベル */
   label: string;
   
-  /** 子ノード */
+  /** 子ノード（メタデータでは空。/api/search/hierarchy で取得する） */
   children: HierarchyNode[];
+
+  /** ノード番号（同じインデックス世代の中でだけ有効） */
+  nodeId?: number;
+
+  /** 文書数 */
+  count?: number;
+
+  /** 子ノードがあるか */
+  hasChildren?: boolean;
+}
+
+/**
+ * 階層ノードの子
+ * GET /api/search/hierarchy の返却値
+ */
+export interface HierarchyChildren {
+  /** インデックスの世代（変わったらnodeIdは使えない） */
+  generation: string;
+
+  nodeId: number;
+
+  /** ノードのラベル（工場, ライン, 設備1, ...） */
+  path: string[];
+
+  /** 文書数 */
+  count: number;
+
+  /** 子ノードの総数 */
+  total: number;
+
+  offset: number;
+
+  children: Array<Omit<HierarchyNode, 'children'> & { nodeId: number; count: number; hasChildren: boolean }>;
+}
+
+/**
+ * 入力補完の候補
+ * GET /api/suggest の返却値の1件
+ */
+export interface Suggestion {
+  text: string;
+
+  /** equipment: 設備名 / code: エラーコード・パラメータ番号 / term: よく出てくる単語 */
+  kind: 'equipment' | 'code' | 'term';
+
+  /** 出てくる文書数（termはチャンク数） */
+  count: number;
+}
+
+export interface SuggestResponse {
+  query: string;
+  suggestions: Suggestion[];
 }
 
 /**
@@ -268,7 +326,7 @@ export interface FilterMetadata {
   /** 総ドキュメント数 */
   totalDocuments: number;
   
-  /** 階層構造（工場 → ライン → 設備1 → 設備2 → 設備3） */
+  /** 階層構造の最上位（工場）。ライン以下は /api/search/hierarchy で取得する */
   hierarchy?: HierarchyNode[];
 }
 
@@ -9,7 +9,7 @@ import logging
 import re
 import hashlib
 import json
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterable, Iterator, Optional
 from dataclasses import dataclass
 from pathlib import Path
 
@@ -53,6 +53,10 @@ class TextChunker:
         self.separator = separator
         # 日本語の文末
         self.sentence_endings = ["。", "！", "？", "\n"]
+        # 毎回組み立てると遅いので、文末のパターンは最初にコンパイルしておく
+        self._sentence_end_pattern = re.compile(
+            '|'.join(re.escape(ending) for ending in self.sentence_endings)
+        )
     
     def chunk_text(
         self,
@@ -71,39 +75,40 @@ class TextChunker:
             metadata = {}
             
         chunks: List[Chunk] = []
-        sentences = self._split_sentences(text)
-        
-        current_chunk = ""
+
+        # 文字列を+=で伸ばすとチャンクが長いほど遅くなるので、
+        # 文をリストに溜めて長さだけ数えておき、チャンクを確定するときにjoinする
+        parts: List[str] = []
+        length = 0
         chunk_index = 0
-        
-        for sentence in sentences:
+
+        for sentence in self._iter_sentences(text):
             sentence = sentence.strip()
             if not sentence:
                 continue
-                
-            potential_chunk = current_chunk + sentence
-            
+
             # チャンクサイズを超えたら保存して次へ
-            if current_chunk and len(potential_chunk) > self.chunk_size:
-                if current_chunk:
-                    self._add_chunk(chunks, current_chunk, doc_id, metadata, chunk_index)
-                    chunk_index += 1
-                    
-                    # オーバーラップ（前のチャンクの末尾を次のチャンクの先頭に含める）
-                    if self.chunk_overlap > 0:
-                        overlap_text = self._get_overlap(current_chunk)
-                        current_chunk = overlap_text + sentence
-                    else:
-                        current_chunk = sentence
+            if parts and length + len(sentence) > self.chunk_size:
+                current_chunk = "".join(parts)
+                self._add_chunk(chunks, current_chunk, doc_id, metadata, chunk_index)
+                chunk_index += 1
+
+                # オーバーラップ（前のチャンクの末尾を次のチャンクの先頭に含める）
+                if self.chunk_overlap > 0:
+                    overlap_text = self._get_overlap(current_chunk)
+                    parts = [overlap_text, sentence]
+                    length = len(overlap_text) + len(sentence)
                 else:
-                    current_chunk = sentence
+                    parts = [sentence]
+                    length = len(sentence)
             else:
-                current_chunk = potential_chunk
-        
+                parts.append(sentence)
+                length += len(sentence)
+
         # 最後のチャンクを保存
-        if current_chunk:
-            self._add_chunk(chunks, current_chunk, doc_id, metadata, chunk_index)
-            
+        if parts:
+            self._add_chunk(chunks, "".join(parts), doc_id, metadata, chunk_index)
+
         return chunks
 
     def _add_chunk(self, chunks, text, doc_id, metadata, index):
@@ -118,23 +123,23 @@ class TextChunker:
     
     def _split_sentences(self, text: str) -> List[str]:
         """文に分割（日本語対応）"""
-        pattern = '|'.join(re.escape(ending) for ending in self.sentence_endings)
-        sentences = re.split(f'({pattern})', text)
-        
-        # 分割された文末記号を文に結合
-        result = []
-        current = ""
-        for part in sentences:
-            if part in self.sentence_endings:
-                current += part
-                result.append(current)
-                current = ""
-            else:
-                current = part
-        if current:
-            result.append(current)
-        return [s for s in result if s.strip()]
-    
+        return [s for s in self._iter_sentences(text) if s.strip()]
+
+    def _iter_sentences(self, text: str) -> Iterator[str]:
+        """
+        文末記号の位置で切り出す（文末記号は前の文に含める）
+
+        re.splitで分割してから結合し直すより、マッチの位置でスライスする方が速い。
+        空白だけの文もそのまま返すので、呼び出し側で飛ばす。
+        """
+        start = 0
+        for match in self._sentence_end_pattern.finditer(text):
+            end = match.end()
+            yield text[start:end]
+            start = end
+        if start < len(text):
+            yield text[start:]
+
     def _get_overlap(self, text: str) -> str:
         """オーバーラップ部分を取得"""
         if len(text) <= self.chunk_overlap:
@@ -154,19 +159,26 @@ class TextChunker:
         doc_id_field: str = "doc_id"
     ) -> List[Chunk]:
         """複数文書をまとめてチャンク化"""
-        all_chunks = []
+        all_chunks = list(self.iter_document_chunks(documents, text_field, doc_id_field))
+        logger.info(f"{len(documents)}件のドキュメントを{len(all_chunks)}個のチャンクに分割しました")
+        return all_chunks
+
+    def iter_document_chunks(
+        self,
+        documents: Iterable[Dict[str, Any]],
+        text_field: str = "text",
+        doc_id_field: str = "doc_id"
+    ) -> Iterator[Chunk]:
+        """chunk_documentsのジェネレーター版（前処理のストリーミング用）"""
         for doc in documents:
             text = doc.get(text_field, "")
-            doc_id = doc.get(doc_id_field, self._generate_doc_id(text))
-            
+            # IDがあるときにハッシュを計算しないように、getのデフォルト値では渡さない
+            doc_id = doc[doc_id_field] if doc_id_field in doc else self._generate_doc_id(text)
+
             # text以外のフィールドはメタデータとして保持
             metadata = {k: v for k, v in doc.items() if k != text_field}
-            
-            chunks = self.chunk_text(text, doc_id, metadata)
-            all_chunks.extend(chunks)
-        
-        logger.info(f"{len(documents)}件のドキュメントを{len(all_chunks)}個のチャンクに分割しました")
-        return all_chunks
+
+            yield from self.chunk_text(text, doc_id, metadata)
 
     def save_chunks(
         self,
@@ -174,7 +186,7 @@ class TextChunker:
         filepath: Path,
         format: str = "jsonl"
     ):
-        """チャンクをファイルに保存"""
+        """チャンクをファイルに保存（jsonl / parquet）"""
         filepath = Path(filepath)
         filepath.parent.mkdir(parents=True, exist_ok=True)
         
@@ -182,3 +194,9 @@ class TextChunker:
             with open(filepath, 'w', encoding='utf-8') as f:
                 for chunk in chunks:
                     f.write(json.dumps(chunk.to_dict(), ensure_ascii=False) + '\n')
+        elif format == "parquet":
+            # pyarrowは任意の依存なので、ここで読み込む
+            from .columnar import write_chunks_parquet
+            write_chunks_parquet(chunks, filepath)
+        else:
+            raise ValueError(f"Unsupported format: {format}")
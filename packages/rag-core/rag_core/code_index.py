@@ -0,0 +1,85 @@
+"""
+エラーコード・パラメータ番号の完全一致インデックス
+
+「E-482」「P-905」のようなコードだけのクエリは、埋め込みもFAISSもCross-Encoderも役に立たない
+（ベクトルでは E-482 と E-428 の区別がつかない）。なのに毎回それらを通すので数十ms〜かかっていた。
+
+本文から正規表現でコードを抜き出して、コード → 行番号（BM25のメタデータの行）の辞書を作っておく。
+クエリがほぼコードだけなら、この辞書でコードを含むチャンクだけを引き、
+その中をBM25で並べる（HybridSearcher.retrieveの近道）。DenseとRerankは通さない。
+
+行番号はBM25のセグメントをまとめた通しの番号なので、BM25IndexManagerが読み込み・追加・マージのたびに作り直す。
+"""
+
+import re
+from typing import Any, Dict, Iterable, List
+
+from .text import normalize_text
+
+# 「E-416」「P-012」のような英字+ハイフン+数字（NFKCのあとで探すので全角でも拾える）
+CODE_PATTERN = re.compile(r"(?<![A-Za-z0-9])[A-Z]{1,3}-\d{1,5}(?![0-9])")
+
+# コードと一緒に打たれても検索の意味が変わらない言葉（「E-482 エラー」はコードだけのクエリ扱い）
+_GENERIC_WORDS = re.compile(r"エラー|アラーム|コード|パラメータ|異常|表示|発生|error|alarm|code", re.IGNORECASE)
+
+# 助詞や送り仮名（ひらがな）・記号・空白は数えない
+_IGNORED_CHARS = re.compile(r"[\sぁ-ゟ]|[^\w]")
+
+
+def extract_codes(text: str) -> List[str]:
+    """本文に出てくるコード（重複なし、出てきた順）"""
+    return list(dict.fromkeys(CODE_PATTERN.findall(normalize_text(text or ""))))
+
+
+def parse_code_query(query: str, min_ratio: float = 0.6) -> List[str]:
+    """
+    クエリがほぼコードだけならコードのリストを返す。そうでなければ空
+
+    コードの文字数 / (コードの文字数 + 残りの文字数) がmin_ratio以上ならコードのクエリとみなす。
+    「E-482」「e-482 エラー」「E-482の対処」はコードのクエリ、「E-482 ベアリング交換」は普通の検索。
+
+    本文と同じCODE_PATTERNで探す（大文字にそろえるだけ）。ハイフンなしまで拾うと
+    型式の「GT2710」が「GT-2710」、「CV-X100」が「X-100」になって、別のコードの完全一致に化ける。
+    """
+    text = normalize_text(query).upper()
+    codes = CODE_PATTERN.findall(text)
+    if not codes:
+        return []
+    rest = _IGNORED_CHARS.sub("", _GENERIC_WORDS.sub("", CODE_PATTERN.sub("", text)))
+    code_chars = sum(len(code) for code in codes)
+    if code_chars / (code_chars + len(rest)) < min_ratio:
+        return []
+    return list(dict.fromkeys(codes))
+
+
+class CodeIndex:
+    """コード → そのコードが出てくる行番号（昇順）"""
+
+    def __init__(self, postings: Dict[str, List[int]] = None):
+        self.postings: Dict[str, List[int]] = postings or {}
+
+    @classmethod
+    def build(cls, metadata: Iterable[Dict[str, Any]], start: int = 0) -> "CodeIndex":
+        postings: Dict[str, List[int]] = {}
+        for row, item in enumerate(metadata, start):
+            for code in extract_codes(item.get('text')):
+                postings.setdefault(code, []).append(row)
+        return cls(postings)
+
+    def extended(self, metadata: List[Dict[str, Any]], start: int) -> "CodeIndex":
+        """
+        start行目からのmetadata（追加したセグメント）を足した新しい索引
+
+        検索中のスレッドが古い方を読んでいてもいいように、自分は書き換えない
+        （変わらないコードのリストはそのまま共有する）。
+        """
+        postings = dict(self.postings)
+        for code, rows in CodeIndex.build(metadata, start).postings.items():
+            postings[code] = postings.get(code, []) + rows
+        return CodeIndex(postings)
+
+    def rows(self, code: str) -> List[int]:
+        return self.postings.get(code, [])
+
+    def __len__(self) -> int:
+        return len(self.postings)
@@ -0,0 +1,278 @@
+"""
+チャンクの列指向フォーマット（Arrow / Parquet）
+
+JSONLだと毎回全部パースし直すことになるので、前処理 → インデックス構築の間は
+Parquetでも受け渡せるようにしてる。
+
+列構成:
+- chunk_id, doc_id, chunk_index, text
+- metadata: 構造体の列（CSVの列がそのままフィールドになる）
+
+doc_idやメタデータの文字列（工場・ライン・設備など）は値の種類が少ないので辞書エンコードする。
+textだけ読みたいとき（埋め込みの計算など）は columns=["text"] で他の列を読まずに済む。
+メタデータも項目を指定すればその列だけ読む（load_chunk_dicts_parquetのmetadata_fields）。
+
+Pythonの値に戻すときは行ごとの辞書（Table.to_pylist）を経由せずに列ごとに変換し、
+辞書エンコードの列は同じ値の文字列オブジェクトを全行で共有する（工場名を行数分コピーしない）。
+
+pyarrowは任意の依存なので、使うときだけimportする。
+"""
+
+import math
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from .chunking import Chunk
+
+CHUNK_COLUMNS = ["chunk_id", "doc_id", "chunk_index", "text", "metadata"]
+PARQUET_SUFFIXES = (".parquet", ".pq")
+
+
+def _pa():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError(
+            "Parquet形式を使うにはpyarrowが必要です: pip install 'rag-core[parquet]'"
+        ) from e
+    return pa, pq
+
+
+def is_parquet(path) -> bool:
+    return Path(path).suffix in PARQUET_SUFFIXES
+
+
+def _column(values: List[Any]):
+    """1列分の配列を作る。NaNは欠損扱いにして、文字列は辞書エンコードする"""
+    pa, _ = _pa()
+    values = [None if isinstance(v, float) and math.isnan(v) else v for v in values]
+    array = pa.array(values)
+    if pa.types.is_string(array.type) or pa.types.is_large_string(array.type):
+        array = array.dictionary_encode()
+    return array
+
+
+def _without_null_types(schema):
+    """
+    null型（ブロック内で全部欠損していた列）を辞書エンコードした文字列型にする
+
+    ParquetWriterのスキーマは最初のブロックで決まるので、null型のまま開くと
+    後のブロックの値がcastで全部Noneになってしまう。欠損の多い列はほとんどが文字列の列。
+    """
+    pa, _ = _pa()
+
+    def fix(data_type):
+        if pa.types.is_null(data_type):
+            return pa.dictionary(pa.int32(), pa.string())
+        if pa.types.is_struct(data_type):
+            return pa.struct([field.with_type(fix(field.type)) for field in data_type])
+        return data_type
+
+    return pa.schema([field.with_type(fix(field.type)) for field in schema], metadata=schema.metadata)
+
+
+def chunks_to_table(chunks: Sequence[Chunk], schema=None):
+    """チャンクのリストをArrowのテーブルにする。schemaを渡すとそれに揃える"""
+    pa, _ = _pa()
+
+    meta_keys: Dict[str, None] = {}
+    for chunk in chunks:
+        for key in chunk.metadata:
+            meta_keys.setdefault(key, None)
+    meta_columns = {key: [] for key in meta_keys}
+    for chunk in chunks:
+        for key in meta_keys:
+            meta_columns[key].append(chunk.metadata.get(key))
+
+    if meta_columns:
+        metadata = pa.StructArray.from_arrays(
+            [_column(values) for values in meta_columns.values()],
+            names=list(meta_columns)
+        )
+    else:
+        metadata = pa.array([{}] * len(chunks), type=pa.struct([]))
+
+    table = pa.table({
+        "chunk_id": pa.array([c.chunk_id for c in chunks], type=pa.string()),
+        "doc_id": pa.array([c.doc_id for c in chunks], type=pa.string()).dictionary_encode(),
+        "chunk_index": pa.array([c.chunk_index for c in chunks], type=pa.int32()),
+        "text": pa.array([c.text for c in chunks], type=pa.string()),
+        "metadata": metadata,
+    })
+    if schema is not None:
+        table = table.cast(schema)
+    return table
+
+
+def _column_to_pylist(column) -> List[Any]:
+    """1列をPythonのリストにする。辞書エンコードの列は辞書の値を使い回す"""
+    pa, _ = _pa()
+    chunks = column.chunks if isinstance(column, pa.ChunkedArray) else [column]
+    values: List[Any] = []
+    for chunk in chunks:
+        if pa.types.is_dictionary(chunk.type):
+            dictionary = chunk.dictionary.to_pylist()
+            values.extend(None if i is None else dictionary[i] for i in chunk.indices.to_pylist())
+        else:
+            values.extend(chunk.to_pylist())
+    return values
+
+
+def _struct_to_dicts(column) -> List[Dict[str, Any]]:
+    """構造体の列を行ごとの辞書にする（構造体そのものが欠損なら空の辞書）"""
+    pa, _ = _pa()
+    chunks = column.chunks if isinstance(column, pa.ChunkedArray) else [column]
+    rows: List[Dict[str, Any]] = []
+    for chunk in chunks:
+        names = [field.name for field in chunk.type]
+        fields = [_column_to_pylist(chunk.field(i)) for i in range(len(names))]
+        valid = chunk.is_valid().to_pylist() if chunk.null_count else [True] * len(chunk)
+        rows.extend(
+            dict(zip(names, values)) if ok else {}
+            for ok, values in zip(valid, zip(*fields) if fields else ([()] * len(chunk)))
+        )
+    return rows
+
+
+def table_to_dicts(table) -> List[Dict[str, Any]]:
+    """Arrowのテーブルを Chunk.to_dict() と同じ形の辞書のリストにする（metadata列がなければ空の辞書）"""
+    if "metadata" in table.column_names:
+        metadata = _struct_to_dicts(table.column("metadata"))
+    else:
+        metadata = [{} for _ in range(table.num_rows)]
+    return [
+        {"chunk_id": chunk_id, "text": text, "metadata": meta, "chunk_index": chunk_index, "doc_id": doc_id}
+        for chunk_id, text, meta, chunk_index, doc_id in zip(
+            _column_to_pylist(table.column("chunk_id")),
+            _column_to_pylist(table.column("text")),
+            metadata,
+            _column_to_pylist(table.column("chunk_index")),
+            _column_to_pylist(table.column("doc_id")),
+        )
+    ]
+
+
+def table_to_chunks(table) -> List[Chunk]:
+    """Arrowのテーブルからチャンクに戻す"""
+    return [Chunk(**data) for data in table_to_dicts(table)]
+
+
+def write_chunks_parquet(chunks: Sequence[Chunk], filepath: Path):
+    """チャンクをParquetで保存"""
+    _, pq = _pa()
+    pq.write_table(chunks_to_table(chunks), filepath, compression="zstd")
+
+
+class ChunkParquetWriter:
+    """
+    ブロックごとにParquetへ追記する（前処理のストリーミング用）
+
+    スキーマは最初のブロックで決めて、以降のブロックはそれに揃える
+    （あるブロックで列が全部欠損していてもnull型にならないように）。
+    最初のブロックで全部欠損していた列は、null型でなく文字列型として開く。
+    """
+
+    def __init__(self, filepath: Path):
+        self.filepath = Path(filepath)
+        self._writer = None
+
+    def write_table(self, table):
+        _, pq = _pa()
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self.filepath, _without_null_types(table.schema), compression="zstd")
+        if table.schema != self._writer.schema:
+            table = table.cast(self._writer.schema)
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+def read_chunks_table(filepath: Path, columns: Optional[List[str]] = None):
+    """
+    Parquetを読む。columnsを指定するとその列だけ読む（例: ["text"]）
+
+    "metadata.line" のように書くと、metadata列はその項目だけの構造体になる。
+    """
+    pa, pq = _pa()
+    parquet_file = pq.ParquetFile(filepath)
+    tables = list(_iter_row_groups(parquet_file, columns))
+    if not tables:
+        return parquet_file.read(columns=columns)
+    return pa.concat_tables(tables)
+
+
+def _iter_row_groups(parquet_file, columns: Optional[List[str]] = None):
+    """
+    row groupを1つずつテーブルで読む
+
+    構造体の中に辞書エンコードの列があると、row groupをまたぐ読み方
+    （ParquetFile.read / iter_batches）は "Nested data conversions not implemented" で落ちる。
+    row group単位なら読めるので、つなぐのはこちらでやる。
+    """
+    for i in range(parquet_file.num_row_groups):
+        yield parquet_file.read_row_group(i, columns=columns)
+
+
+def _projection(filepath: Path, metadata_fields: Optional[List[str]] = None) -> List[str]:
+    """インデックス構築で読む列（metadata_fieldsがNoneならメタデータは全項目）"""
+    if metadata_fields is None:
+        return CHUNK_COLUMNS
+    _, pq = _pa()
+    available = set(pq.read_schema(filepath).field("metadata").type.names)
+    columns = [column for column in CHUNK_COLUMNS if column != "metadata"]
+    return columns + [f"metadata.{field}" for field in metadata_fields if field in available]
+
+
+def load_chunks_parquet(filepath: Path) -> List[Chunk]:
+    return table_to_chunks(read_chunks_table(filepath, columns=CHUNK_COLUMNS))
+
+
+def load_chunk_dicts_parquet(filepath: Path, metadata_fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """
+    チャンクをChunkにせず、Chunk.to_dict()の形で読む（インデックス構築用）
+
+    metadata_fieldsを渡すと、メタデータはその項目だけ読む（ファイルにない項目は飛ばす）。
+    """
+    return table_to_dicts(read_chunks_table(filepath, columns=_projection(filepath, metadata_fields)))
+
+
+def iter_chunk_batches_parquet(
+    filepath: Path,
+    batch_size: int,
+    skip: int = 0,
+    metadata_fields: Optional[List[str]] = None
+) -> Iterator[List[Chunk]]:
+    """row groupごとに読みながらbatch_size件ずつ返す。skip件目までは読み飛ばす"""
+    pa, pq = _pa()
+    parquet_file = pq.ParquetFile(filepath)
+    seen = 0
+    columns = _projection(filepath, metadata_fields)
+    batches = (
+        batch
+        for table in _iter_row_groups(parquet_file, columns)
+        for batch in table.to_batches(max_chunksize=batch_size)
+    )
+    for batch in batches:
+        if seen + batch.num_rows <= skip:
+            seen += batch.num_rows
+            continue
+        offset = max(0, skip - seen)
+        seen += batch.num_rows
+        yield table_to_chunks(pa.Table.from_batches([batch.slice(offset)]))
+
+
+def iter_texts_parquet(filepath: Path, batch_size: int = 65536) -> Iterator[str]:
+    """textの列だけを読みながら1件ずつ返す"""
+    _, pq = _pa()
+    for batch in pq.ParquetFile(filepath).iter_batches(batch_size=batch_size, columns=["text"]):
+        yield from batch.column(0).to_pylist()
+
+
+def count_chunks_parquet(filepath: Path) -> int:
+    """件数はフッターに入っているので、データは読まない"""
+    _, pq = _pa()
+    return pq.ParquetFile(filepath).metadata.num_rows
@@ -14,6 +14,8 @@ DEFAULT_CONFIG = {
     "project": {"name": "kairag-portfolio"},
     "data": {
         "index_path": "data/indices",
+        # 埋め込みのキャッシュ（再構築で変わったチャンクだけエンコードする）
+        "embedding_store_path": "data/embedding_store",
     },
     "embedding": {
         # 多言語対応のモデル。日本語もそこそこいける
@@ -22,7 +24,24 @@ DEFAULT_CONFIG = {
         "normalize_embeddings": True
     },
     "indexing": {
-        "index_type": "Flat"  # 1万件件程度ならFlatで十分
+        "index_type": "Flat",  # 1万件件程度ならFlatで十分
+        # IVF/PQなど学習が要るタイプを学習させる件数（ストリーミング構築では全体から均等に抜き出す）
+        "train_sample_size": 65536,
+        # 差分更新のセグメントがこの数を超えたらベースにマージする
+        "max_segments": 8,
+        # インデックスのメタデータに入れる項目（Noneなら全部）。
+        # 検索や表示に使わない長い列を外すと、構築時のメモリとメタデータのファイルが小さくなる
+        # （Parquetならその列を読みもしない）
+        "metadata_fields": None,
+        # ほぼ同じチャンクをまとめて代表だけをインデックスに入れる（dedup.py参照）
+        "dedup": {
+            "enabled": True,
+            # 文字3-gramのJaccard係数がこれ以上ならまとめる
+            "threshold": 0.7,
+            "num_perm": 128,
+            # この項目が違うチャンクはまとめない（号機=equipment3と日付は違ってもまとめる）
+            "group_by": ["location", "line", "category", "work_type", "equipment1", "equipment2"]
+        }
     },
     "retrieval": {
         "enable_hybrid_search": True,
@@ -33,7 +52,23 @@ DEFAULT_CONFIG = {
         # 多言語対応のCross-Encoder
         "reranker_model": "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1",
         "rerank_batch_size": 32,
-        "rerank_candidates": 10
+        "rerank_candidates": 10,
+        # クエリの埋め込みと (クエリ, 文書) のリランクスコアのキャッシュ件数。0でキャッシュしない
+        "query_cache_size": 2048,
+        "rerank_cache_size": 50000,
+        # エラーコードだけのクエリはコードの完全一致とBM25で返す（DenseとRerankを通さない）
+        "enable_code_search": True,
+        # クエリの文字のうちこの割合以上がコードならコードだけのクエリとみなす（code_index.py参照）
+        "code_query_ratio": 0.6,
+        # コードだけのクエリで返す候補の数（ファセットのmatchedもこの中で数える）
+        "code_top_k": 50
+    },
+    "suggest": {
+        # 入力補完に入れる単語の数と、最低何チャンクに出てくればいいか
+        "max_terms": 50000,
+        "min_term_count": 2,
+        # 単語を数えるときにMeCabにかけるチャンク数の上限（多ければ間引く）
+        "sample_chunks": 20000
     }
 }
 
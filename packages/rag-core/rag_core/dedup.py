@@ -0,0 +1,249 @@
+"""
+ほぼ同じチャンクの検出とまとめ（MinHash + LSH）
+
+保全記録は「定期点検項目への追加」のようなコピペの処置や、同じ故障の二重起票が多い。
+そのまま入れるとFAISSとBM25が大きくなるうえに、上位k件が同じ内容で埋まってしまう。
+
+インデックス構築時に、文字3-gramのJaccard係数がthreshold以上のチャンクをまとめて、
+代表（最初に出てきたもの）だけをインデックスに入れる。
+- 代表のチャンクには duplicates（まとめたチャンクのchunk_idのリスト）を付ける
+- まとめたチャンクは別のファイル（maintenance.duplicates.json）に representative 付きで書く
+
+代表と比べて似ているかを見るので、A≒B、B≒C でも A と C が似ていなければ別の代表になる
+（union-findのように数珠つなぎで大きな塊にはならない）。
+group_byに指定した項目が違うチャンクと、本文のエラーコード（code_index.py）が違うチャンクはまとめない
+（E-482とE-428だけが違う記録をまとめると、コードの完全一致で片方が引けなくなる）。
+
+検索時はDuplicateGroupsで代表 → まとめたチャンクを引く（表示するときに展開する）。
+"""
+
+import json
+import logging
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .code_index import extract_codes
+from .text import normalize_text
+
+logger = logging.getLogger(__name__)
+
+_MAX_HASH = np.uint32((1 << 32) - 1)
+_MASK_32 = np.uint64((1 << 32) - 1)
+_SHINGLE_BASE = np.uint64(1_000_003)
+
+
+def shingles(text: str, size: int = 3) -> np.ndarray:
+    """
+    正規化したテキストの文字size-gramのハッシュ（32bit）
+
+    1文字ずつPythonで回すと遅いので、コードポイントの配列にして多項式ハッシュをまとめて計算する。
+    同じgramが何度出てきても最小値は変わらないので、重複は取り除かない。
+    """
+    codes = np.frombuffer(normalize_text(text).encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    if len(codes) == 0:
+        return codes
+    if len(codes) < size:
+        size = len(codes)
+    hashes = np.zeros(len(codes) - size + 1, dtype=np.uint64)
+    for i in range(size):
+        hashes = (hashes * _SHINGLE_BASE + codes[i:len(codes) - size + 1 + i]) & _MASK_32
+    return hashes
+
+
+def lsh_params(threshold: float, num_perm: int) -> Tuple[int, int]:
+    """
+    バンド数とバンドあたりの行数を決める
+
+    類似度がthresholdの前後で、見逃し（false negative）と
+    余計な候補（false positive）の面積の和が一番小さくなる組み合わせにする。
+    """
+    x = np.linspace(0.0, 1.0, 201)
+    best = (num_perm, 1)
+    best_error = float("inf")
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        # バンドのどれか1つが一致する確率
+        p = 1.0 - (1.0 - x ** rows) ** bands
+        # xは[0, 1]の等間隔なので、平均がそのまま面積になる
+        false_positive = np.where(x < threshold, p, 0.0).mean()
+        false_negative = np.where(x >= threshold, 1.0 - p, 0.0).mean()
+        error = false_positive + false_negative
+        if error < best_error:
+            best, best_error = (bands, rows), error
+    return best
+
+
+class MinHasher:
+    """
+    MinHashの署名を作る（num_perm個のハッシュ関数の最小値）
+
+    ハッシュ関数は multiply-shift（(a * x + b) mod 2^64 の上位32bit）。
+    素数で割る方式より速い（uint64の掛け算は桁あふれしてもそのまま2^64で回る）。
+    """
+
+    def __init__(self, num_perm: int = 128, seed: int = 1, shingle_size: int = 3):
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        # aは奇数
+        self.a = rng.randint(0, 1 << 62, size=num_perm, dtype=np.int64).astype(np.uint64) * np.uint64(2) + np.uint64(1)
+        self.b = rng.randint(0, 1 << 62, size=num_perm, dtype=np.int64).astype(np.uint64)
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = shingles(text, self.shingle_size)
+        if len(hashes) == 0:
+            return np.full(self.num_perm, _MAX_HASH, dtype=np.uint32)
+        permuted = (hashes[:, None] * self.a + self.b) >> np.uint64(32)
+        return permuted.min(axis=0).astype(np.uint32)
+
+
+class NearDuplicateClusterer:
+    """
+    チャンクを順に入れていって、似ている代表があればそこにまとめる
+
+    LSHのバケットには代表だけを入れる。候補は署名の一致率（Jaccard係数の推定値）で確かめる。
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.8,
+        num_perm: int = 128,
+        group_by: Sequence[str] = (),
+        seed: int = 1,
+    ):
+        self.threshold = threshold
+        self.group_by = list(group_by)
+        self.hasher = MinHasher(num_perm=num_perm, seed=seed)
+        self.bands, self.rows = lsh_params(threshold, num_perm)
+        self._buckets: Dict[Tuple[Any, ...], List[int]] = {}
+        self._signatures: Dict[int, np.ndarray] = {}
+
+    def _group(self, item: Dict[str, Any]) -> Tuple[Any, ...]:
+        meta = item.get('metadata', {})
+        codes = tuple(sorted(extract_codes(item.get('text'))))
+        return tuple(meta.get(key) for key in self.group_by) + (codes,)
+
+    def add(self, row: int, item: Dict[str, Any]) -> Optional[int]:
+        """rowを入れる。似ている代表があればその行番号、なければNone（rowが新しい代表になる）"""
+        signature = self.hasher.signature(item.get('text', ''))
+        group = self._group(item)
+        keys = [
+            (group, band, signature[band * self.rows:(band + 1) * self.rows].tobytes())
+            for band in range(self.bands)
+        ]
+
+        best_row, best_similarity = None, self.threshold
+        checked = set()
+        for key in keys:
+            for candidate in self._buckets.get(key, ()):
+                if candidate in checked:
+                    continue
+                checked.add(candidate)
+                similarity = float(np.mean(self._signatures[candidate] == signature))
+                if similarity >= best_similarity:
+                    best_row, best_similarity = candidate, similarity
+        if best_row is not None:
+            return best_row
+
+        self._signatures[row] = signature
+        for key in keys:
+            self._buckets.setdefault(key, []).append(row)
+        return None
+
+
+def deduplicate(
+    items: List[Dict[str, Any]],
+    threshold: float = 0.8,
+    num_perm: int = 128,
+    group_by: Sequence[str] = (),
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    チャンク（to_dict()の形）を代表とまとめたチャンクに分ける
+
+    返すのは (インデックスに入れるチャンク, まとめたチャンク)。並びは元の順番のまま。
+    代表には duplicates、まとめたチャンクには representative（代表のchunk_id）を付ける。
+    """
+    clusterer = NearDuplicateClusterer(threshold=threshold, num_perm=num_perm, group_by=group_by)
+    representative_of: Dict[int, int] = {}
+    for row, item in enumerate(items):
+        rep = clusterer.add(row, item)
+        if rep is not None:
+            representative_of[row] = rep
+
+    members: Dict[int, List[str]] = {}
+    duplicates: List[Dict[str, Any]] = []
+    for row, rep in representative_of.items():
+        members.setdefault(rep, []).append(items[row]['chunk_id'])
+        duplicates.append({**items[row], 'representative': items[rep]['chunk_id']})
+
+    indexed = []
+    for row, item in enumerate(items):
+        if row in representative_of:
+            continue
+        indexed.append({**item, 'duplicates': members[row]} if row in members else item)
+
+    logger.info(
+        f"ほぼ同じチャンクをまとめました: {len(items)}件 → {len(indexed)}件 "
+        f"({len(members)}グループ, threshold={threshold}, bands={clusterer.bands}x{clusterer.rows})"
+    )
+    return indexed, duplicates
+
+
+def save_duplicates(path: Path, duplicates: List[Dict[str, Any]]):
+    """まとめたチャンクを書く（差分更新の世代はハードリンクなので、上書きせずに差し替える）"""
+    path = Path(path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(duplicates, f, ensure_ascii=False, separators=(',', ':'))
+    tmp_path.replace(path)
+
+
+class DuplicateGroups:
+    """
+    代表のchunk_id → まとめたチャンク
+
+    重複をまとめずに作ったインデックス（ファイルがない）なら空。
+    代表の数は少ないので、代表のチャンクもchunk_idで引けるようにしておく。
+    """
+
+    def __init__(
+        self,
+        duplicates: Iterable[Dict[str, Any]] = (),
+        indexed: Iterable[Dict[str, Any]] = (),
+    ):
+        self.chunks: List[Dict[str, Any]] = list(duplicates)
+        self._members: Dict[str, List[Dict[str, Any]]] = {}
+        for chunk in self.chunks:
+            self._members.setdefault(chunk['representative'], []).append(chunk)
+        self._representatives: Dict[str, Dict[str, Any]] = {
+            item['chunk_id']: item for item in indexed if item.get('chunk_id') in self._members
+        }
+
+    @classmethod
+    def load(cls, path: Path, indexed: Iterable[Dict[str, Any]] = ()) -> "DuplicateGroups":
+        """ファイルから読む。indexedはインデックスに入っているチャンク（代表を探すため）"""
+        path = Path(path)
+        if not path.exists():
+            return cls()
+        with open(path, 'r', encoding='utf-8') as f:
+            groups = cls(json.load(f), indexed)
+        logger.info(f"まとめたチャンクを読み込みました: {len(groups.chunks)}件")
+        return groups
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def members(self, chunk_id: str) -> List[Dict[str, Any]]:
+        """代表にまとめたチャンク（代表でなければ空）"""
+        return self._members.get(chunk_id, [])
+
+    def group(self, chunk: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """chunkと同じグループのチャンク（代表が先頭。chunk自身も含む）"""
+        rep_id = chunk.get('representative') or chunk.get('chunk_id')
+        members = self._members.get(rep_id)
+        if not members:
+            return [chunk]
+        representative = self._representatives.get(rep_id)
+        return ([representative] if representative else []) + members
@@ -3,29 +3,42 @@ FAISSインデックスの管理
 
 ベクトル検索用。500件程度ならFlatインデックスで十分速い。
 数万件になったらIVFとか検討する必要あるかも。
+
+差分更新はセグメント方式（segments.py参照）。
+追加分は小さなFlatインデックスとして別ファイルに持って、ベースと一緒に検索する。
 """
 
 import faiss
 import numpy as np
 import json
 import logging
+import threading
 from pathlib import Path
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Iterable, Tuple
 from .config import settings
+from .segments import SegmentInfo, SegmentLog, find_rows, merged_path, remove_files
 
 logger = logging.getLogger(__name__)
 
 class FaissIndexManager:
     """FAISSインデックスの構築・保存・検索"""
 
-    def __init__(self, index_path: str, metadata_path: str):
+    def __init__(self, index_path: str, metadata_path: str, autoload: bool = True):
         self.index_path = Path(index_path)
         self.metadata_path = Path(metadata_path)
         self.index: faiss.Index | None = None
         self.metadata: List[Dict[str, Any]] = []
 
+        # 差分更新用のセグメント（ベースの後ろに通しの行番号で続く）
+        self.segment_log = SegmentLog.for_index(self.index_path)
+        self.segment_indices: List[faiss.Index] = []
+        # _lockは検索側が参照をまとめて取るためのロック
+        # _write_lockは追加・削除・マージを直列にするためのロック
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
         # ファイルがあれば読み込む
-        if self.index_path.exists() and self.metadata_path.exists():
+        if autoload and self.index_path.exists() and self.metadata_path.exists():
             self.load()
 
     def build(self, embeddings: np.ndarray):
@@ -33,41 +46,238 @@ class FaissIndexManager:
         if not isinstance(embeddings, np.ndarray) or embeddings.ndim != 2:
             raise ValueError("Embeddings must be a 2D numpy array.")
 
-        dimension = embeddings.shape[1]
+        self.create(embeddings.shape[1])
+        self.train(embeddings)
+        self.add_batch(embeddings)
+
+    def create(self, dimension: int):
+        """空のインデックスを作る（ストリーミング構築ではこの後add_batchで少しずつ足す）"""
         index_type = settings["indexing"]["index_type"].strip()
-        
+
         logger.info(f"FAISSインデックスを構築中: {index_type}, 次元数: {dimension}")
-        
+
         self.index = faiss.index_factory(dimension, index_type)
 
+        # 全件構築したらセグメントは不要
+        self._remove_segment_files(self.segment_log.segments)
+        self.segment_indices = []
+        self.segment_log.clear()
+
+    @property
+    def needs_training(self) -> bool:
+        """IVF/PQなど、追加する前に学習が要るか"""
+        return self.index is not None and not self.index.is_trained
+
+    def train(self, embeddings: np.ndarray):
+        """
+        学習が要るタイプ（IVF/PQ）なら学習する。Flatなら何もしない
+
+        渡すのはコーパス全体から抜き出したサンプル（最初のバッチだけだと偏るし、nlistより少ないと学習できない）。
+        """
+        if self.index is None:
+            raise RuntimeError("Index not built.")
+        if self.index.is_trained:
+            return
+
+        sample = embeddings.astype(np.float32)
+        if settings["embedding"]["normalize_embeddings"]:
+            faiss.normalize_L2(sample)
+        logger.info(f"FAISSインデックスを学習中: {len(sample)}件")
+        self.index.train(sample)
+
+    def add_batch(self, embeddings: np.ndarray):
+        """ベクトルをインデックスに追加（学習が要るタイプは先にtrainしておく）"""
+        if self.index is None:
+            raise RuntimeError("Index not built.")
+        if not self.index.is_trained:
+            raise RuntimeError("Index must be trained before adding vectors (call train first).")
+
+        embeddings = embeddings.astype(np.float32)
+
         # コサイン類似度を使うために正規化
         if settings["embedding"]["normalize_embeddings"]:
             faiss.normalize_L2(embeddings)
 
-        assert self.index is not None
-        self.index.add(embeddings.astype(np.float32))
+        self.index.add(embeddings)
 
-    def save(self, metadata: List[Dict[str, Any]]):
-        """インデックスとメタデータを保存"""
+    def save_index(self):
+        """インデックスだけ保存（メタデータは別に書く場合）"""
         if self.index is None:
             raise RuntimeError("Index not built.")
 
         self.index_path.parent.mkdir(parents=True, exist_ok=True)
         faiss.write_index(self.index, str(self.index_path))
-        
+
+    def save(self, metadata: List[Dict[str, Any]]):
+        """インデックスとメタデータを保存"""
+        self.save_index()
+
+        # インデントを付けると数百万件でファイルが倍近くになるのでコンパクトに書く
         with open(self.metadata_path, 'w', encoding='utf-8') as f:
-            json.dump(metadata, f, ensure_ascii=False, indent=2)
-            
+            json.dump(metadata, f, ensure_ascii=False, separators=(',', ':'))
+
         self.metadata = metadata
 
     def load(self):
         """インデックス読み込み"""
         logger.info(f"FAISSインデックスを読み込み中: {self.index_path}")
         self.index = faiss.read_index(str(self.index_path))
-        
+
         with open(self.metadata_path, 'r', encoding='utf-8') as f:
             self.metadata = json.load(f)
 
+        # セグメントがあればベースの後ろに繋げる
+        self.segment_indices = []
+        for segment in self.segment_log.segments:
+            seg_path = self.segment_log.segment_path(self.index_path, segment.name)
+            self.segment_indices.append(faiss.read_index(str(seg_path)))
+            with open(f"{seg_path}.meta.json", 'r', encoding='utf-8') as f:
+                self.metadata.extend(json.load(f))
+        if self.segment_log.segments:
+            logger.info(
+                f"FAISSセグメントを読み込みました: {len(self.segment_log.segments)}個, "
+                f"tombstone {len(self.segment_log.tombstones)}件"
+            )
+
+    def unload(self):
+        """メモリを解放する（ホットリロードで古い世代を捨てるとき用）"""
+        with self._lock:
+            self.index = None
+            self.segment_indices = []
+            self.metadata = []
+
+    @property
+    def tombstones(self):
+        return self.segment_log.tombstones
+
+    def live_metadata(self) -> List[Dict[str, Any]]:
+        """削除済み（tombstone）の行を除いたメタデータ"""
+        if not self.segment_log.tombstones:
+            return self.metadata
+        return [m for i, m in enumerate(self.metadata) if i not in self.segment_log.tombstones]
+
+    def add_segment(self, embeddings: np.ndarray, metadata: List[Dict[str, Any]]) -> str:
+        """
+        追加分を新しいセグメントとして書き出す
+
+        ベースは触らないので、追加する件数分の時間しかかからない。
+        """
+        if self.index is None:
+            raise RuntimeError("Index not built.")
+        if embeddings.ndim != 2 or len(embeddings) != len(metadata):
+            raise ValueError("Embeddings and metadata must have the same length.")
+
+        embeddings = embeddings.astype(np.float32)
+        if settings["embedding"]["normalize_embeddings"]:
+            faiss.normalize_L2(embeddings)
+
+        # セグメントは件数が少ないので常にFlat（厳密検索）
+        segment_index = faiss.IndexFlat(self.index.d, self.index.metric_type)
+        segment_index.add(embeddings)
+
+        with self._write_lock:
+            name = self.segment_log.new_segment_name()
+            seg_path = self.segment_log.segment_path(self.index_path, name)
+            faiss.write_index(segment_index, str(seg_path))
+            with open(f"{seg_path}.meta.json", 'w', encoding='utf-8') as f:
+                json.dump(metadata, f, ensure_ascii=False, separators=(',', ':'))
+
+            with self._lock:
+                self.segment_indices.append(segment_index)
+                self.metadata = self.metadata + metadata
+                self.segment_log.segments.append(SegmentInfo(name=name, count=len(metadata)))
+                self.segment_log.save()
+
+        logger.info(f"FAISSセグメントを追加しました: {name} ({len(metadata)}件)")
+        return name
+
+    def delete(self, chunk_ids: Iterable[str] = (), doc_ids: Iterable[str] = ()) -> int:
+        """tombstoneを付けて検索結果から外す。実際に消えるのはマージ時"""
+        with self._write_lock:
+            rows = find_rows(self.metadata, self.segment_log.tombstones, chunk_ids, doc_ids)
+            if rows:
+                with self._lock:
+                    self.segment_log.tombstones = self.segment_log.tombstones | set(rows)
+                    self.segment_log.save()
+        return len(rows)
+
+    def merge_segments(self) -> List[Path]:
+        """
+        ベースとセグメントを1つのインデックスにまとめ直す（コンパクション）
+
+        ベクトルはインデックスから復元するので再埋め込みは不要。
+        新しいインデックスを作ってから差し替えるので、その間も検索できる。
+
+        まとめたものは新しいファイル名（segments.merged_path）で書いて、今のファイルには触らない。
+        公開はmanifestのファイル名をindex_path / metadata_pathに書き換えた時点（segments.py参照）。
+        戻り値は要らなくなった古いファイル。manifestを書いてから消す。
+        """
+        if self.index is None:
+            raise RuntimeError("Index not built.")
+
+        with self._write_lock:
+            if self.segment_log.is_empty:
+                return []
+
+            indices = [self.index] + self.segment_indices
+            metadata = self.metadata
+            tombstones = self.segment_log.tombstones
+            old_segments = list(self.segment_log.segments)
+
+            vectors = np.vstack([_reconstruct_all(index) for index in indices])
+            live_rows = [i for i in range(len(metadata)) if i not in tombstones]
+            live_vectors = np.ascontiguousarray(vectors[live_rows], dtype=np.float32)
+            live_metadata = [metadata[i] for i in live_rows]
+
+            # 読み込んだベースと同じ種類で作り直す（設定のindex_typeが変わっていても変えない）。
+            # IVF/PQは学習済みの状態ごと複製するので、学習し直さない。ベクトルは正規化済み
+            merged = faiss.clone_index(self.index)
+            merged.reset()
+            if not merged.is_trained:
+                merged.train(live_vectors)
+            merged.add(live_vectors)
+
+            index_path = merged_path(self.index_path)
+            metadata_path = index_path.with_name(f"{index_path.name}.meta{self.metadata_path.suffix}")
+            tmp_path = index_path.with_name(index_path.name + ".tmp")
+            faiss.write_index(merged, str(tmp_path))
+            tmp_path.replace(index_path)
+            tmp_meta_path = metadata_path.with_name(metadata_path.name + ".tmp")
+            with open(tmp_meta_path, 'w', encoding='utf-8') as f:
+                json.dump(live_metadata, f, ensure_ascii=False, separators=(',', ':'))
+            tmp_meta_path.replace(metadata_path)
+
+            superseded = [self.index_path, self.metadata_path, self.segment_log.path]
+            superseded += self._segment_files(old_segments)
+            with self._lock:
+                self.index = merged
+                self.metadata = live_metadata
+                self.segment_indices = []
+                self.index_path = index_path
+                self.metadata_path = metadata_path
+                self.segment_log = SegmentLog.for_index(index_path)
+
+        logger.info(
+            f"FAISSセグメントをマージしました: {len(old_segments)}個 → {len(live_metadata)}件 ({index_path.name})"
+        )
+        return superseded
+
+    def _segment_files(self, segments: List[SegmentInfo]) -> List[Path]:
+        files = []
+        for segment in segments:
+            seg_path = self.segment_log.segment_path(self.index_path, segment.name)
+            files += [seg_path, Path(f"{seg_path}.meta.json")]
+        return files
+
+    def _remove_segment_files(self, segments: List[SegmentInfo]):
+        remove_files(self._segment_files(segments))
+
+    def start_background_merge(self) -> threading.Thread:
+        """マージを別スレッドで実行する"""
+        thread = threading.Thread(target=self.merge_segments, name="faiss-merge", daemon=True)
+        thread.start()
+        return thread
+
     def search(self, query_vector: np.ndarray, top_k: int) -> List[Tuple[Dict[str, Any], float]]:
         """検索実行"""
         if self.index is None:
@@ -81,12 +291,85 @@ class FaissIndexManager:
         if settings["embedding"]["normalize_embeddings"]:
             faiss.normalize_L2(query_vector.astype(np.float32))
 
-        distances, indices = self.index.search(query_vector.astype(np.float32), top_k)
-        
-        results = []
-        for i in range(len(indices[0])):
-            idx = indices[0][i]
-            if idx != -1 and idx < len(self.metadata):
-                results.append((self.metadata[idx], float(distances[0][i])))
-        
-        return results
+        with self._lock:
+            indices = [self.index] + self.segment_indices
+            metadata = self.metadata
+            tombstones = self.segment_log.tombstones
+
+        # セグメントもtombstoneもなければ今まで通り
+        if len(indices) == 1 and not tombstones:
+            distances, ids = self.index.search(query_vector.astype(np.float32), top_k)
+            results = []
+            for i in range(len(ids[0])):
+                idx = ids[0][i]
+                if idx != -1 and idx < len(metadata):
+                    results.append((metadata[idx], float(distances[0][i])))
+            return results
+
+        # 各インデックスを検索して、通しの行番号に直してからまとめる
+        # tombstoneで消える分だけ多めに取っておく
+        candidates: List[Tuple[float, int]] = []
+        offset = 0
+        for index in indices:
+            n_dead = sum(1 for row in tombstones if offset <= row < offset + index.ntotal)
+            k = min(top_k + n_dead, index.ntotal)
+            if k > 0:
+                distances, ids = index.search(query_vector.astype(np.float32), k)
+                for dist, idx in zip(distances[0], ids[0]):
+                    row = offset + int(idx)
+                    if idx != -1 and row not in tombstones:
+                        candidates.append((float(dist), row))
+            offset += index.ntotal
+
+        # L2は小さい方が近い、内積は大きい方が近い
+        descending = self.index.metric_type == faiss.METRIC_INNER_PRODUCT
+        candidates.sort(key=lambda x: x[0], reverse=descending)
+
+        return [(metadata[row], dist) for dist, row in candidates[:top_k] if row < len(metadata)]
+
+
+def _reconstruct_all(index: faiss.Index) -> np.ndarray:
+    """全ベクトルを復元する。IVFは行番号 → リストの対応（direct map）がないと復元できないので作る"""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and ivf.direct_map.type == faiss.DirectMap.NoMap:
+        ivf.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
+class MetadataWriter:
+    """
+    メタデータ（JSON配列）を1件ずつ書き出す
+
+    全件をリストに溜めてからjson.dumpすると件数に比例してメモリを食うので、
+    ストリーミング構築ではこれで少しずつ書く。出力はjson.loadでそのまま読める。
+    tell()の位置まで切り詰めれば、途中から書き直せる（チェックポイント用）。
+    """
+
+    def __init__(self, path: Path, resume_offset: int | None = None):
+        self.path = Path(path)
+        self.count = 0
+        if resume_offset:
+            self._file = open(self.path, 'r+b')
+            self._file.truncate(resume_offset)
+            self._file.seek(resume_offset)
+            self._first = resume_offset <= 1  # '['しか書いてない
+        else:
+            self._file = open(self.path, 'wb')
+            self._file.write(b'[')
+            self._first = True
+
+    def write(self, items: Iterable[Dict[str, Any]]):
+        for item in items:
+            if not self._first:
+                self._file.write(b',\n')
+            self._file.write(json.dumps(item, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+            self._first = False
+            self.count += 1
+
+    def tell(self) -> int:
+        self._file.flush()
+        return self._file.tell()
+
+    def close(self):
+        self._file.write(b']')
+        self._file.close()
@@ -0,0 +1,80 @@
+"""
+doc_id → チャンクの行番号の索引
+
+詳細パネルを開くたびにメタデータを先頭から探していたので、読み込み時に1回だけ索引を作る。
+行番号を (doc_id, chunk_index) の順に並べた配列を持っておいて、
+doc_idごとにその配列の範囲 [start, end) を覚えておく。
+差分更新で同じ文書のチャンクが離れた行にあっても、範囲は1つにまとまる。
+"""
+
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# チャンクをつなげるときに重複とみなす最短の長さ（偶然の一致を拾わないため）
+MIN_OVERLAP = 8
+MAX_OVERLAP = 500
+
+
+def _doc_id_of(item: Dict[str, Any]) -> Optional[str]:
+    return item.get('doc_id') or item.get('metadata', {}).get('doc_id')
+
+
+class DocIndex:
+    """doc_idからチャンクを引く。検索時間は件数に依存しない"""
+
+    def __init__(self, metadata: List[Dict[str, Any]]):
+        self.metadata = metadata
+
+        rows_by_doc: Dict[str, List[int]] = {}
+        for row, item in enumerate(metadata):
+            doc_id = _doc_id_of(item)
+            if doc_id is not None:
+                rows_by_doc.setdefault(doc_id, []).append(row)
+
+        order: List[int] = []
+        self._ranges: Dict[str, Tuple[int, int]] = {}
+        for doc_id, rows in rows_by_doc.items():
+            if len(rows) > 1:
+                rows.sort(key=lambda row: metadata[row].get('chunk_index', 0))
+            self._ranges[doc_id] = (len(order), len(order) + len(rows))
+            order.extend(rows)
+        self._order = np.asarray(order, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self._ranges)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._ranges
+
+    def rows(self, doc_id: str) -> np.ndarray:
+        """文書のチャンクの行番号（chunk_index順）"""
+        start, end = self._ranges.get(doc_id, (0, 0))
+        return self._order[start:end]
+
+    def chunks(self, doc_id: str) -> List[Dict[str, Any]]:
+        """文書のチャンク（chunk_index順）。なければ空リスト"""
+        return [self.metadata[row] for row in self.rows(doc_id)]
+
+
+def merge_chunk_texts(texts: List[str]) -> str:
+    """
+    チャンクのテキストをつないで元の文書に戻す
+
+    チャンクの先頭には前のチャンクの末尾（オーバーラップ）が入っているので、
+    前のチャンクの末尾と一致する部分は1回だけにする。
+    """
+    if not texts:
+        return ""
+    merged = texts[0]
+    for text in texts[1:]:
+        overlap = 0
+        for size in range(min(len(merged), len(text), MAX_OVERLAP), MIN_OVERLAP - 1, -1):
+            if merged.endswith(text[:size]):
+                overlap = size
+                break
+        merged += text[overlap:]
+    return merged
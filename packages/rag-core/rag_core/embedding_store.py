@@ -0,0 +1,237 @@
+"""
+埋め込みベクトルのキャッシュ（コンテンツアドレス方式）
+
+夜間の再構築で毎回全チャンクをエンコードし直すのが一番重いけど、
+保守記録はほとんど変わらないので、(モデル名, 正規化したテキスト) のハッシュをキーにして
+一度計算したベクトルを取っておく。再構築では変わったチャンクだけエンコードすればいい。
+
+store_dir/
+├── store.json     # モデル名・次元数・件数（件数を書いた時点で確定）
+├── keys.bin       # 16バイトのハッシュを行番号順に並べたもの
+└── vectors.f32    # float32のベクトルを行番号順に並べたもの（memmapで読む）
+
+追記しかしないので、書き込み途中で落ちても store.json の件数より後ろを捨てれば元に戻る。
+モデルが変わったら中身を全部捨てて作り直す。
+
+再構築を繰り返すと消えたチャンクの分が溜まっていくので、compact() で
+今の構築に使ったチャンクの分だけを残して詰め直す（build_index.py --compact-embedding-store）。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from .text import normalize_text
+
+logger = logging.getLogger(__name__)
+
+KEY_SIZE = 16
+STORE_FILE = "store.json"
+KEYS_FILE = "keys.bin"
+VECTORS_FILE = "vectors.f32"
+
+# 詰め直すときに一度にコピーする行数
+COMPACT_BLOCK_ROWS = 65536
+
+def content_key(model_name: str, text: str) -> bytes:
+    """(モデル名, 正規化したテキスト) のハッシュ"""
+    h = hashlib.blake2b(digest_size=KEY_SIZE)
+    h.update(model_name.encode("utf-8"))
+    h.update(b"\0")
+    h.update(normalize_text(text).encode("utf-8"))
+    return h.digest()
+
+
+class EmbeddingStore:
+    """
+    ハッシュ → ベクトルの永続キャッシュ
+
+    get_or_encode() に渡したテキストのうち、ストアにないものだけをencode_fnでエンコードする。
+    """
+
+    def __init__(self, store_dir: str, model_name: str, dimension: int):
+        self.store_dir = Path(store_dir)
+        self.model_name = model_name
+        self.dimension = dimension
+        self.count = 0
+        self._rows: Dict[bytes, int] = {}
+        self._vectors: Optional[np.memmap] = None
+        self._lock = threading.Lock()
+
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        self._open()
+
+    @property
+    def _store_path(self) -> Path:
+        return self.store_dir / STORE_FILE
+
+    @property
+    def _keys_path(self) -> Path:
+        return self.store_dir / KEYS_FILE
+
+    @property
+    def _vectors_path(self) -> Path:
+        return self.store_dir / VECTORS_FILE
+
+    def _open(self):
+        info = {}
+        if self._store_path.exists():
+            with open(self._store_path, 'r', encoding='utf-8') as f:
+                info = json.load(f)
+
+        if info and (info.get("model_name") != self.model_name or info.get("dimension") != self.dimension):
+            logger.info(
+                f"埋め込みモデルが変わったのでストアを作り直します: "
+                f"{info.get('model_name')} → {self.model_name}"
+            )
+            info = {}
+
+        self.count = info.get("count", 0)
+        if not info:
+            # 新規 or 無効化。ファイルを空にしてから件数0を書く
+            for path in (self._keys_path, self._vectors_path):
+                path.unlink(missing_ok=True)
+            self._write_info()
+
+        # 確定していない末尾（書き込み途中で落ちた分）を捨てる
+        for path, size in ((self._keys_path, KEY_SIZE), (self._vectors_path, self.dimension * 4)):
+            with open(path, 'ab') as f:
+                f.truncate(self.count * size)
+
+        with open(self._keys_path, 'rb') as f:
+            keys = f.read()
+        self._rows = {keys[i * KEY_SIZE:(i + 1) * KEY_SIZE]: i for i in range(self.count)}
+        self._map_vectors()
+        logger.info(f"埋め込みストアを開きました: {self.store_dir} ({self.count}件)")
+
+    def _map_vectors(self):
+        if self.count:
+            self._vectors = np.memmap(
+                self._vectors_path, dtype=np.float32, mode='r', shape=(self.count, self.dimension)
+            )
+        else:
+            self._vectors = None
+
+    def _write_info(self):
+        tmp_path = self._store_path.with_name(STORE_FILE + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(
+                {"model_name": self.model_name, "dimension": self.dimension, "count": self.count},
+                f, ensure_ascii=False
+            )
+        os.replace(tmp_path, self._store_path)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, text: str) -> bool:
+        return content_key(self.model_name, text) in self._rows
+
+    def add(self, texts: List[str], vectors: np.ndarray):
+        """ベクトルを追記する。すでにあるキーは飛ばす"""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self._lock:
+            new_keys: List[bytes] = []
+            new_rows: List[int] = []
+            seen = set()
+            for i, text in enumerate(texts):
+                key = content_key(self.model_name, text)
+                if key in self._rows or key in seen:
+                    continue
+                seen.add(key)
+                new_keys.append(key)
+                new_rows.append(i)
+            if not new_keys:
+                return
+
+            # ベクトル → キー → 件数 の順に書く（件数を書くまでは未確定）
+            with open(self._vectors_path, 'ab') as f:
+                f.write(vectors[new_rows].tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            with open(self._keys_path, 'ab') as f:
+                f.write(b"".join(new_keys))
+                f.flush()
+                os.fsync(f.fileno())
+
+            for offset, key in enumerate(new_keys):
+                self._rows[key] = self.count + offset
+            self.count += len(new_keys)
+            self._write_info()
+            self._map_vectors()
+
+    def get_or_encode(
+        self,
+        texts: List[str],
+        encode_fn: Callable[[List[str]], np.ndarray]
+    ) -> np.ndarray:
+        """
+        ストアにあるものはそのまま使い、ないものだけencode_fnでエンコードする
+
+        同じテキストが複数回出てきても1回しかエンコードしない。
+        """
+        keys = [content_key(self.model_name, text) for text in texts]
+        missing: Dict[bytes, int] = {}
+        for i, key in enumerate(keys):
+            if key not in self._rows and key not in missing:
+                missing[key] = i
+
+        hits = len(texts) - sum(1 for key in keys if key in missing)
+        logger.info(f"埋め込みストア: ヒット{hits}件, エンコード{len(missing)}件")
+
+        if missing:
+            missing_texts = [texts[i] for i in missing.values()]
+            self.add(missing_texts, encode_fn(missing_texts))
+
+        vectors = self._vectors
+        rows = np.fromiter((self._rows[key] for key in keys), dtype=np.int64, count=len(keys))
+        if vectors is None:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        return np.asarray(vectors[rows])
+
+    def compact(self, texts: Iterable[str]) -> int:
+        """
+        textsのベクトルだけを残して詰め直す。捨てた件数を返す
+
+        新しいファイルを.tmpに書いてから差し替える。差し替えの前に件数0を書いておくので、
+        途中で落ちたら空のストアとして開き直される（次の構築でエンコードし直すだけで壊れはしない）。
+        """
+        keep = {content_key(self.model_name, text) for text in texts}
+        with self._lock:
+            kept = sorted((row, key) for key, row in self._rows.items() if key in keep)
+            removed = self.count - len(kept)
+            if removed == 0:
+                return 0
+
+            tmp_keys = self._keys_path.with_name(KEYS_FILE + ".tmp")
+            tmp_vectors = self._vectors_path.with_name(VECTORS_FILE + ".tmp")
+            rows = np.fromiter((row for row, _ in kept), dtype=np.int64, count=len(kept))
+            with open(tmp_vectors, 'wb') as f:
+                for start in range(0, len(rows), COMPACT_BLOCK_ROWS):
+                    f.write(np.ascontiguousarray(self._vectors[rows[start:start + COMPACT_BLOCK_ROWS]]).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            with open(tmp_keys, 'wb') as f:
+                f.write(b"".join(key for _, key in kept))
+                f.flush()
+                os.fsync(f.fileno())
+
+            self.count = 0
+            self._write_info()
+            self._vectors = None
+            os.replace(tmp_vectors, self._vectors_path)
+            os.replace(tmp_keys, self._keys_path)
+
+            self._rows = {key: row for row, (_, key) in enumerate(kept)}
+            self.count = len(kept)
+            self._write_info()
+            self._map_vectors()
+
+        logger.info(f"埋め込みストアを詰め直しました: {removed}件を削除, 残り{self.count}件")
+        return removed
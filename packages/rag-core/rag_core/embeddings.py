@@ -12,6 +12,8 @@ from sentence_transformers import SentenceTransformer
 from pathlib import Path
 import torch
 
+from .instrumentation import stage
+
 logger = logging.getLogger(__name__)
 
 class EmbeddingService:
@@ -74,15 +76,57 @@ class EmbeddingService:
             texts = [texts]
             
         try:
-            embeddings = self.model.encode(
+            with stage("encode"):
+                embeddings = self.model.encode(
+                    texts,
+                    batch_size=batch_size,
+                    normalize_embeddings=normalize,
+                    show_progress_bar=show_progress and len(texts) > 100,
+                    convert_to_numpy=convert_to_numpy,
+                    device=self.device
+                )
+            return embeddings
+        except Exception as e:
+            logger.error(f"エンコーディングに失敗しました: {e}")
+            raise
+
+    def encode_parallel(
+        self,
+        texts: List[str],
+        workers: Optional[int] = None,
+        batch_size: int = 32,
+        normalize: bool = True,
+        chunk_size: Optional[int] = None
+    ) -> np.ndarray:
+        """
+        複数プロセスでまとめてエンコード（インデックス構築用）
+
+        sentence-transformersのマルチプロセスプールを使う。
+        GPUがあれば全GPU、なければCPUプロセスをworkers個立ち上げる。
+        プロセスの起動とモデルの読み込みに数秒かかるので、件数が少ないときは普通のencodeの方が速い。
+        """
+        if self.device == "cuda":
+            target_devices = None  # 全GPUを使う
+        else:
+            target_devices = ["cpu"] * (workers or 4)
+
+        logger.info(f"マルチプロセスでエンコード中: {len(texts)}件, デバイス: {target_devices or 'all GPUs'}")
+        pool = self.model.start_multi_process_pool(target_devices=target_devices)
+        try:
+            embeddings = self.model.encode_multi_process(
                 texts,
+                pool,
                 batch_size=batch_size,
-                normalize_embeddings=normalize,
-                show_progress_bar=show_progress and len(texts) > 100,
-                convert_to_numpy=convert_to_numpy,
-                device=self.device
+                chunk_size=chunk_size
             )
-            return embeddings
         except Exception as e:
             logger.error(f"エンコーディングに失敗しました: {e}")
             raise
+        finally:
+            self.model.stop_multi_process_pool(pool)
+
+        # 古いバージョンのencode_multi_processは正規化オプションがないので自前で
+        if normalize:
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings = embeddings / np.clip(norms, 1e-12, None)
+        return embeddings
@@ -0,0 +1,103 @@
+"""
+ファセット（ライン・設備・故障分類ごとの件数）の集計
+
+メタデータの辞書を1件ずつ見て数えると検索のたびに件数分のループになるので、
+読み込み時に項目ごとの値を整数コードの列（numpy配列）にしておく。
+フィルターは列同士の比較でマスクを作り、件数はnp.bincountで数える。
+
+件数は文書単位（1文書が複数チャンクに分かれていても1件）。
+"""
+
+import logging
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# フィルター名 → メタデータの項目名（HybridSearcher._apply_filtersと同じ対応）
+FACET_FIELDS: Dict[str, str] = {
+    "categories": "category",
+    "workTypes": "work_type",
+    "productionLines": "line",
+    "locations": "location",
+    "equipment1s": "equipment1",
+    "equipment2s": "equipment2",
+    "equipment3s": "equipment3",
+}
+
+
+class FacetIndex:
+    """項目ごとの値を辞書エンコードした列"""
+
+    def __init__(self, metadata: List[Dict[str, Any]], fields: Optional[Dict[str, str]] = None):
+        self.fields = dict(fields or FACET_FIELDS)
+        self.size = len(metadata)
+        self.values: Dict[str, List[str]] = {}
+        self.columns: Dict[str, np.ndarray] = {}
+
+        codes_by_field: Dict[str, Dict[str, int]] = {name: {} for name in self.fields}
+        columns = {name: np.full(self.size, -1, dtype=np.int32) for name in self.fields}
+        self._row_of: Dict[str, int] = {}
+        # 文書ごとの代表行（最初に出てきた行）。件数を文書単位にするため
+        doc_rows: Dict[str, int] = {}
+        self._doc_row = np.empty(self.size, dtype=np.int64)
+
+        for row, item in enumerate(metadata):
+            self._row_of[item.get('chunk_id')] = row
+            doc_id = item.get('doc_id') or row
+            self._doc_row[row] = doc_rows.setdefault(doc_id, row)
+
+            meta = item.get('metadata', {})
+            for name, key in self.fields.items():
+                value = meta.get(key)
+                if value:
+                    codes = codes_by_field[name]
+                    code = codes.get(value)
+                    if code is None:
+                        code = codes[value] = len(codes)
+                    columns[name][row] = code
+
+        self.columns = columns
+        self.values = {name: list(codes) for name, codes in codes_by_field.items()}
+        self._codes = codes_by_field
+        self._is_doc_row = self._doc_row == np.arange(self.size)
+
+    def mask(self, filters: Optional[Dict[str, Any]] = None) -> np.ndarray:
+        """フィルターに合う行。項目内はOR、項目間はAND"""
+        mask = np.ones(self.size, dtype=bool)
+        for name, selected in (filters or {}).items():
+            if name not in self.fields or not selected:
+                continue
+            codes = [self._codes[name][v] for v in selected if v in self._codes[name]]
+            mask &= np.isin(self.columns[name], np.asarray(codes, dtype=np.int32))
+        return mask
+
+    def rows(self, chunk_ids: Iterable[str]) -> np.ndarray:
+        """chunk_idから行番号へ"""
+        return np.fromiter(
+            (self._row_of[chunk_id] for chunk_id in chunk_ids if chunk_id in self._row_of),
+            dtype=np.int64
+        )
+
+    def counts(self, rows: Optional[np.ndarray] = None, mask: Optional[np.ndarray] = None) -> Dict[str, Dict[str, int]]:
+        """
+        項目ごとの件数（文書単位）
+
+        rowsを渡すとその行だけ（検索結果の候補）、maskを渡すとマスクされた行だけ数える。
+        どちらもなければ全件。
+        """
+        if rows is not None:
+            selected = np.unique(self._doc_row[rows])
+        elif mask is not None:
+            selected = np.flatnonzero(mask & self._is_doc_row)
+        else:
+            selected = np.flatnonzero(self._is_doc_row)
+
+        result: Dict[str, Dict[str, int]] = {}
+        for name, column in self.columns.items():
+            codes = column[selected]
+            counts = np.bincount(codes[codes >= 0], minlength=len(self.values[name]))
+            values = self.values[name]
+            result[name] = {values[code]: int(counts[code]) for code in np.flatnonzero(counts)}
+        return result
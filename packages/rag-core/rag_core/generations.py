@@ -0,0 +1,198 @@
+"""
+インデックスの世代管理
+
+FAISS・BM25・メタデータのファイルを「世代（generation）」として1セットで扱う。
+インデックスを作り直すたびに generations/<世代ID>/ に新しいディレクトリを作って、
+最後に CURRENT ファイルを書き換えて公開する。
+書き換えはos.replaceでやるので、読み込み側が中途半端な状態を見ることはない。
+
+data/indices/
+├── CURRENT                  # 現在の世代ID（1行だけ）
+└── generations/
+    └── 20250101-120000-000000/
+        ├── manifest.json
+        ├── maintenance.faiss
+        └── ...
+
+CURRENTがない場合は従来どおり data/indices/ 直下のファイルを使う（レガシー配置）。
+"""
+
+import json
+import logging
+import os
+import shutil
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "manifest.json"
+CURRENT_FILE = "CURRENT"
+GENERATIONS_DIR = "generations"
+LEGACY_GENERATION = "legacy"
+
+# 世代に含まれるファイル（キー → ファイル名）
+DEFAULT_FILES: Dict[str, str] = {
+    "faiss": "maintenance.faiss",
+    "faiss_meta": "maintenance.faiss.meta.json",
+    "bm25": "maintenance.bm25",
+    "bm25_meta": "maintenance.bm25.meta.pkl",
+    # 代表にまとめたチャンク（dedup.py）。重複をまとめずに作った世代にはない
+    "duplicates": "maintenance.duplicates.json",
+}
+
+
+@dataclass
+class IndexManifest:
+    """1世代分のインデックスファイルの対応表"""
+    generation: str
+    files: Dict[str, str] = field(default_factory=lambda: dict(DEFAULT_FILES))
+    created_at: str = ""
+    num_chunks: int = 0
+    embedding_model: str = ""
+    base_dir: Path = field(default=Path("."), compare=False)
+
+    def path(self, key: str) -> Path:
+        """ファイルのキーから実際のパスを返す"""
+        return self.base_dir / self.files.get(key, DEFAULT_FILES.get(key, key))
+
+    def to_dict(self) -> dict:
+        return {
+            "generation": self.generation,
+            "files": self.files,
+            "created_at": self.created_at,
+            "num_chunks": self.num_chunks,
+            "embedding_model": self.embedding_model,
+        }
+
+    def save(self):
+        """manifest.jsonを書き出す"""
+        self.base_dir.mkdir(parents=True, exist_ok=True)
+        _atomic_write_text(
+            self.base_dir / MANIFEST_FILE,
+            json.dumps(self.to_dict(), ensure_ascii=False, indent=2)
+        )
+
+    @classmethod
+    def load(cls, generation_dir: Path) -> "IndexManifest":
+        generation_dir = Path(generation_dir)
+        with open(generation_dir / MANIFEST_FILE, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(
+            generation=data["generation"],
+            files={**DEFAULT_FILES, **data.get("files", {})},
+            created_at=data.get("created_at", ""),
+            num_chunks=data.get("num_chunks", 0),
+            embedding_model=data.get("embedding_model", ""),
+            base_dir=generation_dir,
+        )
+
+
+def _atomic_write_text(path: Path, text: str):
+    """一時ファイルに書いてからos.replaceで差し替える"""
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def new_generation_id() -> str:
+    """世代ID。時刻ベースなので辞書順＝作成順になる"""
+    return datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+
+
+def create_generation_dir(index_root: Path, generation: Optional[str] = None) -> Tuple[str, Path]:
+    """新しい世代のディレクトリを作る（まだ公開はしない）"""
+    generation = generation or new_generation_id()
+    generation_dir = Path(index_root) / GENERATIONS_DIR / generation
+    generation_dir.mkdir(parents=True, exist_ok=False)
+    return generation, generation_dir
+
+
+def publish_generation(index_root: Path, manifest: IndexManifest):
+    """
+    世代を公開する
+
+    manifestを書いてからCURRENTを差し替える。
+    rag-api側はCURRENTの変化を見て新しい世代を読み込む。
+    """
+    if not manifest.created_at:
+        manifest.created_at = datetime.now().isoformat()
+    manifest.save()
+    _atomic_write_text(Path(index_root) / CURRENT_FILE, manifest.generation + "\n")
+    logger.info(f"インデックス世代を公開しました: {manifest.generation}")
+
+
+def current_generation(index_root: Path) -> Optional[str]:
+    """CURRENTに書かれた世代IDを返す。なければNone（レガシー配置）"""
+    current_path = Path(index_root) / CURRENT_FILE
+    if not current_path.exists():
+        return None
+    generation = current_path.read_text(encoding='utf-8').strip()
+    return generation or None
+
+
+def list_generations(index_root: Path) -> List[str]:
+    """manifestがある世代の一覧（古い順）"""
+    generations_dir = Path(index_root) / GENERATIONS_DIR
+    if not generations_dir.exists():
+        return []
+    return sorted(
+        p.name for p in generations_dir.iterdir()
+        if (p / MANIFEST_FILE).exists()
+    )
+
+
+def resolve_manifest(index_root: Path, generation: Optional[str] = None) -> IndexManifest:
+    """
+    読み込む世代のmanifestを決める
+
+    generation指定 > CURRENT > レガシー配置 の順。
+    """
+    index_root = Path(index_root)
+    generation = generation or current_generation(index_root)
+
+    if generation is None or generation == LEGACY_GENERATION:
+        # 直下にmanifestがあればファイル名はそれに従う（ストリーミング構築など）
+        if (index_root / MANIFEST_FILE).exists():
+            return IndexManifest.load(index_root)
+        return IndexManifest(generation=LEGACY_GENERATION, base_dir=index_root)
+
+    generation_dir = index_root / GENERATIONS_DIR / generation
+    if not (generation_dir / MANIFEST_FILE).exists():
+        raise FileNotFoundError(f"Index generation not found: {generation_dir}")
+    return IndexManifest.load(generation_dir)
+
+
+def fork_generation(index_root: Path, generation: Optional[str] = None) -> IndexManifest:
+    """
+    今の世代をコピーした新しい世代を作る（差分更新用）
+
+    ファイルはハードリンクするのでベースが大きくても一瞬で終わる。
+    インデックス側は上書きせずに tmp → os.replace で差し替えるので、
+    リンク元の世代（rag-apiが読み込み中）のファイルが書き換わることはない。
+    """
+    index_root = Path(index_root)
+    source = resolve_manifest(index_root, generation)
+    new_generation, new_dir = create_generation_dir(index_root)
+
+    for path in source.base_dir.iterdir():
+        if not path.is_file() or path.name in (MANIFEST_FILE, CURRENT_FILE) or path.suffix == ".tmp":
+            continue
+        try:
+            os.link(path, new_dir / path.name)
+        except OSError:
+            # ハードリンクできないファイルシステムならコピー
+            shutil.copy2(path, new_dir / path.name)
+
+    return IndexManifest(
+        generation=new_generation,
+        files=dict(source.files),
+        num_chunks=source.num_chunks,
+        embedding_model=source.embedding_model,
+        base_dir=new_dir,
+    )
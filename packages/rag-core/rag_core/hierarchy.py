@@ -0,0 +1,118 @@
+"""
+設備階層（工場 → ライン → 設備1 → 設備2 → 設備3）の木
+
+フィルター用メタデータに木を丸ごと入れると、設備が増えるほどレスポンスが大きくなる。
+フロントエンドは1つの枝ずつ開くので、読み込み時に木を整数で作っておいて、
+指定したノードの子だけを返せるようにする。
+
+ノード0が根。ノードごとに親・深さ・ラベル番号・文書数をnumpy配列で持ち、
+子は child_ids[child_offsets[n]:child_offsets[n + 1]] にラベル順で並べておく。
+件数は文書単位（1文書が複数チャンクに分かれていても1件）。
+"""
+
+import logging
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 階層の順番（メタデータの項目名）
+HIERARCHY_LEVELS = ["location", "line", "equipment1", "equipment2", "equipment3"]
+# 工場とラインがない文書は木に入れない
+REQUIRED_LEVELS = 2
+
+ROOT = 0
+
+
+class HierarchyIndex:
+    """整数で持った設備階層の木"""
+
+    def __init__(self, metadata: List[Dict[str, Any]], levels: Optional[Sequence[str]] = None):
+        self.levels = list(levels or HIERARCHY_LEVELS)
+
+        label_codes: Dict[str, int] = {}
+        node_of: Dict[Tuple[int, int], int] = {}
+        parents = [-1]
+        label_ids = [-1]
+        depths = [0]
+        counts = [0]
+        seen_docs = set()
+
+        for row, item in enumerate(metadata):
+            doc_id = item.get('doc_id') or row
+            if doc_id in seen_docs:
+                continue
+            seen_docs.add(doc_id)
+
+            meta = item.get('metadata', {})
+            if not all(meta.get(key) for key in self.levels[:REQUIRED_LEVELS]):
+                continue
+            counts[ROOT] += 1
+            node = ROOT
+            for depth, key in enumerate(self.levels, start=1):
+                value = meta.get(key)
+                if not value:
+                    break
+                code = label_codes.setdefault(value, len(label_codes))
+                child = node_of.get((node, code))
+                if child is None:
+                    child = node_of[(node, code)] = len(parents)
+                    parents.append(node)
+                    label_ids.append(code)
+                    depths.append(depth)
+                    counts.append(0)
+                counts[child] += 1
+                node = child
+
+        self.labels: List[str] = list(label_codes)
+        self.parent = np.asarray(parents, dtype=np.int32)
+        self.label_id = np.asarray(label_ids, dtype=np.int32)
+        self.depth = np.asarray(depths, dtype=np.int8)
+        self.count = np.asarray(counts, dtype=np.int64)
+        self._node_of = node_of
+        self._label_codes = label_codes
+
+        # 親ごと・ラベル順に並べてCSRにする
+        order = sorted(range(1, len(parents)), key=lambda n: (parents[n], self.labels[label_ids[n]]))
+        self.child_ids = np.asarray(order, dtype=np.int32)
+        per_parent = np.bincount(self.parent[1:], minlength=len(parents))
+        self.child_offsets = np.concatenate([[0], np.cumsum(per_parent)]).astype(np.int64)
+
+    def __len__(self) -> int:
+        """根を含むノード数"""
+        return len(self.parent)
+
+    def find(self, path: Sequence[str]) -> Optional[int]:
+        """ラベルの列（例: ["第1工場", "A1000 生産ラインA"]）からノード番号へ。なければNone"""
+        node = ROOT
+        for value in path:
+            code = self._label_codes.get(value)
+            if code is None:
+                return None
+            node = self._node_of.get((node, code))
+            if node is None:
+                return None
+        return node
+
+    def path(self, node: int) -> List[str]:
+        """ノード番号からラベルの列へ（根は空）"""
+        labels: List[str] = []
+        while node > ROOT:
+            labels.append(self.labels[self.label_id[node]])
+            node = int(self.parent[node])
+        return labels[::-1]
+
+    def label(self, node: int) -> str:
+        return self.labels[self.label_id[node]] if node > ROOT else ""
+
+    def num_children(self, node: int) -> int:
+        return int(self.child_offsets[node + 1] - self.child_offsets[node])
+
+    def children(self, node: int, offset: int = 0, limit: Optional[int] = None) -> np.ndarray:
+        """nodeの子のノード番号（ラベル順）。offset / limitでページ分けする"""
+        start = int(self.child_offsets[node]) + offset
+        end = int(self.child_offsets[node + 1])
+        if limit is not None:
+            end = min(end, start + limit)
+        return self.child_ids[start:end] if start < end else self.child_ids[:0]
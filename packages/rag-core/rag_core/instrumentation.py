@@ -0,0 +1,71 @@
+"""
+処理ステージごとの時間計測
+
+検索・埋め込み・リランクの各ステージをstage()で囲んでおくと、
+- add_observerで登録したコールバック（rag-apiのPrometheusのヒストグラムなど）に通知する
+- collect()で渡した辞書に、そのリクエストのステージごとの時間（ミリ秒）を足し込む
+
+rag_core自体はメトリクスのライブラリに依存しない。
+辞書はcontextvarで持つので、executorのスレッドごとに別々になる
+（collect()は検索を実行するスレッドの中で呼ぶこと）。
+"""
+
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# (ステージ名, 秒) を受け取るコールバック
+Observer = Callable[[str, float], None]
+
+_observers: List[Observer] = []
+_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("rag_core_stage_timings", default=None)
+
+
+def add_observer(observer: Observer):
+    if observer not in _observers:
+        _observers.append(observer)
+
+
+def remove_observer(observer: Observer):
+    if observer in _observers:
+        _observers.remove(observer)
+
+
+@contextmanager
+def collect(timings: Optional[Dict[str, float]]) -> Iterator[Optional[Dict[str, float]]]:
+    """
+    この中で実行されたステージの時間をtimingsに記録する
+
+    Noneなら外側のcollect()の辞書をそのまま使う（入れ子で呼んでも上書きしない）。
+    """
+    if timings is None:
+        yield _timings.get()
+        return
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """ステージの処理時間を計測する。例外で抜けても記録する"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        timings = _timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed * 1000
+        for observer in _observers:
+            try:
+                observer(name, elapsed)
+            except Exception as e:
+                # 計測の失敗で検索を止めない
+                logger.warning(f"ステージ計測の通知に失敗しました: {e}")
@@ -9,7 +9,11 @@ Bi-Encoder（FAISSとか）より精度高いけど遅い。
 import logging
 from typing import Dict, List, Any, Optional
 from sentence_transformers import CrossEncoder
+from .caching import LRUCache
 from .config import settings
+from .embedding_store import content_key
+from .text import normalize_text
+from .instrumentation import stage
 
 logger = logging.getLogger(__name__)
 
@@ -40,6 +44,9 @@ class Reranker:
         self.device = device
         self.model = None
         self._is_available = False
+        # (クエリ, 文書) → スコア。同じクエリが続くとき・事前のウォームアップ用
+        # 内容のハッシュをキーにしているので、インデックスの世代が変わっても使える
+        self.score_cache = LRUCache(settings["retrieval"].get("rerank_cache_size", 0))
         
         self._load_model()
     
@@ -101,12 +108,21 @@ class Reranker:
 
         try:
             assert self.model is not None
-            scores = self.model.predict(
-                pairs,
-                batch_size=self.batch_size,
-                show_progress_bar=False,
-                convert_to_numpy=True
-            )
+            normalized_query = normalize_text(query)
+            keys = [content_key(self.model_name, f"{normalized_query}\0{text}") for _, text in pairs]
+            scores = [self.score_cache.get(key) for key in keys]
+            missing = [i for i, score in enumerate(scores) if score is None]
+            if missing:
+                with stage("rerank"):
+                    predicted = self.model.predict(
+                        [pairs[i] for i in missing],
+                        batch_size=self.batch_size,
+                        show_progress_bar=False,
+                        convert_to_numpy=True
+                    )
+                for i, score in zip(missing, predicted):
+                    scores[i] = float(score)
+                    self.score_cache.put(keys[i], scores[i])
             
             reranked_results = []
             for idx, score in zip(valid_indices, scores):
@@ -4,18 +4,30 @@
 FAISSとBM25を組み合わせて、RRFで結果を統合する。
 ベクトル検索だけだと専門用語やエラーコードの検索精度が低かったので、
 キーワード検索も組み合わせることにした。
+
+「E-482」のようなコードだけのクエリは、コードの完全一致インデックスとBM25だけで返す（code_index.py）。
 """
 
 import logging
+import threading
 from pathlib import Path
 from typing import Dict, List, Any, Optional
 
+import numpy as np
+
+from .caching import LRUCache
 from .config import settings
 from .dense_index import FaissIndexManager
 from .sparse_index import BM25IndexManager
+from .code_index import parse_code_query
 from .tokenization import tokenizer
 from .embeddings import EmbeddingService
 from .reranker import Reranker
+from .text import normalize_text
+from .generations import resolve_manifest
+from .facets import FacetIndex
+from .dedup import DuplicateGroups
+from .instrumentation import collect, stage
 
 logger = logging.getLogger(__name__)
 
@@ -59,7 +71,14 @@ class HybridSearcher:
     RRFで結果を統合すると、両方の良いとこ取りができる。
     """
 
-    def __init__(self, index_dir: Optional[str] = None):
+    def __init__(
+        self,
+        index_dir: Optional[str] = None,
+        generation: Optional[str] = None,
+        embedding_service: Optional[EmbeddingService] = None,
+        reranker: Optional[Reranker] = None,
+        query_vectors: Optional[LRUCache] = None,
+    ):
         logger.info("ハイブリッド検索エンジンを初期化中...")
         
         # インデックスのパス
@@ -67,100 +86,280 @@ class HybridSearcher:
             base_dir = Path(index_dir)
         else:
             base_dir = Path(settings["data"]["index_path"])
-            
-        logger.info(f"インデックスディレクトリ: {base_dir}")
+        self.index_dir = base_dir
+
+        # どの世代のファイルを使うかはmanifestで決める（なければ直下のファイル）
+        self.manifest = resolve_manifest(base_dir, generation)
+        self.generation = self.manifest.generation
+        logger.info(f"インデックスディレクトリ: {self.manifest.base_dir} (世代: {self.generation})")
 
         # Dense検索（ベクトル検索）
         self.dense_searcher = FaissIndexManager(
-            str(base_dir / "maintenance.faiss"), 
-            str(base_dir / "maintenance.faiss.meta.json")
+            str(self.manifest.path("faiss")), 
+            str(self.manifest.path("faiss_meta"))
         )
 
         # Sparse検索（キーワード検索）
         self.sparse_searcher = BM25IndexManager(
-            str(base_dir / "maintenance.bm25"), 
-            str(base_dir / "maintenance.bm25.meta.pkl")
+            str(self.manifest.path("bm25")), 
+            str(self.manifest.path("bm25_meta"))
         )
 
-        self.embedding_service = EmbeddingService(
+        # インデックス構築時に代表にまとめたチャンク（表示やフィルターのときに展開する）
+        self.duplicates = DuplicateGroups.load(
+            self.manifest.path("duplicates"), self.dense_searcher.live_metadata()
+        )
+
+        # モデルは重いので、渡されたものがあれば使い回す
+        self.embedding_service = embedding_service or EmbeddingService(
             model_name=settings["embedding"]["model_name"],
             cache_folder=settings["embedding"]["cache_folder"]
         )
         
+        # クエリの埋め込み（正規化したクエリ → ベクトル）。モデルが同じなら世代をまたいで使える
+        self.query_vectors = query_vectors or LRUCache(settings["retrieval"].get("query_cache_size", 0))
+
         self.tokenizer = tokenizer
 
         # Re-ranker（オプション）
         # Cross-Encoderで再順位付けすると精度上がるけど遅くなる
-        self.reranker = None
-        if settings["retrieval"].get("enable_reranking", False):
+        self.reranker = reranker
+        if self.reranker is None and settings["retrieval"].get("enable_reranking", False):
             self.reranker = Reranker(
                 model_name=settings["retrieval"].get("reranker_model")
             )
 
-    def search(self, query: str, filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        # ファセット集計用の列（使うときに作る）
+        self._facet_index: Optional[FacetIndex] = None
+        self._facet_lock = threading.Lock()
+
+    def load_generation(self, generation: Optional[str] = None) -> "HybridSearcher":
+        """
+        別の世代のインデックスを読み込んだSearcherを作る
+
+        埋め込みモデルとCross-Encoderはこのインスタンスのものを使い回すので、
+        読み込むのはインデックスファイルだけ。
+        """
+        return HybridSearcher(
+            index_dir=str(self.index_dir),
+            generation=generation,
+            embedding_service=self.embedding_service,
+            reranker=self.reranker,
+            query_vectors=self.query_vectors,
+        )
+
+    def close(self):
+        """インデックスを解放する。モデルは他の世代と共有してるので触らない"""
+        self.dense_searcher.unload()
+        self.sparse_searcher.unload()
+        self.duplicates = DuplicateGroups()
+        self._facet_index = None
+
+    @property
+    def facet_index(self) -> FacetIndex:
+        """
+        ファセット集計用の列。最初に使うときにメタデータから作る
+
+        代表にまとめたチャンクも入れる（corpusの件数はまとめる前の全文書で数える）。
+        """
+        if self._facet_index is None:
+            with self._facet_lock:
+                if self._facet_index is None:
+                    self._facet_index = FacetIndex(self.dense_searcher.live_metadata() + self.duplicates.chunks)
+        return self._facet_index
+
+    def search(
+        self,
+        query: str,
+        filters: Optional[Dict[str, Any]] = None,
+        timings: Optional[Dict[str, float]] = None
+    ) -> List[Dict[str, Any]]:
         """
         ハイブリッド検索を実行
         
         フィルターは後処理で適用（ポストフィルタリング）。
         本当は検索時にフィルタリングした方が効率いいけど、
         500件程度なら後処理でも十分速い。
+
+        timingsに辞書を渡すと、ステージごとの処理時間（ミリ秒）を書き込む。
         """
         if not query:
             return []
+        with collect(timings):
+            candidates = self.retrieve(query, filters)
+            return self.finalize(query, candidates)
 
-        # 1. Dense検索
-        query_vector = self.embedding_service.encode(query, show_progress=False)
-        dense_results = self.dense_searcher.search(
-            query_vector=query_vector,
-            top_k=settings["retrieval"]["dense_top_k"]
-        )
+    def search_with_facets(
+        self,
+        query: str,
+        filters: Optional[Dict[str, Any]] = None,
+        timings: Optional[Dict[str, float]] = None
+    ) -> Dict[str, Any]:
+        """
+        検索結果と一緒にファセットの件数を返す
 
-        # 2. Sparse検索
-        tokenized_query = self.tokenizer.tokenize(query)
-        sparse_results = self.sparse_searcher.search(
-            tokenized_query=tokenized_query,
-            top_k=settings["retrieval"]["sparse_top_k"]
-        )
+        matched: フィルター後の候補（リランク前の全候補）の件数
+        corpus: フィルターに合う全文書の件数
+        """
+        facet_index = self.facet_index
+        with collect(timings):
+            candidates = self.retrieve(query, filters) if query else []
+            results = self.finalize(query, candidates) if query else []
+            with stage("facets"):
+                facets = {
+                    "matched": facet_index.counts(rows=facet_index.rows(c['chunk_id'] for c in candidates)),
+                    "corpus": facet_index.counts(mask=facet_index.mask(filters)),
+                }
+        return {"results": results, "facets": facets}
 
-        # 3. RRFで統合
-        # k=60は論文で最適とされてた値。変えてもあんまり変わらなかった
-        fused_results = self._reciprocal_rank_fusion([
-            {res[0]['chunk_id']: res[1] for res in dense_results},
-            {res[0]['chunk_id']: res[1] for res in sparse_results}
-        ])
-
-        # 4. メタデータを付与
-        all_results_map = {
-            res[0]['chunk_id']: res[0] 
-            for res in dense_results + sparse_results
-        }
-        
-        candidates = []
-        for chunk_id, score in fused_results:
-            if chunk_id in all_results_map:
-                item = all_results_map[chunk_id].copy()
-                item['score'] = score
+    @property
+    def can_rerank(self) -> bool:
+        return bool(self.reranker and self.reranker.is_available)
+
+    def retrieve(
+        self,
+        query: str,
+        filters: Optional[Dict[str, Any]] = None,
+        timings: Optional[Dict[str, float]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Dense + Sparse → RRF → フィルターまで（リランク前の候補）
+
+        クエリがほぼコードだけで、そのコードがインデックスにあれば、
+        Denseを通さずにコードの完全一致の候補を返す（_retrieve_codes）。
+
+        timingsに辞書を渡すと、ステージごとの処理時間（ミリ秒）を書き込む。
+        """
+        with collect(timings):
+            if settings["retrieval"].get("enable_code_search", False):
+                codes = parse_code_query(query, settings["retrieval"].get("code_query_ratio", 0.6))
+                if codes:
+                    candidates = self._retrieve_codes(query, codes, filters)
+                    if candidates is not None:
+                        return candidates
+
+            # 1. Dense検索（クエリの埋め込みはEmbeddingService側で"encode"として計測。キャッシュにあれば0）
+            query_vector = self.encode_query(query)
+            with stage("dense"):
+                dense_results = self.dense_searcher.search(
+                    query_vector=query_vector,
+                    top_k=settings["retrieval"]["dense_top_k"]
+                )
+
+            # 2. Sparse検索
+            with stage("sparse"):
+                tokenized_query = self.tokenizer.tokenize(query)
+                sparse_results = self.sparse_searcher.search(
+                    tokenized_query=tokenized_query,
+                    top_k=settings["retrieval"]["sparse_top_k"]
+                )
+
+            with stage("fusion"):
+                # 3. RRFで統合
+                # k=60は論文で最適とされてた値。変えてもあんまり変わらなかった
+                fused_results = self._reciprocal_rank_fusion([
+                    {res[0]['chunk_id']: res[1] for res in dense_results},
+                    {res[0]['chunk_id']: res[1] for res in sparse_results}
+                ])
+
+                # 4. メタデータを付与
+                all_results_map = {
+                    res[0]['chunk_id']: res[0] 
+                    for res in dense_results + sparse_results
+                }
+                
+                candidates = []
+                for chunk_id, score in fused_results:
+                    if chunk_id in all_results_map:
+                        item = all_results_map[chunk_id].copy()
+                        item['score'] = score
+                        item['duplicate_count'] = len(self.duplicates.members(chunk_id))
+                        candidates.append(item)
+
+            # 5. フィルター適用
+            if filters:
+                with stage("filter"):
+                    filtered_candidates = []
+                    for item in candidates:
+                        item = self._filter_candidate(item, filters)
+                        if item is not None:
+                            filtered_candidates.append(item)
+                    candidates = filtered_candidates
+
+        return candidates
+
+    def _retrieve_codes(
+        self,
+        query: str,
+        codes: List[str],
+        filters: Optional[Dict[str, Any]] = None
+    ) -> Optional[List[Dict[str, Any]]]:
+        """
+        コードを含むチャンクをBM25の順に返す。どのコードもインデックスになければNone
+
+        scoreはクエリのコードのうち一致した割合（全部含んでいれば1.0）。
+        code_matchが付いた候補はfinalizeでリランクしない。
+
+        よく出てくるコードは数百件に一致するので、並べるのは全件、
+        辞書を作ってフィルターにかけるのは上位からcode_top_k件が揃うまで。
+        """
+        limit = settings["retrieval"].get("code_top_k", 50)
+        with stage("codes"):
+            hits = self.sparse_searcher.search_codes(codes, self.tokenizer.tokenize(query))
+            if not hits:
+                return None
+            candidates = []
+            for meta, _, matched in hits:
+                item = {
+                    **meta,
+                    'score': matched / len(codes),
+                    'code_match': matched,
+                    'duplicate_count': len(self.duplicates.members(meta['chunk_id'])),
+                }
+                if filters:
+                    item = self._filter_candidate(item, filters)
+                    if item is None:
+                        continue
                 candidates.append(item)
+                if len(candidates) >= limit:
+                    break
+        return candidates
 
-        # 5. フィルター適用
-        if filters:
-            filtered_candidates = []
-            for item in candidates:
-                if self._apply_filters(item, filters):
-                    filtered_candidates.append(item)
-            candidates = filtered_candidates
+    def should_rerank(self, candidates: List[Dict[str, Any]]) -> bool:
+        """リランクするか（コードの完全一致の候補は並びが決まっているのでしない）"""
+        return self.can_rerank and bool(candidates) and 'code_match' not in candidates[0]
 
-        # 6. Re-ranking（有効な場合）
+    def finalize(
+        self,
+        query: str,
+        candidates: List[Dict[str, Any]],
+        rerank: bool = True,
+        timings: Optional[Dict[str, float]] = None
+    ) -> List[Dict[str, Any]]:
+        """Re-ranking（有効な場合）して上位を返す。rerank=FalseならRRFの順のまま"""
         final_top_k = settings["retrieval"]["final_top_k"]
         
-        if self.reranker and self.reranker.is_available and candidates:
+        if rerank and self.should_rerank(candidates):
             rerank_candidates_count = settings["retrieval"].get("rerank_candidates", 10)
             to_rerank = candidates[:rerank_candidates_count]
-            reranked = self.reranker.rerank(query, to_rerank)
+            # リランクの時間はReranker側で"rerank"として計測
+            with collect(timings):
+                reranked = self.reranker.rerank(query, to_rerank)
             return reranked[:final_top_k]
         
         return candidates[:final_top_k]
 
+    def encode_query(self, query: str) -> np.ndarray:
+        """クエリの埋め込み。キャッシュにあればエンコードしない"""
+        key = normalize_text(query)
+        vector = self.query_vectors.get(key)
+        if vector is None:
+            vector = self.embedding_service.encode(query, show_progress=False)
+            # キャッシュしたベクトルを呼び出し側が書き換えないように
+            vector.flags.writeable = False
+            self.query_vectors.put(key, vector)
+        return vector
+
     def _reciprocal_rank_fusion(self, result_sets: List[Dict[str, float]], k: int = 60):
         """
         RRFスコア計算
@@ -169,18 +368,36 @@ class HybridSearcher:
         
         k=60は論文（Cormack et al., 2009）で最適とされてた値。
         試しに30とか120とかも試したけど、大差なかったのでデフォルトのまま。
+
+        順位は各result_setの並び順（検索側で近い順に並んでいる）をそのまま使う。
+        スコアで並べ直すと、FAISSのL2距離（小さい方が近い）が逆順になってしまう。
         """
         fused_scores = {}
         
         for result_set in result_sets:
-            sorted_docs = sorted(result_set.items(), key=lambda x: x[1], reverse=True)
-            for rank, (doc_id, _) in enumerate(sorted_docs):
+            for rank, doc_id in enumerate(result_set):
                 if doc_id not in fused_scores:
                     fused_scores[doc_id] = 0.0
                 fused_scores[doc_id] += 1.0 / (k + rank + 1)
                 
         return sorted(fused_scores.items(), key=lambda x: x[1], reverse=True)
 
+    def _filter_candidate(self, item: Dict[str, Any], filters: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        フィルターに合えばそのまま返す
+
+        代表が合わなくても、まとめたチャンク（号機が違うなど）が合えばそちらに差し替える。
+        """
+        if self._apply_filters(item, filters):
+            return item
+        for duplicate in self.duplicates.members(item['chunk_id']):
+            if self._apply_filters(duplicate, filters):
+                return {
+                    **duplicate,
+                    **{key: item[key] for key in ('score', 'code_match', 'duplicate_count') if key in item},
+                }
+        return None
+
     def _apply_filters(self, item: Dict[str, Any], filters: Dict[str, Any]) -> bool:
         """フィルター適用。条件に合わなければFalse"""
         meta = item.get('metadata', {})
@@ -0,0 +1,129 @@
+"""
+インデックスのセグメント管理（差分更新用）
+
+毎回全件を作り直すと1日分の追加でも全履歴の埋め込みが走るので、
+追加分は小さな「セグメント」として別ファイルに書いて、ベースと一緒に検索する。
+削除（と更新前の古い行）は行番号のtombstoneで隠しておいて、マージ時に物理削除する。
+
+行番号はベース → セグメント1 → セグメント2 ... の順に通しで振る。
+FAISSとBM25は同じ順番で追加するので、行番号はどちらでも同じ意味になる。
+
+マージしたベースは新しいファイル名（maintenance.merged000001.faiss など）で書く。
+新しいファイル名にはsegments.jsonがまだないので、manifestのファイル名を書き換えた時点で
+「マージ済みのベース + 空のセグメント・tombstone」が1回で公開される。
+途中で落ちても古いベース・セグメント・tombstoneは一式そのまま残る。
+"""
+
+import json
+import os
+import re
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Set
+
+
+@dataclass
+class SegmentInfo:
+    """1セグメントの情報"""
+    name: str
+    count: int
+
+
+@dataclass
+class SegmentLog:
+    """
+    セグメント一覧とtombstoneの記録
+
+    <インデックスファイル名>.segments.json に保存する。
+    """
+    path: Path
+    segments: List[SegmentInfo] = field(default_factory=list)
+    tombstones: Set[int] = field(default_factory=set)
+    next_id: int = 1
+
+    @classmethod
+    def for_index(cls, index_path: Path) -> "SegmentLog":
+        """インデックスファイルに対応するログを読む。なければ空のログ"""
+        index_path = Path(index_path)
+        log = cls(path=index_path.with_name(index_path.name + ".segments.json"))
+        if log.path.exists():
+            with open(log.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            log.segments = [SegmentInfo(**s) for s in data.get("segments", [])]
+            log.tombstones = set(data.get("tombstones", []))
+            log.next_id = data.get("next_id", len(log.segments) + 1)
+        return log
+
+    @property
+    def is_empty(self) -> bool:
+        return not self.segments and not self.tombstones
+
+    def segment_path(self, index_path: Path, name: str) -> Path:
+        """セグメントのファイルパス（インデックスファイルと同じ場所に置く）"""
+        index_path = Path(index_path)
+        return index_path.with_name(f"{index_path.name}.{name}")
+
+    def new_segment_name(self) -> str:
+        name = f"seg{self.next_id:06d}"
+        self.next_id += 1
+        return name
+
+    def save(self):
+        """tmpに書いてから差し替える（ハードリンクで共有してる世代を壊さないため）"""
+        data: Dict[str, Any] = {
+            "segments": [{"name": s.name, "count": s.count} for s in self.segments],
+            "tombstones": sorted(self.tombstones),
+            "next_id": self.next_id,
+        }
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        """マージ後はセグメントもtombstoneも空になる"""
+        self.segments = []
+        self.tombstones = set()
+        if self.path.exists():
+            self.path.unlink()
+
+
+_MERGED_TAG = re.compile(r"\.merged(\d+)")
+
+
+def merged_path(index_path: Path) -> Path:
+    """
+    マージしたベースの書き出し先（今のファイル名の番号を1つ進める）
+
+    maintenance.faiss → maintenance.merged000001.faiss → maintenance.merged000002.faiss
+    """
+    index_path = Path(index_path)
+    match = _MERGED_TAG.search(index_path.name)
+    number = int(match.group(1)) + 1 if match else 1
+    stem, _, suffix = _MERGED_TAG.sub("", index_path.name).partition(".")
+    return index_path.with_name(f"{stem}.merged{number:06d}.{suffix}" if suffix else f"{stem}.merged{number:06d}")
+
+
+def remove_files(paths: Iterable[Path]):
+    """マージで要らなくなったファイルを消す（新しいファイル名をmanifestに書いてから呼ぶ）"""
+    for path in paths:
+        Path(path).unlink(missing_ok=True)
+
+
+def find_rows(
+    metadata: List[Dict[str, Any]],
+    tombstones: Set[int],
+    chunk_ids: Iterable[str] = (),
+    doc_ids: Iterable[str] = ()
+) -> List[int]:
+    """chunk_idかdoc_idが一致する生きている行の番号を返す"""
+    chunk_id_set = set(chunk_ids)
+    doc_id_set = set(doc_ids)
+    rows = []
+    for row, item in enumerate(metadata):
+        if row in tombstones:
+            continue
+        if item.get('chunk_id') in chunk_id_set or item.get('doc_id') in doc_id_set:
+            rows.append(row)
+    return rows
+
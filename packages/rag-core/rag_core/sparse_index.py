@@ -3,36 +3,130 @@ BM25インデックスの管理
 
 キーワード検索用。エラーコードとか型番の完全一致に強い。
 最初はElasticsearch使おうとしたけど、500件程度ならrank-bm25で十分だった。
+
+差分更新はFAISSと同じセグメント方式（segments.py参照）。
+BM25はIDFと平均文書長がコーパス全体に依存するので、セグメントを読み込んだら
+生きている文書だけで統計を計算し直す。こうすると全件再構築したときと同じスコアになる。
+文書頻度はベース・セグメントごとと、tombstoneの行の分を持っておいて足し引きする
+（追加・削除のたびに全行をなめ直すと、1日分の追加でもコーパス全体に比例する時間がかかる）。
+
+コードの完全一致インデックス（code_index.py）も同じ行番号で持つので、メタデータが変わるたびに作り直す。
 """
 
+import json
 import pickle
 import logging
+import threading
 import numpy as np
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Iterable, Tuple
 from rank_bm25 import BM25Okapi
+from .segments import SegmentInfo, SegmentLog, find_rows, merged_path, remove_files
+from .code_index import CodeIndex
 
 logger = logging.getLogger(__name__)
 
+
+@dataclass
+class DocStats:
+    """BM25の統計の材料: 単語 → その単語を含む文書数、文書数、トークン数の合計"""
+    nd: Dict[str, int] = field(default_factory=dict)
+    count: int = 0
+    total_len: int = 0
+
+    @classmethod
+    def of_rows(cls, doc_freqs: List[Dict[str, int]], doc_len: List[int], rows: Iterable[int] | None = None) -> "DocStats":
+        """指定した行（Noneなら全行）の統計"""
+        stats = cls()
+        for row in (range(len(doc_freqs)) if rows is None else rows):
+            stats.count += 1
+            stats.total_len += doc_len[row]
+            for word in doc_freqs[row]:
+                stats.nd[word] = stats.nd.get(word, 0) + 1
+        return stats
+
+    @classmethod
+    def combine(cls, parts: Iterable["DocStats"], minus: "DocStats | None" = None) -> "DocStats":
+        """partsを足してminusを引く。件数が0になった単語は消す（全件再構築したときのIDFと揃える）"""
+        total = cls()
+        for part in parts:
+            total.count += part.count
+            total.total_len += part.total_len
+            for word, n in part.nd.items():
+                total.nd[word] = total.nd.get(word, 0) + n
+        if minus is not None:
+            total.count -= minus.count
+            total.total_len -= minus.total_len
+            for word, n in minus.nd.items():
+                left = total.nd[word] - n
+                if left:
+                    total.nd[word] = left
+                else:
+                    del total.nd[word]
+        return total
+
+
+class StatsBM25Okapi(BM25Okapi):
+    """
+    構築時に数えた文書頻度をdoc_statsとして持っておくBM25Okapi
+
+    BM25Okapiは数えた文書頻度をIDFの計算に使ったら捨ててしまうので、差分更新のたびに
+    全行から数え直すことになる。持っておけばpickleにも入る（古いpickleにはないので、そのときだけ数える）。
+    """
+
+    def _initialize(self, corpus):
+        nd = super()._initialize(corpus)
+        self.doc_stats = DocStats(dict(nd), self.corpus_size, sum(self.doc_len))
+        return nd
+
+
 class BM25IndexManager:
     """BM25インデックスの構築・保存・検索"""
 
-    def __init__(self, index_path: str, metadata_path: str):
+    def __init__(self, index_path: str, metadata_path: str, autoload: bool = True):
         self.index_path = Path(index_path)
         self.metadata_path = Path(metadata_path)
         self.index: BM25Okapi | None = None
         self.metadata: List[Dict[str, Any]] = []
 
-        if self.index_path.exists() and self.metadata_path.exists():
+        # 差分更新用のセグメント
+        # _scorerはベース+セグメントをまとめて検索するためのBM25（セグメントがなければindexと同じ）
+        self.segment_log = SegmentLog.for_index(self.index_path)
+        self.segment_indices: List[BM25Okapi] = []
+        self._scorer: BM25Okapi | None = None
+        # 文書頻度などの統計（ベース・セグメントごと）とtombstoneの行の分
+        self._stats: List[DocStats] | None = None
+        self._dead_stats = DocStats()
+        # コード → 行番号（コードだけのクエリの近道用）
+        self.codes = CodeIndex()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+        if autoload and self.index_path.exists() and self.metadata_path.exists():
             self.load()
 
-    def build(self, tokenized_corpus: List[List[str]]):
-        """インデックス構築。トークン化済みのテキストを渡す"""
-        logger.info(f"BM25インデックスを構築中: {len(tokenized_corpus)}件のドキュメント")
-        self.index = BM25Okapi(tokenized_corpus)
+    def build(self, tokenized_corpus: Iterable[List[str]]):
+        """
+        インデックス構築。トークン化済みのテキストを渡す
 
-    def save(self, metadata: List[Dict[str, Any]]):
-        """インデックスとメタデータを保存"""
+        BM25Okapiはコーパスを1回なめるだけなので、ジェネレーターを渡してもOK
+        （ストリーミング構築ではファイルから1件ずつ読みながら渡す）。
+        """
+        logger.info("BM25インデックスを構築中...")
+        self.index = StatsBM25Okapi(tokenized_corpus)
+        logger.info(f"BM25インデックスを構築しました: {self.index.corpus_size}件のドキュメント")
+
+        # 全件構築したらセグメントは不要
+        self._remove_segment_files(self.segment_log.segments)
+        self.segment_indices = []
+        self.segment_log.clear()
+        self._scorer = self.index
+        self._stats = None
+        self._dead_stats = DocStats()
+
+    def save_index(self):
+        """インデックスだけ保存（メタデータは別に書く場合）"""
         if self.index is None:
             raise RuntimeError("インデックスが構築されていません。")
 
@@ -40,27 +134,263 @@ class BM25IndexManager:
         with open(self.index_path, 'wb') as f:
             pickle.dump(self.index, f)
 
-        with open(self.metadata_path, 'wb') as f:
-            pickle.dump(metadata, f)
-        
+    def save(self, metadata: List[Dict[str, Any]]):
+        """インデックスとメタデータを保存"""
+        self.save_index()
+
+        if self.metadata_path.suffix == ".json":
+            with open(self.metadata_path, 'w', encoding='utf-8') as f:
+                json.dump(metadata, f, ensure_ascii=False, separators=(',', ':'))
+        else:
+            with open(self.metadata_path, 'wb') as f:
+                pickle.dump(metadata, f)
+
         self.metadata = metadata
+        self.codes = CodeIndex.build(metadata)
 
     def load(self):
         """インデックス読み込み"""
         logger.info(f"BM25インデックスを読み込み中: {self.index_path}")
         with open(self.index_path, 'rb') as f:
             self.index = pickle.load(f)
-        
-        with open(self.metadata_path, 'rb') as f:
-            self.metadata = pickle.load(f)
+
+        # メタデータはFAISSと共有のJSONのこともある（ストリーミング構築）
+        if self.metadata_path.suffix == ".json":
+            with open(self.metadata_path, 'r', encoding='utf-8') as f:
+                self.metadata = json.load(f)
+        else:
+            with open(self.metadata_path, 'rb') as f:
+                self.metadata = pickle.load(f)
+
+        self.segment_indices = []
+        for segment in self.segment_log.segments:
+            seg_path = self.segment_log.segment_path(self.index_path, segment.name)
+            with open(seg_path, 'rb') as f:
+                self.segment_indices.append(pickle.load(f))
+            with open(f"{seg_path}.meta.pkl", 'rb') as f:
+                self.metadata.extend(pickle.load(f))
+        self._stats = None
+        self._dead_stats = DocStats()
+        self._scorer = self.index
+        if not self.segment_log.is_empty:
+            self._ensure_stats()
+            doc_freqs = [freqs for index in [self.index] + self.segment_indices for freqs in index.doc_freqs]
+            doc_len = [length for index in [self.index] + self.segment_indices for length in index.doc_len]
+            self._dead_stats = DocStats.of_rows(doc_freqs, doc_len, sorted(self.segment_log.tombstones))
+            self._scorer = self._build_scorer(
+                self.index, doc_freqs, doc_len, DocStats.combine(self._stats, self._dead_stats)
+            )
+        self.codes = CodeIndex.build(self.metadata)
+
+    def unload(self):
+        """メモリを解放する（ホットリロードで古い世代を捨てるとき用）"""
+        with self._lock:
+            self.index = None
+            self._scorer = None
+            self.segment_indices = []
+            self.metadata = []
+            self.codes = CodeIndex()
+            self._stats = None
+
+    @property
+    def tombstones(self):
+        return self.segment_log.tombstones
+
+    def add_segment(self, tokenized_corpus: List[List[str]], metadata: List[Dict[str, Any]]) -> str:
+        """追加分を新しいセグメントとして書き出す"""
+        if self.index is None:
+            raise RuntimeError("インデックスが構築されていません。")
+        if len(tokenized_corpus) != len(metadata):
+            raise ValueError("Tokenized corpus and metadata must have the same length.")
+
+        segment_index = StatsBM25Okapi(tokenized_corpus)
+
+        with self._write_lock:
+            name = self.segment_log.new_segment_name()
+            seg_path = self.segment_log.segment_path(self.index_path, name)
+            with open(seg_path, 'wb') as f:
+                pickle.dump(segment_index, f)
+            with open(f"{seg_path}.meta.pkl", 'wb') as f:
+                pickle.dump(metadata, f)
+
+            # 足すのは新しいセグメントの統計だけ（ベースと既存のセグメントはなめ直さない）。
+            # doc_freqsのリストはつなぐ（参照のコピーだけ）
+            stats = self._ensure_stats() + [segment_index.doc_stats]
+            segment_indices = self.segment_indices + [segment_index]
+            scorer = self._build_scorer(
+                self.index,
+                self._scorer.doc_freqs + segment_index.doc_freqs,
+                self._scorer.doc_len + segment_index.doc_len,
+                DocStats.combine(stats, self._dead_stats),
+            )
+            codes = self.codes.extended(metadata, len(self.metadata))
+            with self._lock:
+                self.segment_indices = segment_indices
+                self.metadata = self.metadata + metadata
+                self._scorer = scorer
+                self._stats = stats
+                self.codes = codes
+                self.segment_log.segments.append(SegmentInfo(name=name, count=len(metadata)))
+                self.segment_log.save()
+
+        logger.info(f"BM25セグメントを追加しました: {name} ({len(metadata)}件)")
+        return name
+
+    def delete(self, chunk_ids: Iterable[str] = (), doc_ids: Iterable[str] = ()) -> int:
+        """tombstoneを付けて検索結果から外す。IDFなどの統計も計算し直す"""
+        with self._write_lock:
+            rows = find_rows(self.metadata, self.segment_log.tombstones, chunk_ids, doc_ids)
+            if rows:
+                tombstones = self.segment_log.tombstones | set(rows)
+                # 引くのは消した行の統計だけ
+                dead_stats = DocStats.combine([
+                    self._dead_stats, DocStats.of_rows(self._scorer.doc_freqs, self._scorer.doc_len, rows)
+                ])
+                scorer = self._build_scorer(
+                    self.index,
+                    self._scorer.doc_freqs,
+                    self._scorer.doc_len,
+                    DocStats.combine(self._ensure_stats(), dead_stats),
+                )
+                with self._lock:
+                    self.segment_log.tombstones = tombstones
+                    self._scorer = scorer
+                    self._dead_stats = dead_stats
+                    self.segment_log.save()
+        return len(rows)
+
+    def merge_segments(self) -> List[Path]:
+        """
+        ベースとセグメントを1つのBM25にまとめ直す
+
+        BM25Okapiは元のトークン列を持ってないけど、文書ごとの単語頻度があれば
+        同じ統計になるので、そこからトークン列を復元して作り直す。
+
+        FAISSと同じく新しいファイル名で書いて、今のファイルには触らない（segments.py参照）。
+        メタデータもこのインデックスの名前で別に書くので、FAISSとJSONを共有していても
+        同時にマージしてぶつかることはない。戻り値は要らなくなった古いファイル。
+        """
+        if self.index is None:
+            raise RuntimeError("インデックスが構築されていません。")
+
+        with self._write_lock:
+            if self.segment_log.is_empty:
+                return []
+
+            metadata = self.metadata
+            tombstones = self.segment_log.tombstones
+            old_segments = list(self.segment_log.segments)
+            doc_freqs = self._scorer.doc_freqs
+
+            live_rows = [i for i in range(len(metadata)) if i not in tombstones]
+            merged = StatsBM25Okapi([
+                [word for word, count in doc_freqs[i].items() for _ in range(count)]
+                for i in live_rows
+            ])
+            live_metadata = [metadata[i] for i in live_rows]
+
+            index_path = merged_path(self.index_path)
+            metadata_path = index_path.with_name(f"{index_path.name}.meta{self.metadata_path.suffix}")
+            tmp_path = index_path.with_name(index_path.name + ".tmp")
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(merged, f)
+            tmp_path.replace(index_path)
+            tmp_meta_path = metadata_path.with_name(metadata_path.name + ".tmp")
+            if metadata_path.suffix == ".json":
+                with open(tmp_meta_path, 'w', encoding='utf-8') as f:
+                    json.dump(live_metadata, f, ensure_ascii=False, separators=(',', ':'))
+            else:
+                with open(tmp_meta_path, 'wb') as f:
+                    pickle.dump(live_metadata, f)
+            tmp_meta_path.replace(metadata_path)
+            codes = CodeIndex.build(live_metadata)
+
+            superseded = [self.index_path, self.metadata_path, self.segment_log.path]
+            superseded += self._segment_files(old_segments)
+            with self._lock:
+                self.index = merged
+                self.metadata = live_metadata
+                self.segment_indices = []
+                self._scorer = merged
+                self._stats = None
+                self._dead_stats = DocStats()
+                self.codes = codes
+                self.index_path = index_path
+                self.metadata_path = metadata_path
+                self.segment_log = SegmentLog.for_index(index_path)
+
+        logger.info(
+            f"BM25セグメントをマージしました: {len(old_segments)}個 → {len(live_metadata)}件 ({index_path.name})"
+        )
+        return superseded
+
+    def start_background_merge(self) -> threading.Thread:
+        """マージを別スレッドで実行する"""
+        thread = threading.Thread(target=self.merge_segments, name="bm25-merge", daemon=True)
+        thread.start()
+        return thread
+
+    def _segment_files(self, segments: List[SegmentInfo]) -> List[Path]:
+        files = []
+        for segment in segments:
+            seg_path = self.segment_log.segment_path(self.index_path, segment.name)
+            files += [seg_path, Path(f"{seg_path}.meta.pkl")]
+        return files
+
+    def _remove_segment_files(self, segments: List[SegmentInfo]):
+        remove_files(self._segment_files(segments))
+
+    def _ensure_stats(self) -> List[DocStats]:
+        """ベース・セグメントごとの統計。構築時に数えたものがなければ（古いpickle）ここで数える"""
+        if self._stats is None:
+            self._stats = [
+                getattr(index, "doc_stats", None) or DocStats.of_rows(index.doc_freqs, index.doc_len)
+                for index in [self.index] + self.segment_indices
+            ]
+        return self._stats
+
+    @staticmethod
+    def _build_scorer(
+        base: BM25Okapi,
+        doc_freqs: List[Dict[str, int]],
+        doc_len: List[int],
+        live: DocStats
+    ) -> BM25Okapi:
+        """
+        ベース+セグメントを1つのBM25として検索できるようにする
+
+        doc_freqsは全行（tombstone含む）を通しの行番号で並べて、
+        IDFと平均文書長は生きている行の統計（live）で計算する。かかる時間は語彙数に比例する。
+        """
+        scorer = BM25Okapi.__new__(BM25Okapi)
+        scorer.k1, scorer.b, scorer.epsilon = base.k1, base.b, base.epsilon
+        scorer.tokenizer = None
+        scorer.doc_freqs = doc_freqs
+        scorer.doc_len = doc_len
+        scorer.idf = {}
+
+        # _calc_idfはcorpus_sizeを使うので、一時的に生きている件数にしておく
+        scorer.corpus_size = live.count
+        scorer.avgdl = live.total_len / live.count if live.count else 0.0
+        if live.nd:
+            scorer._calc_idf(live.nd)
+        scorer.corpus_size = len(doc_freqs)
+        return scorer
 
     def search(self, tokenized_query: List[str], top_k: int) -> List[Tuple[Dict[str, Any], float]]:
         """検索実行。トークン化済みのクエリを渡す"""
-        if self.index is None:
+        with self._lock:
+            scorer = self._scorer
+            metadata = self.metadata
+            tombstones = self.segment_log.tombstones
+
+        if scorer is None:
             logger.warning("BM25インデックスが読み込まれていません。")
             return []
 
-        doc_scores = self.index.get_scores(tokenized_query)
+        doc_scores = scorer.get_scores(tokenized_query)
+        if tombstones:
+            doc_scores[list(tombstones)] = 0.0
         top_n_indices = np.argsort(doc_scores)[::-1][:top_k]
 
         results = []
@@ -68,6 +398,61 @@ class BM25IndexManager:
             score = doc_scores[idx]
             # スコア0は除外（キーワードが1つも一致しなかった）
             if score > 0:
-                results.append((self.metadata[idx], float(score)))
-        
+                results.append((metadata[idx], float(score)))
+
         return results
+
+    def search_codes(
+        self,
+        codes: List[str],
+        tokenized_query: List[str],
+        top_k: int | None = None
+    ) -> List[Tuple[Dict[str, Any], float, int]]:
+        """
+        コードを含むチャンクだけを検索する（コードの完全一致）
+
+        返すのは (メタデータ, BM25スコア, 一致したコードの数)。
+        一致したコードが多い順、同じならBM25スコアの順に並べる。
+        コーパス全体のスコアは計算せずに、候補の行だけ get_scores と同じ式で計算する。
+        """
+        with self._lock:
+            scorer = self._scorer
+            metadata = self.metadata
+            tombstones = self.segment_log.tombstones
+            code_index = self.codes
+
+        if scorer is None:
+            logger.warning("BM25インデックスが読み込まれていません。")
+            return []
+
+        matched: Dict[int, int] = {}
+        for code in codes:
+            for row in code_index.rows(code):
+                if row not in tombstones:
+                    matched[row] = matched.get(row, 0) + 1
+        if not matched:
+            return []
+
+        rows = list(matched)
+        counts = np.fromiter(matched.values(), dtype=np.int64, count=len(matched))
+        scores = self._score_rows(scorer, tokenized_query, rows)
+        order = np.lexsort((np.asarray(rows), -scores, -counts))[:top_k]
+        return [(metadata[rows[i]], float(scores[i]), int(counts[i])) for i in order.tolist()]
+
+    @staticmethod
+    def _score_rows(scorer: BM25Okapi, tokenized_query: List[str], rows: List[int]) -> np.ndarray:
+        """
+        指定した行だけのBM25スコア（BM25Okapi.get_scoresと同じ値）
+
+        doc_lenとdoc_freqsはPythonのリストなので、行番号もnumpyの整数でなくintのリストで渡す（その方が速い）。
+        """
+        doc_len = np.array([scorer.doc_len[row] for row in rows], dtype=np.float64)
+        norm = scorer.k1 * (1 - scorer.b + scorer.b * doc_len / scorer.avgdl)
+        scores = np.zeros(len(rows))
+        for q in tokenized_query:
+            idf = scorer.idf.get(q) or 0
+            if not idf:
+                continue
+            q_freq = np.array([scorer.doc_freqs[row].get(q, 0) for row in rows], dtype=np.float64)
+            scores += idf * (q_freq * (scorer.k1 + 1) / (q_freq + norm))
+        return scores
@@ -0,0 +1,210 @@
+"""
+検索ボックスの入力補完（前方一致）
+
+候補は3種類で、読み込み時にメタデータ（設備名と本文）から作る。
+- equipment: 設備1〜3の名前（文書数）
+- code: 本文に出てくるエラーコード・パラメータ番号（E-416, P-012 など。文書数）
+- term: コーパスによく出てくる名詞（MeCabで切り出した表層形。チャンク数）
+
+BM25のトークンは読み（「異音」→「イオン」）なので、単語は本文をもう一度MeCabにかけて数える。
+チャンクが多いときは等間隔にsample_chunks件だけ見て、件数は全体に引き伸ばした推定値にする。
+
+入力のたびに呼ばれるので、埋め込みモデルは使わずに、ソート済みの配列を二分探索する
+（配列で持ったtrieのようなもの）。接頭辞に当たる範囲が狭ければその場で件数順に並べ、
+範囲が広い短い接頭辞（「イ」「E-」など）は上位を読み込み時に計算しておく。
+どちらでも1回の補完はマイクロ秒単位で終わる。
+
+キーはNFKC・小文字・カタカナ→ひらがなにそろえるので、
+「ｅ－４」「いんば」でも「E-416」「インバータ」が出てくる。
+"""
+
+import logging
+import re
+from bisect import bisect_left
+from typing import Any, Dict, Iterable, List, Tuple
+
+import numpy as np
+
+from .code_index import extract_codes
+from .text import normalize_text
+from .tokenization import tokenizer
+
+logger = logging.getLogger(__name__)
+
+EQUIPMENT_LEVELS = ["equipment1", "equipment2", "equipment3"]
+
+# 同じ表記が複数の種類に出てきたら、前の方の種類として1件にまとめる
+KINDS = ["code", "equipment", "term"]
+
+# 設備3の「インバータ #2」のような号機番号は外して1つの設備名にまとめる
+_UNIT_SUFFIX = re.compile(r"\s*#\d+$")
+
+# ひらがなだけの単語（する・ある・ない…）はどこにでも出てきて補完の邪魔なので外す
+_HIRAGANA_ONLY = re.compile(r"^[ぁ-ゟー]+$")
+
+# 接頭辞の範囲がこれより広ければ上位を先に計算しておく
+SCAN_LIMIT = 64
+# 1回に返せる最大件数
+MAX_LIMIT = 20
+
+_KATAKANA_TO_HIRAGANA = {code: code - 0x60 for code in range(0x30A1, 0x30F7)}
+
+
+def suggest_key(text: str) -> str:
+    """照合用のキー（全角半角・大文字小文字・カタカナひらがなの違いをならす）"""
+    return normalize_text(text).lower().translate(_KATAKANA_TO_HIRAGANA)
+
+
+def _is_term(token: str) -> bool:
+    if len(token) < 2 or token.isdigit() or _HIRAGANA_ONLY.match(token):
+        return False
+    # 記号だけのトークン
+    return any(ch.isalnum() for ch in token)
+
+
+class SuggestIndex:
+    """前方一致で候補を件数順に返す索引"""
+
+    def __init__(self, candidates: Iterable[Tuple[str, str, int]]):
+        """candidates: (表記, 種類, 件数)"""
+        merged: Dict[str, Tuple[str, int, int]] = {}
+        for label, kind, count in candidates:
+            key = suggest_key(label)
+            if not key or count <= 0:
+                continue
+            rank = KINDS.index(kind)
+            current = merged.get(key)
+            if current is None:
+                merged[key] = (label, rank, count)
+            else:
+                best = current if current[1] <= rank else (label, rank, current[2])
+                merged[key] = (best[0], best[1], max(current[2], count))
+
+        self.keys: List[str] = sorted(merged)
+        self.labels: List[str] = [merged[key][0] for key in self.keys]
+        self.kinds = np.asarray([merged[key][1] for key in self.keys], dtype=np.int8)
+        self.counts = np.asarray([merged[key][2] for key in self.keys], dtype=np.int64)
+
+        # 範囲の広い接頭辞 → 件数順の上位（self.keysの位置）
+        self._top: Dict[str, np.ndarray] = {}
+        self._build_top()
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _ranked(self, lo: int, hi: int, limit: int) -> np.ndarray:
+        """[lo, hi)を件数の多い順（同じならキー順）に上位limit件"""
+        counts = self.counts[lo:hi]
+        if hi - lo > limit:
+            part = np.argpartition(-counts, limit - 1)[:limit]
+        else:
+            part = np.arange(hi - lo)
+        order = part[np.lexsort((part, -counts[part]))]
+        return (order + lo).astype(np.int32)
+
+    def _build_top(self):
+        # 広い範囲を1文字ずつ伸ばしながら分けていく。
+        # 範囲が狭くなった接頭辞はそこで打ち切るので、全部の接頭辞を数えることはない
+        wide = [("", 0, len(self.keys))]
+        while wide:
+            next_wide = []
+            for prefix, lo, hi in wide:
+                if prefix:
+                    self._top[prefix] = self._ranked(lo, hi, MAX_LIMIT)
+                depth = len(prefix)
+                i = lo
+                # prefixそのもののキーはソート順で先頭に来る
+                while i < hi and len(self.keys[i]) == depth:
+                    i += 1
+                while i < hi:
+                    child = self.keys[i][:depth + 1]
+                    j = bisect_left(self.keys, child + "\U0010ffff", i, hi)
+                    if j - i > SCAN_LIMIT:
+                        next_wide.append((child, i, j))
+                    i = j
+            wide = next_wide
+
+    def suggest(self, text: str, limit: int = 8) -> List[Dict[str, Any]]:
+        """textで始まる候補を件数の多い順に返す"""
+        prefix = suggest_key(text)
+        if not prefix:
+            return []
+        limit = max(1, min(limit, MAX_LIMIT))
+
+        top = self._top.get(prefix)
+        if top is not None:
+            rows = top[:limit]
+        else:
+            lo = bisect_left(self.keys, prefix)
+            hi = bisect_left(self.keys, prefix + "\U0010ffff", lo)
+            if lo == hi:
+                return []
+            rows = self._ranked(lo, hi, limit)
+        return [
+            {"text": self.labels[row], "kind": KINDS[self.kinds[row]], "count": int(self.counts[row])}
+            for row in rows
+        ]
+
+    def stats(self) -> Dict[str, int]:
+        by_kind = np.bincount(self.kinds, minlength=len(KINDS)) if len(self.keys) else [0] * len(KINDS)
+        return {
+            "entries": len(self.keys),
+            "precomputed_prefixes": len(self._top),
+            **{kind: int(n) for kind, n in zip(KINDS, by_kind)},
+        }
+
+
+def build_suggest_index(
+    metadata: List[Dict[str, Any]],
+    max_terms: int = 50000,
+    min_term_count: int = 2,
+    sample_chunks: int = 20000,
+) -> SuggestIndex:
+    """
+    メタデータ（チャンク単位）から候補を作る
+
+    設備名とコードは文書単位で数える（1文書が複数チャンクでも1件）。
+    単語は見たチャンクのうちmin_term_count件以上に出てくるものを、多い順にmax_terms個まで。
+    """
+    equipment: Dict[str, int] = {}
+    codes: Dict[str, int] = {}
+    seen_equipment = set()
+    seen_codes = set()
+
+    for row, item in enumerate(metadata):
+        doc_id = item.get('doc_id') or row
+        meta = item.get('metadata', {})
+        for level in EQUIPMENT_LEVELS:
+            name = meta.get(level)
+            if name:
+                name = _UNIT_SUFFIX.sub("", name)
+            if name and (doc_id, name) not in seen_equipment:
+                seen_equipment.add((doc_id, name))
+                equipment[name] = equipment.get(name, 0) + 1
+        for code in extract_codes(item.get('text')):
+            if (doc_id, code) not in seen_codes:
+                seen_codes.add((doc_id, code))
+                codes[code] = codes.get(code, 0) + 1
+
+    step = max(1, -(-len(metadata) // sample_chunks)) if sample_chunks > 0 else 1
+    term_counts: Dict[str, int] = {}
+    for item in metadata[::step]:
+        for token in set(tokenizer.nouns(item.get('text', ''))):
+            term_counts[token] = term_counts.get(token, 0) + 1
+    terms = sorted(
+        ((token, count * step) for token, count in term_counts.items()
+         if count >= min_term_count and _is_term(token)),
+        key=lambda pair: -pair[1],
+    )[:max_terms]
+
+    candidates: List[Tuple[str, str, int]] = []
+    candidates.extend((code, "code", count) for code, count in codes.items())
+    candidates.extend((name, "equipment", count) for name, count in equipment.items())
+    candidates.extend((token, "term", count) for token, count in terms)
+
+    index = SuggestIndex(candidates)
+    logger.info(
+        f"入力補完の索引を作りました: {len(index)}件 "
+        f"(設備{len(equipment)}, コード{len(codes)}, 単語{len(terms)})"
+    )
+    return index
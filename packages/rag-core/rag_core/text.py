@@ -0,0 +1,28 @@
+"""
+テキストの正規化
+
+埋め込みキャッシュのキー、重複検出、エラーコードの抽出、サジェスト、
+検索キャッシュのキーとクエリログ（と、それを読むプリウォーム）で同じ正規化を使う。
+どこかで揃っていないと、同じクエリなのにキャッシュが外れたりログで別のクエリとして数えたりするので、
+ここに1つだけ置いておく。
+"""
+
+import re
+import unicodedata
+from typing import Any, Dict, Optional
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """全角半角と空白の揺れをならす（キーを安定させるため）"""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+
+def normalize_filters(filters: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """空の項目を落として値を並べ替える（項目内はORなので順番が違っても結果は同じ）"""
+    return {
+        name: sorted(value) if isinstance(value, list) else value
+        for name, value in sorted((filters or {}).items())
+        if value not in (None, [], "")
+    }
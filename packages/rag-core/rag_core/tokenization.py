@@ -8,6 +8,10 @@ WindowsのローカルでMeCab動かすの大変だったのでDocker使うこ
 import MeCab
 import unidic_lite
 import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from typing import List, Optional
 
 logger = logging.getLogger(__name__)
@@ -38,6 +42,7 @@ class TokenizerService:
             # パスにスペースが含まれてるとエラーになるので
             # ダブルクォートで囲む（Program Filesとか）
             tagger_args = f'-d "{dic_path}"'
+            self.tagger_args = tagger_args
             self.tagger = MeCab.Tagger(tagger_args)
             logger.info(f"MeCabトークナイザーの初期化に成功しました: {tagger_args}")
         except RuntimeError as e:
@@ -46,6 +51,8 @@ class TokenizerService:
             )
             logger.warning("フォールバック: シンプルな空白区切りトークナイザーを使用します。")
             self.tagger = None
+        self._noun_tagger = None
+        self._noun_lock = threading.Lock()
 
     def tokenize(self, text: str) -> List[str]:
         """
@@ -85,5 +92,62 @@ class TokenizerService:
         
         return tokens
 
+    def nouns(self, text: str) -> List[str]:
+        """
+        名詞を表層形のまま取り出す（数詞は除く）。入力補完の候補用
+
+        tokenize()は読みに寄せるので、画面に出す表記には使えない。
+        parseToNodeのノードは次のparseで壊れるので、検索で使うTaggerとは別のものを使う。
+        """
+        if not text or not isinstance(text, str):
+            return []
+        if not self.tagger:
+            return text.split()
+
+        with self._noun_lock:
+            if self._noun_tagger is None:
+                self._noun_tagger = MeCab.Tagger(self.tagger_args)
+            node = self._noun_tagger.parseToNode(text)
+            nouns = []
+            while node:
+                features = node.feature.split(',')
+                if node.surface and features[0] == '名詞' and features[1:2] != ['数詞']:
+                    nouns.append(node.surface)
+                node = node.next
+        return nouns
+
 # シングルトンインスタンス
 tokenizer = TokenizerService()
+
+
+def _tokenize_shard(texts: List[str]) -> List[List[str]]:
+    """ワーカープロセス側の処理。MeCabはプロセスごとに初期化済みのシングルトンを使う"""
+    return [tokenizer.tokenize(text) for text in texts]
+
+
+def tokenize_parallel(
+    texts: List[str],
+    workers: Optional[int] = None,
+    shard_size: int = 2000
+) -> List[List[str]]:
+    """
+    大量のテキストをプロセスプールでトークナイズ
+
+    MeCabはGILを握ったまま動くのでスレッドだと速くならない。
+    shard_size件ずつに分けてワーカーに投げる（1件ずつ投げるとpickleのコストが勝つ）。
+    結果の順番は入力と同じ。
+
+    ワーカーはspawnで起動する。build_index.pyの並列モードでは、別スレッドでtorchの
+    エンコードプールが動いている最中に呼ばれるので、forkだとスレッドやロックを握ったまま
+    複製された子プロセスが固まることがある（sentence-transformersのプールもspawn）。
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(texts) <= shard_size:
+        return _tokenize_shard(texts)
+
+    shards = [texts[i:i + shard_size] for i in range(0, len(texts), shard_size)]
+    tokenized: List[List[str]] = []
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        for result in executor.map(_tokenize_shard, shards):
+            tokenized.extend(result)
+    return tokenized
@@ -0,0 +1,48 @@
+# LRUキャッシュとリランクスコアのキャッシュのテスト
+
+from rag_core.caching import LRUCache
+from rag_core.reranker import Reranker
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # aを使ったのでbが一番古くなる
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()["hits"] == 3
+
+    disabled = LRUCache(0)
+    disabled.put("a", 1)
+    assert disabled.get("a") is None
+
+
+class FakeCrossEncoder:
+    def __init__(self):
+        self.pairs = 0
+
+    def predict(self, pairs, **kwargs):
+        self.pairs += len(pairs)
+        return [float(len(text)) for _, text in pairs]
+
+
+def test_rerank_scores_are_cached_per_query_and_text():
+    model = FakeCrossEncoder()
+    Reranker._model_cache["fake-cross-encoder"] = model
+    try:
+        reranker = Reranker(model_name="fake-cross-encoder")
+        results = [{"text": "短い"}, {"text": "もっと長い文書"}]
+
+        first = reranker.rerank("異音", results)
+        assert [r["text"] for r in first] == ["もっと長い文書", "短い"]
+        assert model.pairs == 2
+
+        # 同じクエリ（空白の揺れは無視）ならモデルを呼ばない
+        again = reranker.rerank(" 異音 ", results + [{"text": "新しい"}])
+        assert model.pairs == 3
+        assert [r["rerank_score"] for r in again] == [7.0, 3.0, 2.0]
+    finally:
+        del Reranker._model_cache["fake-cross-encoder"]
@@ -0,0 +1,18 @@
+# チャンク分割のテスト（文末での分割とオーバーラップ）
+
+from rag_core.chunking import TextChunker
+
+
+def test_split_keeps_sentence_endings():
+    chunker = TextChunker()
+    sentences = chunker._split_sentences("ポンプが停止。\n原因は？ベアリング摩耗！交換済み")
+
+    assert sentences == ["ポンプが停止。", "原因は？", "ベアリング摩耗！", "交換済み"]
+
+
+def test_chunks_overlap_previous_tail():
+    chunker = TextChunker(chunk_size=10, chunk_overlap=3)
+    chunks = chunker.chunk_text("あいうえお。かきくけこ。さしすせそ。", doc_id="doc1")
+
+    assert [c.text for c in chunks] == ["あいうえお。", "えお。かきくけこ。", "けこ。さしすせそ。"]
+    assert [c.chunk_id for c in chunks] == ["doc1_chunk_0", "doc1_chunk_1", "doc1_chunk_2"]
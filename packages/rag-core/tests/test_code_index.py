@@ -0,0 +1,73 @@
+# エラーコードの完全一致インデックスのテスト
+
+import numpy as np
+
+from rag_core.code_index import CodeIndex, extract_codes, parse_code_query
+from rag_core.sparse_index import BM25IndexManager
+
+TEXTS = [
+    "インバータにE-482が表示された。",
+    "E-428が出たのでP-905を初期化。",
+    "コンベアが停止。モーターを点検。",
+    "E-482とP-905。E-482が再発。",
+    "ＥＲＲ-９ではなくE-482。",
+]
+CORPUS = [
+    ["インバータ", "E-482", "表示"],
+    ["E-428", "P-905", "初期化"],
+    ["コンベア", "停止", "モーター"],
+    ["E-482", "P-905", "E-482", "再発"],
+    ["ERR-9", "E-482"],
+]
+
+
+def _metadata(texts, start=0):
+    return [
+        {"chunk_id": f"doc_{i}_chunk_0", "doc_id": f"doc_{i}", "text": text}
+        for i, text in enumerate(texts, start)
+    ]
+
+
+def test_parse_code_query():
+    assert extract_codes(TEXTS[3]) == ["E-482", "P-905"]
+    assert extract_codes(TEXTS[4]) == ["ERR-9", "E-482"]
+
+    # 小文字・全角でもコードとして扱う。よくある言葉や助詞は数えない
+    assert parse_code_query("E-482") == ["E-482"]
+    assert parse_code_query("e-482 エラー") == ["E-482"]
+    assert parse_code_query("Ｅ－４８２の対処") == ["E-482"]
+    assert parse_code_query("P-905 E-482 P-905") == ["P-905", "E-482"]
+    # コード以外の内容が多いクエリは普通の検索
+    assert parse_code_query("E-482 ベアリング交換") == []
+    assert parse_code_query("モーター異音") == []
+    # ハイフンのない型式や、英字に続く数字はコードではない（本文からも抜き出さない）
+    assert parse_code_query("GT2710") == []
+    assert parse_code_query("CV-X100") == []
+    assert parse_code_query("gt2710 エラー") == []
+    assert extract_codes("型式GT2710とCV-X100") == []
+
+
+def test_search_codes(tmp_path):
+    manager = BM25IndexManager(str(tmp_path / "m.bm25"), str(tmp_path / "m.bm25.meta.pkl"))
+    manager.build(CORPUS[:3])
+    manager.save(_metadata(TEXTS[:3]))
+    manager.add_segment(CORPUS[3:], _metadata(TEXTS[3:], 3))
+    assert manager.codes.rows("E-482") == [0, 3, 4]
+
+    # 両方のコードを含むチャンクが先頭、あとはBM25の順（P-905の方がIDFが大きい）
+    hits = manager.search_codes(["E-482", "P-905"], ["E-482", "P-905"])
+    assert [(item["doc_id"], matched) for item, _, matched in hits] == [
+        ("doc_3", 2), ("doc_1", 1), ("doc_4", 1), ("doc_0", 1),
+    ]
+    # スコアは全件で計算したBM25と同じ
+    full = manager._scorer.get_scores(["E-482", "P-905"])
+    assert np.allclose([score for _, score, _ in hits], full[[3, 1, 4, 0]])
+
+    # 消した文書は出てこない。マージしても同じ
+    manager.delete(doc_ids=["doc_3"])
+    assert {item["doc_id"] for item, _, _ in manager.search_codes(["E-482"], ["E-482"])} == {"doc_0", "doc_4"}
+    manager.merge_segments()
+    assert manager.codes.rows("E-482") == [0, 3]
+    assert manager.search_codes(["E-999"], ["E-999"]) == []
+
+    assert len(CodeIndex()) == 0
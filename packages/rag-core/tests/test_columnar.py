@@ -0,0 +1,63 @@
+# チャンクのParquet保存・読み込みのテスト
+
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from rag_core.chunking import Chunk, TextChunker
+from rag_core.columnar import (
+    ChunkParquetWriter,
+    chunks_to_table,
+    load_chunk_dicts_parquet,
+    load_chunks_parquet,
+    read_chunks_table,
+)
+
+
+def test_parquet_roundtrip(tmp_path):
+    """JSONLと同じチャンクに戻る。欠損（NaN）はNoneになる"""
+    chunker = TextChunker(chunk_size=10, chunk_overlap=0)
+    chunks = chunker.chunk_documents([
+        {"doc_id": "doc1", "text": "ポンプ停止。ベアリング交換。", "line": "A1000", "downtime_minutes": 30,
+         "prevention": float("nan")},
+        {"doc_id": "doc2", "text": "E-101発生", "line": "A1000", "downtime_minutes": 0,
+         "prevention": "定期点検"},
+    ])
+    path = tmp_path / "chunks.parquet"
+    chunker.save_chunks(chunks, path, format="parquet")
+
+    loaded = load_chunks_parquet(path)
+    assert [c.chunk_id for c in loaded] == [c.chunk_id for c in chunks]
+    assert [c.text for c in loaded] == [c.text for c in chunks]
+    assert loaded[0].metadata["prevention"] is None
+    assert loaded[2].metadata == chunks[2].metadata
+
+    # textだけ読める
+    table = read_chunks_table(path, columns=["text"])
+    assert table.column_names == ["text"]
+
+
+def test_writer_keeps_values_after_all_null_block(tmp_path):
+    """最初のブロックで全部欠損していた列も、後のブロックの値が消えない"""
+    def chunk(i, **meta):
+        return Chunk(chunk_id=f"doc{i}_chunk_0", text=f"記録{i}", metadata=meta, chunk_index=0, doc_id=f"doc{i}")
+
+    path = tmp_path / "chunks.parquet"
+    writer = ChunkParquetWriter(path)
+    writer.write_table(chunks_to_table([chunk(0, prevention=None, line="A1000")]))
+    writer.write_table(chunks_to_table([chunk(1, prevention="定期点検", line=None)]))
+    writer.write_table(chunks_to_table([chunk(2, prevention=None, line="B2000")]))
+    writer.close()
+
+    assert [c.metadata for c in load_chunks_parquet(path)] == [
+        {"prevention": None, "line": "A1000"},
+        {"prevention": "定期点検", "line": None},
+        {"prevention": None, "line": "B2000"},
+    ]
+
+    # インデックス構築用: to_dict()の形で、メタデータは指定した項目だけ読む
+    dicts = load_chunk_dicts_parquet(path, metadata_fields=["prevention", "missing"])
+    assert dicts[1] == {
+        "chunk_id": "doc1_chunk_0", "text": "記録1", "metadata": {"prevention": "定期点検"},
+        "chunk_index": 0, "doc_id": "doc1",
+    }
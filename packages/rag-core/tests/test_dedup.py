@@ -0,0 +1,60 @@
+# ほぼ同じチャンクのまとめのテスト
+
+from rag_core.dedup import DuplicateGroups, deduplicate, lsh_params, save_duplicates
+
+BASE = "ベルトコンベアから異音が発生。ローラーベアリングの摩耗を確認し、交換した。定期点検項目に追加。"
+
+
+def _item(chunk_id, text, eq2="搬送設備", eq3="ベルトコンベア #1"):
+    return {
+        "chunk_id": chunk_id,
+        "doc_id": chunk_id.split("_")[0],
+        "text": text,
+        "metadata": {"equipment2": eq2, "equipment3": eq3},
+    }
+
+
+def test_near_duplicates_collapse_within_group(tmp_path):
+    items = [
+        _item("d1_chunk_0", BASE),
+        # 号機と語尾が違うだけ → d1にまとまる
+        _item("d2_chunk_0", BASE.replace("交換した", "交換しました"), eq3="ベルトコンベア #2"),
+        # 内容が違う
+        _item("d3_chunk_0", "インバータにE-416が表示された。パラメータP-012を初期化して復旧。"),
+        # 同じ内容でもgroup_byの項目が違えばまとめない
+        _item("d4_chunk_0", BASE, eq2="加工設備"),
+    ]
+    indexed, duplicates = deduplicate(items, threshold=0.7, group_by=["equipment2"])
+
+    assert [item["chunk_id"] for item in indexed] == ["d1_chunk_0", "d3_chunk_0", "d4_chunk_0"]
+    assert indexed[0]["duplicates"] == ["d2_chunk_0"]
+    assert "duplicates" not in indexed[1]
+    assert [(d["chunk_id"], d["representative"]) for d in duplicates] == [("d2_chunk_0", "d1_chunk_0")]
+
+    path = tmp_path / "maintenance.duplicates.json"
+    save_duplicates(path, duplicates)
+    groups = DuplicateGroups.load(path, indexed)
+    assert len(groups) == 1
+    assert [d["chunk_id"] for d in groups.members("d1_chunk_0")] == ["d2_chunk_0"]
+    assert groups.members("d3_chunk_0") == []
+    # 代表からでもまとめたチャンクからでも同じグループが引ける（代表が先頭）
+    assert [c["chunk_id"] for c in groups.group(duplicates[0])] == ["d1_chunk_0", "d2_chunk_0"]
+    assert [c["chunk_id"] for c in groups.group(indexed[1])] == ["d3_chunk_0"]
+
+    # ファイルがなければ空（まとめずに作ったインデックス）
+    assert len(DuplicateGroups.load(tmp_path / "missing.json")) == 0
+
+
+def test_lsh_params_put_s_curve_at_threshold():
+    for threshold, num_perm in [(0.7, 128), (0.5, 128), (0.8, 64)]:
+        bands, rows = lsh_params(threshold, num_perm)
+        # 使わないハッシュは1バンド分に満たない端数だけ
+        assert bands * rows <= num_perm < (bands + 1) * rows
+        # S字カーブの立ち上がり (1/b)^(1/r) がthresholdの近く
+        assert abs((1 / bands) ** (1 / rows) - threshold) < 0.05
+
+    # 0.7なら、類似度0.5はほぼ候補にならず、0.9はほぼ必ず候補になる
+    bands, rows = lsh_params(0.7, 128)
+    def p(s):
+        return 1 - (1 - s ** rows) ** bands
+    assert p(0.5) < 0.05 and p(0.9) > 0.95
@@ -0,0 +1,26 @@
+# doc_id → チャンクの索引のテスト
+
+from rag_core.chunking import TextChunker
+from rag_core.doc_index import DocIndex, merge_chunk_texts
+
+
+def test_chunks_in_chunk_index_order():
+    """差分更新で行が離れていても、chunk_index順にまとまる"""
+    metadata = [
+        {"chunk_id": "doc1_chunk_1", "doc_id": "doc1", "chunk_index": 1, "text": "b"},
+        {"chunk_id": "doc2_chunk_0", "doc_id": "doc2", "chunk_index": 0, "text": "x"},
+        {"chunk_id": "doc1_chunk_0", "doc_id": "doc1", "chunk_index": 0, "text": "a"},
+    ]
+    index = DocIndex(metadata)
+
+    assert [c["chunk_id"] for c in index.chunks("doc1")] == ["doc1_chunk_0", "doc1_chunk_1"]
+    assert index.chunks("missing") == []
+    assert len(index) == 2
+
+
+def test_merge_removes_overlap():
+    text = "ポンプから異音が発生した。ベアリングを点検したところ摩耗が見られた。新品に交換して試運転を行った。"
+    chunks = TextChunker(chunk_size=30, chunk_overlap=10).chunk_text(text, doc_id="doc1")
+
+    assert len(chunks) > 1
+    assert merge_chunk_texts([c.text for c in chunks]) == text
@@ -0,0 +1,64 @@
+# 埋め込みストアのテスト
+# モデルは読み込まず、呼ばれた回数を数えるだけのエンコーダーで確認する
+
+import numpy as np
+
+from rag_core.embedding_store import EmbeddingStore
+
+
+class CountingEncoder:
+    def __init__(self, dimension=4):
+        self.dimension = dimension
+        self.encoded = []
+
+    def __call__(self, texts):
+        self.encoded.extend(texts)
+        return np.array(
+            [[len(text), i, 0.5, 1.0][:self.dimension] for i, text in enumerate(texts)],
+            dtype=np.float32
+        )
+
+
+def test_only_new_texts_are_encoded(tmp_path):
+    """2回目は変わったチャンクだけエンコードされ、ベクトルは前回と同じ"""
+    encoder = CountingEncoder()
+    store = EmbeddingStore(tmp_path, "model-a", 4)
+    first = store.get_or_encode(["ポンプ異音", "E-101 停止", "ポンプ異音"], encoder)
+    assert encoder.encoded == ["ポンプ異音", "E-101 停止"]
+
+    # 開き直しても残っている。空白・全角の揺れは同じキーになる
+    encoder.encoded = []
+    store = EmbeddingStore(tmp_path, "model-a", 4)
+    second = store.get_or_encode(["ポンプ異音 ", "Ｅ-101  停止", "ベアリング交換"], encoder)
+    assert encoder.encoded == ["ベアリング交換"]
+    np.testing.assert_array_equal(second[:2], first[:2])
+    assert len(store) == 3
+
+
+def test_model_change_invalidates(tmp_path):
+    """モデルが変わったら古いベクトルは使わない"""
+    EmbeddingStore(tmp_path, "model-a", 4).get_or_encode(["ポンプ異音"], CountingEncoder())
+
+    encoder = CountingEncoder()
+    store = EmbeddingStore(tmp_path, "model-b", 4)
+    assert len(store) == 0
+    store.get_or_encode(["ポンプ異音"], encoder)
+    assert encoder.encoded == ["ポンプ異音"]
+
+
+def test_compact_keeps_only_current_texts(tmp_path):
+    """詰め直すと今のチャンク以外のベクトルが消え、残したベクトルは変わらない"""
+    store = EmbeddingStore(tmp_path, "model-a", 4)
+    before = store.get_or_encode(["ポンプ異音", "E-101 停止", "ベアリング交換"], CountingEncoder())
+
+    assert store.compact(["ベアリング交換", "ポンプ異音", "新しいチャンク"]) == 1
+    assert store.compact(["ベアリング交換", "ポンプ異音"]) == 0
+    assert (tmp_path / "keys.bin").stat().st_size == 2 * 16
+
+    # 開き直しても同じ。消したテキストだけエンコードし直す
+    encoder = CountingEncoder()
+    store = EmbeddingStore(tmp_path, "model-a", 4)
+    after = store.get_or_encode(["ポンプ異音", "ベアリング交換", "E-101 停止"], encoder)
+    assert encoder.encoded == ["E-101 停止"]
+    np.testing.assert_array_equal(after[0], before[0])
+    np.testing.assert_array_equal(after[1], before[2])
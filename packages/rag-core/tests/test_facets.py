@@ -0,0 +1,36 @@
+# ファセット集計のテスト
+
+from rag_core.facets import FacetIndex
+
+
+def _item(chunk_id, doc_id, line, work_type):
+    return {
+        "chunk_id": chunk_id,
+        "doc_id": doc_id,
+        "metadata": {"line": line, "work_type": work_type},
+    }
+
+
+METADATA = [
+    _item("d1_chunk_0", "d1", "A1000", "修理票"),
+    _item("d1_chunk_1", "d1", "A1000", "修理票"),  # 同じ文書の2チャンク目
+    _item("d2_chunk_0", "d2", "A1000", "重大故障"),
+    _item("d3_chunk_0", "d3", "B2000", "修理票"),
+]
+
+
+def test_corpus_counts_are_per_document():
+    index = FacetIndex(METADATA)
+
+    counts = index.counts(mask=index.mask({"productionLines": ["A1000"]}))
+    assert counts["productionLines"] == {"A1000": 2}
+    assert counts["workTypes"] == {"修理票": 1, "重大故障": 1}
+
+
+def test_matched_counts_from_candidates():
+    index = FacetIndex(METADATA)
+
+    counts = index.counts(rows=index.rows(["d1_chunk_1", "d1_chunk_0", "d3_chunk_0"]))
+    assert counts["productionLines"] == {"A1000": 1, "B2000": 1}
+    # 存在しない値でフィルターすると0件
+    assert not index.mask({"productionLines": ["Z9999"]}).any()
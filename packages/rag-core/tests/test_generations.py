@@ -0,0 +1,38 @@
+# インデックス世代（manifest / CURRENT）の切り替えを確認するテスト
+# 実際のインデックスファイルは作らず、パスの解決だけ見る
+
+from rag_core.generations import (
+    LEGACY_GENERATION,
+    IndexManifest,
+    create_generation_dir,
+    current_generation,
+    list_generations,
+    publish_generation,
+    resolve_manifest,
+)
+
+
+def test_legacy_layout_without_current(tmp_path):
+    """CURRENTがなければ直下のファイルを使う（従来の配置）"""
+    manifest = resolve_manifest(tmp_path)
+
+    assert manifest.generation == LEGACY_GENERATION
+    assert manifest.path("faiss") == tmp_path / "maintenance.faiss"
+
+
+def test_publish_switches_current(tmp_path):
+    """公開した世代がCURRENTになり、manifestのパスが世代ディレクトリを指す"""
+    gen1, dir1 = create_generation_dir(tmp_path, "gen1")
+    publish_generation(tmp_path, IndexManifest(generation=gen1, base_dir=dir1, num_chunks=10))
+    gen2, dir2 = create_generation_dir(tmp_path, "gen2")
+    publish_generation(tmp_path, IndexManifest(generation=gen2, base_dir=dir2, num_chunks=20))
+
+    assert current_generation(tmp_path) == "gen2"
+    assert list_generations(tmp_path) == ["gen1", "gen2"]
+
+    manifest = resolve_manifest(tmp_path)
+    assert manifest.num_chunks == 20
+    assert manifest.path("bm25") == dir2 / "maintenance.bm25"
+
+    # 世代を指定すれば古い世代も読める（ロールバック用）
+    assert resolve_manifest(tmp_path, "gen1").base_dir == dir1
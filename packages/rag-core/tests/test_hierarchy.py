@@ -0,0 +1,47 @@
+# 設備階層の木のテスト
+
+from rag_core.hierarchy import ROOT, HierarchyIndex
+
+
+def _item(chunk_id, doc_id, location, line, eq1=None, eq2=None):
+    return {
+        "chunk_id": chunk_id,
+        "doc_id": doc_id,
+        "metadata": {"location": location, "line": line, "equipment1": eq1, "equipment2": eq2},
+    }
+
+
+METADATA = [
+    _item("d1_chunk_0", "d1", "第2工場", "B1000", "制御盤", "操作盤"),
+    _item("d1_chunk_1", "d1", "第2工場", "B1000", "制御盤", "操作盤"),  # 同じ文書の2チャンク目
+    _item("d2_chunk_0", "d2", "第1工場", "A1000", "搬送設備"),
+    _item("d3_chunk_0", "d3", "第1工場", "A2000"),
+    _item("d4_chunk_0", "d4", "第1工場", "A1000", "搬送設備", "ベルトコンベア"),
+    _item("d5_chunk_0", "d5", "第1工場", None),  # ラインがないので入らない
+]
+
+
+def test_children_are_sorted_with_document_counts():
+    tree = HierarchyIndex(METADATA)
+
+    top = tree.children(ROOT)
+    assert [tree.label(n) for n in top] == ["第1工場", "第2工場"]
+    assert [int(tree.count[n]) for n in top] == [3, 1]
+    assert int(tree.count[ROOT]) == 4
+
+    node = tree.find(["第1工場", "A1000"])
+    assert tree.path(node) == ["第1工場", "A1000"]
+    assert tree.num_children(node) == 1
+    (eq1,) = tree.children(node)
+    assert tree.label(eq1) == "搬送設備" and int(tree.count[eq1]) == 2
+    assert [tree.label(n) for n in tree.children(eq1)] == ["ベルトコンベア"]
+
+
+def test_find_and_paging():
+    tree = HierarchyIndex(METADATA)
+
+    assert tree.find(["第1工場", "B1000"]) is None
+    assert tree.find([]) == ROOT
+    lines = tree.find(["第1工場"])
+    assert [tree.label(n) for n in tree.children(lines, offset=1, limit=5)] == ["A2000"]
+    assert len(tree.children(lines, offset=5)) == 0
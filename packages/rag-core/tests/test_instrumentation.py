@@ -0,0 +1,25 @@
+# ステージ計測のテスト
+
+from rag_core.instrumentation import add_observer, collect, remove_observer, stage
+
+
+def test_stage_records_into_collected_timings_and_observers():
+    seen = []
+    observer = lambda name, seconds: seen.append(name)  # noqa: E731
+    add_observer(observer)
+    try:
+        timings = {}
+        with collect(timings):
+            with stage("dense"):
+                pass
+            # 入れ子でNoneを渡しても外側の辞書に記録される
+            with collect(None), stage("rerank"):
+                pass
+        with stage("outside"):
+            pass
+    finally:
+        remove_observer(observer)
+
+    assert set(timings) == {"dense", "rerank"}
+    assert all(ms >= 0 for ms in timings.values())
+    assert seen == ["dense", "rerank", "outside"]
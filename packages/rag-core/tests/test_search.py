@@ -71,3 +71,17 @@ def test_text_normalization():
     
     assert normalized == "全角スペース と  半角スペース"
 
+
+# テストケース3: Dense（L2距離）とSparseの順位がそのまま使われるか
+def test_hybrid_rrf_uses_result_order():
+    """FAISSのL2距離は小さい方が近いので、スコアで並べ直すと逆順になってしまう"""
+    from rag_core.search import HybridSearcher
+
+    searcher = HybridSearcher.__new__(HybridSearcher)  # インデックスもモデルも読まない
+    dense = {"doc_near": 0.1, "doc_far": 0.9}  # L2距離（近い順）
+    sparse = {"doc_other": 12.0, "doc_near": 3.0}  # BM25スコア（高い順）
+
+    fused = dict(searcher._reciprocal_rank_fusion([dense, sparse]))
+
+    assert fused["doc_near"] > fused["doc_far"]
+    assert fused["doc_other"] > fused["doc_far"]
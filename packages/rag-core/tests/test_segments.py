@@ -0,0 +1,143 @@
+# 差分更新（セグメント + tombstone）のテスト
+# 「ベース + セグメント」と「全件再構築」で検索結果が同じになるかを確認する
+
+import numpy as np
+
+from rag_core.dense_index import FaissIndexManager
+from rag_core.sparse_index import BM25IndexManager
+
+CORPUS = [
+    ["コンベア", "停止", "モーター"],
+    ["エラー", "E-482", "表示"],
+    ["油圧", "ポンプ", "漏れ"],
+    ["コンベア", "ベルト", "スリップ"],
+    ["センサー", "検出", "不良"],
+    ["モーター", "過負荷", "アラーム"],
+]
+
+
+def _metadata(n, prefix="doc"):
+    return [{"chunk_id": f"{prefix}_{i}_chunk_0", "doc_id": f"{prefix}_{i}", "text": ""} for i in range(n)]
+
+
+def _ids(results):
+    # 同点の並び順は保証されないので、スコア → chunk_id の順で並べて比べる
+    return [item["chunk_id"] for item, score in sorted(results, key=lambda r: (-round(r[1], 9), r[0]["chunk_id"]))]
+
+
+def test_bm25_segments_match_full_rebuild(tmp_path):
+    metadata = _metadata(len(CORPUS))
+
+    # ベース4件 + セグメント2件、doc_1は削除
+    incremental = BM25IndexManager(str(tmp_path / "inc.bm25"), str(tmp_path / "inc.bm25.meta.pkl"))
+    incremental.build(CORPUS[:4])
+    incremental.save(metadata[:4])
+    incremental.add_segment(CORPUS[4:], metadata[4:])
+    assert incremental.delete(doc_ids=["doc_1"]) == 1
+
+    full = BM25IndexManager(str(tmp_path / "full.bm25"), str(tmp_path / "full.bm25.meta.pkl"))
+    live = [i for i in range(len(CORPUS)) if i != 1]
+    full.build([CORPUS[i] for i in live])
+    full.save([metadata[i] for i in live])
+
+    for query in (["コンベア"], ["モーター", "アラーム"], ["E-482"]):
+        inc_results = incremental.search(query, top_k=5)
+        full_results = full.search(query, top_k=5)
+        assert _ids(inc_results) == _ids(full_results)
+        assert np.allclose([s for _, s in inc_results], [s for _, s in full_results])
+
+    # ファイルから読み直しても、マージしても同じ
+    reloaded = BM25IndexManager(str(tmp_path / "inc.bm25"), str(tmp_path / "inc.bm25.meta.pkl"))
+    assert _ids(reloaded.search(["コンベア"], 5)) == _ids(full.search(["コンベア"], 5))
+    reloaded.merge_segments()
+    assert reloaded.segment_log.is_empty
+    assert _ids(reloaded.search(["コンベア"], 5)) == _ids(full.search(["コンベア"], 5))
+
+
+def test_faiss_segments_match_full_rebuild(tmp_path):
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((50, 16)).astype(np.float32)
+    metadata = _metadata(50)
+    query = rng.standard_normal(16).astype(np.float32)
+
+    incremental = FaissIndexManager(str(tmp_path / "inc.faiss"), str(tmp_path / "inc.faiss.meta.json"))
+    incremental.build(vectors[:40].copy())
+    incremental.save(metadata[:40])
+    incremental.add_segment(vectors[40:].copy(), metadata[40:])
+    incremental.delete(chunk_ids=["doc_3_chunk_0", "doc_45_chunk_0"])
+
+    live = [i for i in range(50) if i not in (3, 45)]
+    full = FaissIndexManager(str(tmp_path / "full.faiss"), str(tmp_path / "full.faiss.meta.json"))
+    full.build(vectors[live].copy())
+    full.save([metadata[i] for i in live])
+
+    assert _ids(incremental.search(query.copy(), 10)) == _ids(full.search(query.copy(), 10))
+
+    incremental.merge_segments()
+    assert len(incremental.metadata) == 48
+    assert _ids(incremental.search(query.copy(), 10)) == _ids(full.search(query.copy(), 10))
+
+
+def test_merge_is_published_by_new_file_names(tmp_path):
+    # マージは新しいファイル名に書くだけ。古いファイル一式は公開するまでそのまま（途中で落ちても元に戻る）
+    metadata = _metadata(len(CORPUS))
+    manager = BM25IndexManager(str(tmp_path / "m.bm25"), str(tmp_path / "m.bm25.meta.pkl"))
+    manager.build(CORPUS[:4])
+    manager.save(metadata[:4])
+    manager.add_segment(CORPUS[4:], metadata[4:])
+    manager.delete(doc_ids=["doc_1"])
+    before = _ids(manager.search(["コンベア", "モーター"], 5))
+
+    superseded = manager.merge_segments()
+    assert manager.index_path.name == "m.merged000001.bm25"
+    assert manager.segment_log.is_empty and not manager.segment_log.path.exists()
+    assert all(path.exists() for path in superseded)
+
+    old = BM25IndexManager(str(tmp_path / "m.bm25"), str(tmp_path / "m.bm25.meta.pkl"))
+    assert len(old.segment_log.segments) == 1 and old.tombstones == {1}
+    assert _ids(old.search(["コンベア", "モーター"], 5)) == before
+
+    merged = BM25IndexManager(str(manager.index_path), str(manager.metadata_path))
+    assert merged.segment_log.is_empty and len(merged.metadata) == 5
+    assert _ids(merged.search(["コンベア", "モーター"], 5)) == before
+
+
+def test_faiss_merge_keeps_loaded_index_type(tmp_path):
+    import faiss
+
+    rng = np.random.default_rng(1)
+    vectors = rng.standard_normal((200, 16)).astype(np.float32)
+    manager = FaissIndexManager(str(tmp_path / "m.faiss"), str(tmp_path / "m.faiss.meta.json"))
+    # 設定のindex_type（Flat）ではなく、読み込んだインデックスの種類で作り直す
+    manager.index = faiss.index_factory(16, "IVF4,Flat", faiss.METRIC_INNER_PRODUCT)
+    manager.train(vectors[:180].copy())
+    manager.add_batch(vectors[:180].copy())
+    manager.save(_metadata(180))
+    manager.add_segment(vectors[180:].copy(), _metadata(20, "new"))
+    manager.delete(doc_ids=["doc_0"])
+
+    manager.merge_segments()
+    assert faiss.try_extract_index_ivf(manager.index) is not None
+    assert manager.index.ntotal == 199
+    reloaded = FaissIndexManager(str(manager.index_path), str(manager.metadata_path))
+    assert faiss.try_extract_index_ivf(reloaded.index) is not None
+
+
+def test_bm25_stats_follow_adds_and_deletes(tmp_path):
+    # 統計は足し引きで更新する。全件再構築と同じIDF（消えた単語はIDFからも消える）になる
+    metadata = _metadata(len(CORPUS))
+    manager = BM25IndexManager(str(tmp_path / "m.bm25"), str(tmp_path / "m.bm25.meta.pkl"))
+    manager.build(CORPUS[:3])
+    manager.save(metadata[:3])
+    manager.delete(doc_ids=["doc_1"])
+    manager.add_segment(CORPUS[3:5], metadata[3:5])
+    manager = BM25IndexManager(str(tmp_path / "m.bm25"), str(tmp_path / "m.bm25.meta.pkl"))
+    manager.add_segment(CORPUS[5:], metadata[5:])
+    manager.delete(doc_ids=["doc_4"])
+
+    live = [0, 2, 3, 5]
+    full = BM25IndexManager(str(tmp_path / "full.bm25"), str(tmp_path / "full.bm25.meta.pkl"))
+    full.build([CORPUS[i] for i in live])
+    assert manager._scorer.idf.keys() == full.index.idf.keys()
+    assert all(np.isclose(manager._scorer.idf[word], idf) for word, idf in full.index.idf.items())
+    assert np.isclose(manager._scorer.avgdl, full.index.avgdl)
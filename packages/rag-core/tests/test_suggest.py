@@ -0,0 +1,53 @@
+# 入力補完の索引のテスト
+
+from rag_core import suggest as suggest_module
+from rag_core.suggest import SuggestIndex, build_suggest_index
+
+
+def _item(chunk_id, doc_id, text, eq1=None, eq2=None, eq3=None):
+    return {
+        "chunk_id": chunk_id,
+        "doc_id": doc_id,
+        "text": text,
+        "metadata": {"equipment1": eq1, "equipment2": eq2, "equipment3": eq3},
+    }
+
+
+METADATA = [
+    _item("d1_chunk_0", "d1", "インターロックが働きE-416が表示された。", "電気", "駆動制御", "インバータ #1"),
+    _item("d1_chunk_1", "d1", "インターロックを解除してP-012を初期化。", "電気", "駆動制御", "インバータ #1"),
+    _item("d2_chunk_0", "d2", "インターロックが外れずE-401が出た。", "電気", "駆動制御", "インバータ #2"),
+    _item("d3_chunk_0", "d3", "ＥＲＲ-９ではなくE-416。異音あり。", "機械", "搬送設備", "ベルトコンベア"),
+]
+
+
+def test_ranked_by_count_and_normalized():
+    index = build_suggest_index(METADATA)
+
+    # コードは文書単位で数える（d1は2チャンクに出てくるが1件）。全角も拾う
+    assert index.suggest("e-4") == [
+        {"text": "E-416", "kind": "code", "count": 2},
+        {"text": "E-401", "kind": "code", "count": 1},
+    ]
+    assert [s["text"] for s in index.suggest("ERR")] == ["ERR-9"]
+
+    # ひらがなで打ってもカタカナの候補が出る。号機番号は外して1つの設備名にまとめる
+    assert index.suggest("いん") == [
+        {"text": "インターロック", "kind": "term", "count": 3},
+        {"text": "インバータ", "kind": "equipment", "count": 2},
+    ]
+    # 1チャンクにしか出てこない単語は入らない
+    assert index.suggest("異") == []
+    assert index.suggest("") == [] and index.suggest("ZZZ") == []
+
+
+def test_wide_prefixes_use_precomputed_top(monkeypatch):
+    monkeypatch.setattr(suggest_module, "SCAN_LIMIT", 3)
+    candidates = [(f"P-{i:03d}", "code", i % 7 + 1) for i in range(50)] + [("Pump", "term", 100)]
+    index = SuggestIndex(candidates)
+
+    assert "p" in index._top and "p-0" in index._top
+    top = index.suggest("p", limit=3)
+    assert [s["text"] for s in top] == ["Pump", "P-006", "P-013"]
+    # 狭い範囲はその場で並べる。どちらも同じ順序になる
+    assert [s["text"] for s in index.suggest("P-00", limit=2)] == ["P-006", "P-005"]
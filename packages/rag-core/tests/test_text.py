@@ -0,0 +1,16 @@
+# テキストの正規化のテスト
+
+from rag_core.text import normalize_filters, normalize_text
+
+
+def test_normalize_text_folds_width_and_spaces():
+    assert normalize_text("　Ｅ－４８２\t 異音 ") == "E-482 異音"
+    # 正規化済みのもの（クエリログに書いたクエリ）をもう一度通しても変わらない
+    assert normalize_text(normalize_text("　Ｅ－４８２\t 異音 ")) == "E-482 異音"
+
+
+def test_normalize_filters_drops_empty_and_sorts():
+    filters = {"line": ["B", "A"], "site": None, "area": "", "eq": []}
+    assert normalize_filters(filters) == {"line": ["A", "B"]}
+    assert list(normalize_filters({"b": "x", "a": "y"})) == ["a", "b"]
+    assert normalize_filters(None) == {}
@@ -38,6 +38,7 @@ class SearchRequest(BaseModel):
     query: str = Field(..., min_length=1, max_length=200)
     filters: Optional[SearchFilters] = None
     k: int = Field(default=5, ge=1, le=20)
+    facets: bool = False  # Trueならファセットの件数も返す
 
 class SearchResult(BaseModel):
     """個別検索結果モデル"""
@@ -57,12 +58,35 @@ class SearchResult(BaseModel):
     action_taken: Optional[str] = None
     parts_replaced: Optional[str] = None
     operator: Optional[str] = None
+    chunk_id: Optional[str] = None
+    # 代表にまとめたほぼ同じ記録の件数（/api/docs/{doc_id}/duplicates で展開する）
+    duplicate_count: int = 0
+
+class FacetCounts(BaseModel):
+    """
+    ファセットごとの件数（文書単位）
+
+    キーはフィルター名（productionLines, equipment1s, workTypes など）、値は {値: 件数}
+    - matched: 今のクエリでヒットした候補（フィルター適用後、リランク前）
+    - corpus: フィルターに合う全文書
+    """
+    matched: Dict[str, Dict[str, int]]
+    corpus: Dict[str, Dict[str, int]]
+
+class ProfileEntry(BaseModel):
+    """cProfileの1関数分（?profile=1のときだけ）"""
+    function: str
+    calls: int
+    total_ms: float
+    cumulative_ms: float
 
 class SearchResponse(BaseModel):
     """検索レスポンスモデル"""
     results: List[SearchResult]
     total: int
     processingTime: int
+    facets: Optional[FacetCounts] = None
+    profile: Optional[List[ProfileEntry]] = None  # ?profile=1（管理者のみ）
 
 class DocumentChunk(BaseModel):
     """ドキュメントチャンクモデル"""
@@ -86,15 +110,75 @@ class DocumentDetail(BaseModel):
 class FeedbackRequest(BaseModel):
     """フィードバックリクエスト"""
     doc_id: str
+    rating: int = Field(..., ge=1, le=5)
+    comment: Optional[str] = Field(None, max_length=2000)
+    helpful: bool
+
+class FeedbackEntry(BaseModel):
+    """保存済みのフィードバック1件"""
+    id: int
+    received_at: float  # UNIX時間
+    doc_id: str
     rating: int
-    comment: Optional[str] = None
     helpful: bool
+    comment: Optional[str] = None
+
+class FeedbackPage(BaseModel):
+    """フィードバックの一括取得（idの昇順。next_after_idを渡すと続きを取れる）"""
+    items: List[FeedbackEntry]
+    next_after_id: Optional[int] = None
 
 class HierarchyNode(BaseModel):
-    """階層構造のノード"""
+    """
+    階層構造のノード
+
+    フィルター用メタデータには工場（最上位）だけを入れる。
+    その下は /api/search/hierarchy で開いたときに取得する。
+    """
     id: str
     label: str
     children: List['HierarchyNode'] = []
+    nodeId: Optional[int] = None
+    count: Optional[int] = None
+    hasChildren: bool = False
+
+class HierarchyChild(BaseModel):
+    """子ノード1件"""
+    id: str  # フィルターに使う値
+    label: str
+    nodeId: int  # 世代の中でだけ有効な番号
+    count: int  # 文書数
+    hasChildren: bool
+
+class HierarchyChildren(BaseModel):
+    """
+    あるノードの子（ページ分け）
+
+    nodeIdは世代が変わると振り直されるので、generationが変わったらpathで引き直す。
+    """
+    generation: str
+    nodeId: int
+    path: List[str]
+    count: int
+    total: int  # 子の総数
+    offset: int
+    children: List[HierarchyChild]
+
+class Suggestion(BaseModel):
+    """入力補完の候補1件"""
+    text: str
+    kind: str  # equipment / code / term
+    count: int  # 出てくる文書数（termはチャンク数）
+
+class SuggestResponse(BaseModel):
+    """入力補完（件数の多い順）"""
+    query: str
+    suggestions: List[Suggestion]
+
+class DuplicatesResponse(BaseModel):
+    """インデックス構築時に同じグループにまとめたほぼ同じ記録"""
+    doc_id: str
+    results: List[SearchResult]
 
 class FilterMetadata(BaseModel):
     """
@@ -125,3 +209,30 @@ class HealthResponse(BaseModel):
     index_loaded: bool
     model_loaded: bool
     vectors: int
+
+class IndexReloadRequest(BaseModel):
+    """インデックス再読み込みリクエスト"""
+    generation: Optional[str] = None  # 省略時はCURRENTが指す世代
+    force: bool = False
+
+class IndexGenerationInfo(BaseModel):
+    """読み込み中のインデックス世代"""
+    generation: str
+    documents: int
+    loaded_at: float
+    inflight: int
+
+class MemoryAllocation(BaseModel):
+    """tracemallocの差分（行ごと）"""
+    location: str
+    size_diff: int
+    count_diff: int
+    size: int
+
+class ProfileResult(BaseModel):
+    """サンプリングプロファイラの結果"""
+    seconds: float
+    interval_ms: float
+    samples: int
+    collapsed: str  # flamegraph.pl / speedscope に渡せる形式
+    memory: Optional[List[MemoryAllocation]] = None
@@ -8,28 +8,56 @@ FastAPIで検索APIを提供する。
 import asyncio
 import logging
 import math
+import secrets
 import time
 import uvicorn
 from contextlib import asynccontextmanager
 from datetime import datetime
 from functools import partial
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic_settings import BaseSettings
 
 # rag-coreパッケージから共通ロジックをインポート
-from rag_core import HybridSearcher, settings as core_settings
+from rag_core import settings as core_settings
+from rag_core.caching import LRUCache
+from rag_core.doc_index import DocIndex, merge_chunk_texts
+from rag_core.hierarchy import ROOT, HierarchyIndex
+from rag_core.instrumentation import add_observer, collect, remove_observer, stage
 
 from src.api.models import (
     SearchRequest,
     SearchResponse,
     DocumentDetail,
+    FeedbackPage,
+    FeedbackRequest,
     FilterMetadata,
-    SearchResult,
     HierarchyNode,
+    HierarchyChild,
+    HierarchyChildren,
+    IndexReloadRequest,
+    IndexGenerationInfo,
+    ProfileResult,
+    SuggestResponse,
+    DuplicatesResponse,
 )
+from src.services.feedback_store import FeedbackQueueFull, FeedbackStore
+from src.services.index_manager import IndexGeneration, IndexManager
+from src.services.profiling import MemoryDiff, SamplingProfiler, profile_call
+from src.services.query_log import QueryLog
+from src.services.metrics import (
+    SEARCH_SECONDS,
+    InstrumentedExecutor,
+    observe_stage,
+    metrics_response,
+    runtime_stats,
+    server_timing,
+)
+from src.services.serialization import PrecomputedResponse, encode_response, sse_event
+from src.services.single_flight import SingleFlight, search_key
 
 # ==================== 設定 ====================
 
@@ -47,6 +75,41 @@ class Settings(BaseSettings):
     ]
     
     LOG_LEVEL: str = "INFO"
+
+    # 管理用API（インデックスのリロードなど）のトークン
+    # 未設定なら管理用APIは無効
+    ADMIN_TOKEN: Optional[str] = None
+
+    # CURRENTファイルの監視間隔（秒）。0なら監視しない
+    INDEX_WATCH_INTERVAL: float = 0.0
+    # 古い世代を解放する前に処理中のリクエストを待つ時間（秒）
+    INDEX_DRAIN_TIMEOUT: float = 30.0
+
+    # 実行中の同じ検索（クエリ・フィルター・k）に相乗りする
+    SEARCH_COALESCING: bool = True
+
+    # 検索を実行するスレッド数（Noneならconcurrent.futuresのデフォルト）
+    SEARCH_WORKERS: Optional[int] = None
+    # イベントループの遅れを測る間隔（秒）。0なら測らない
+    LOOP_LAG_INTERVAL: float = 0.5
+
+    # フィードバックの保存先（SQLite）と書き込みキュー
+    FEEDBACK_DB_PATH: str = "data/feedback/feedback.db"
+    # キューに溜められる件数。超えたら503を返す
+    FEEDBACK_QUEUE_SIZE: int = 10000
+    # 1回のコミットでまとめて書く最大件数
+    FEEDBACK_BATCH_SIZE: int = 500
+
+    # 検索クエリのログ（ウォームアップ用）。空なら記録しない
+    QUERY_LOG_PATH: str = "data/query_log/queries.jsonl"
+    QUERY_LOG_MAX_BYTES: int = 50_000_000
+    # 世代ごとの検索結果のキャッシュ件数。0ならキャッシュしない
+    SEARCH_CACHE_SIZE: int = 1024
+    # 世代を読み込んだら、直近PREWARM_WINDOW_HOURS時間でよく来た上位PREWARM_TOP_N件を先に実行する
+    PREWARM_TOP_N: int = 200
+    PREWARM_WINDOW_HOURS: float = 168.0
+    # ウォームアップにかける時間の上限（秒）。超えたら残りはやめて差し替える
+    PREWARM_BUDGET_SECONDS: float = 30.0
     
     class Config:
         env_file = ".env"
@@ -63,64 +126,32 @@ logger = logging.getLogger(__name__)
 
 # ==================== ヘルパー関数 ====================
 
-def _build_hierarchy(metadata: List[Dict[str, Any]]) -> List[HierarchyNode]:
+def _top_level_nodes(hierarchy: HierarchyIndex) -> List[HierarchyNode]:
     """
-    メタデータから設備の階層構造を構築
-    工場 → ライン → 設備1 → 設備2 → 設備3 の階層
-    
-    フロントエンドのツリービューで使う
+    階層の最上位（工場）だけをノードにする
+
+    木を丸ごと入れると設備の数だけレスポンスが大きくなるので、
+    その下はフロントエンドが開いたときに /api/search/hierarchy で取る。
     """
-    tree: Dict[str, Any] = {}
-    
-    for doc in metadata:
-        meta = doc.get('metadata', {})
-        loc = meta.get('location')
-        line = meta.get('line')
-        eq1 = meta.get('equipment1')
-        eq2 = meta.get('equipment2')
-        eq3 = meta.get('equipment3')
-        
-        if not all([loc, line]):
-            continue
-            
-        if loc not in tree:
-            tree[loc] = {}
-        if line not in tree[loc]:
-            tree[loc][line] = {}
-        
-        if eq1:
-            if eq1 not in tree[loc][line]:
-                tree[loc][line][eq1] = {}
-            if eq2:
-                if eq2 not in tree[loc][line][eq1]:
-                    tree[loc][line][eq1][eq2] = {}
-                if eq3:
-                    tree[loc][line][eq1][eq2][eq3] = True
-
-    # ツリー構造をHierarchyNodeのリストに変換
-    result = []
-    for loc_name, lines in sorted(tree.items()):
-        loc_node = HierarchyNode(id=loc_name, label=loc_name, children=[])
-        for line_name, eq1s in sorted(lines.items()):
-            line_node = HierarchyNode(id=line_name, label=line_name, children=[])
-            for eq1_name, eq2s in sorted(eq1s.items()):
-                eq1_node = HierarchyNode(id=eq1_name, label=eq1_name, children=[])
-                for eq2_name, eq3s in sorted(eq2s.items()):
-                    eq2_node = HierarchyNode(id=eq2_name, label=eq2_name, children=[])
-                    for eq3_name in sorted(eq3s.keys()):
-                        eq3_node = HierarchyNode(id=eq3_name, label=eq3_name, children=[])
-                        eq2_node.children.append(eq3_node)
-                    eq1_node.children.append(eq2_node)
-                line_node.children.append(eq1_node)
-            loc_node.children.append(line_node)
-        result.append(loc_node)
-        
-    return result
+    return [
+        HierarchyNode(
+            id=hierarchy.label(node),
+            label=hierarchy.label(node),
+            nodeId=int(node),
+            count=int(hierarchy.count[node]),
+            hasChildren=hierarchy.num_children(node) > 0,
+        )
+        for node in hierarchy.children(ROOT)
+    ]
 
-def _get_filter_metadata(metadata: List[Dict[str, Any]]) -> Dict[str, Any]:
+def _get_filter_metadata(
+    metadata: List[Dict[str, Any]], hierarchy: Optional[HierarchyIndex] = None
+) -> Dict[str, Any]:
     """
     フィルター用のメタデータを生成
     フロントエンドのフィルターパネルで使う選択肢のリスト
+
+    項目ごとにメタデータを舐めると件数×項目数かかるので、1回のループで全部集める。
     """
     if not metadata:
         return {
@@ -135,99 +166,246 @@ def _get_filter_metadata(metadata: List[Dict[str, Any]]) -> Dict[str, Any]:
             'hierarchy': []
         }
     
-    hierarchy = _build_hierarchy(metadata)
-    
-    # ユニークな値を集める
     categories = set()
-    for doc in metadata:
-        meta = doc.get('metadata', {})
-        category = meta.get('category')
-        if category:
-            categories.add(category)
-    
-    # 故障分類
-    work_types = set()
-    for doc in metadata:
-        meta = doc.get('metadata', {})
-        work_type = meta.get('work_type')
-        if work_type:
-            work_types.add(work_type)
-    
-    # 生産ライン
-    lines = set()
-    for doc in metadata:
-        meta = doc.get('metadata', {})
-        line = meta.get('line')
-        if line:
-            lines.add(line)
-    
+    work_types = set()  # 故障分類
+    lines = set()  # 生産ライン
     # 設備階層
     equipment1s = set()
     equipment2s = set()
     equipment3s = set()
+    # 年度範囲
+    min_year: Optional[int] = None
+    max_year: Optional[int] = None
+
     for doc in metadata:
         meta = doc.get('metadata', {})
+
+        if meta.get('category'):
+            categories.add(meta['category'])
+        if meta.get('work_type'):
+            work_types.add(meta['work_type'])
+        if meta.get('line'):
+            lines.add(meta['line'])
         if meta.get('equipment1'):
             equipment1s.add(meta['equipment1'])
         if meta.get('equipment2'):
             equipment2s.add(meta['equipment2'])
         if meta.get('equipment3'):
             equipment3s.add(meta['equipment3'])
-    
-    # 年度範囲
-    years = []
-    for doc in metadata:
-        meta = doc.get('metadata', {})
+
         date_str = meta.get('date', '')
         if date_str and len(date_str) >= 4:
             try:
                 year = int(date_str[:4])
-                if 2000 <= year <= 2100:
-                    years.append(year)
             except (ValueError, TypeError):
                 continue
+            if 2000 <= year <= 2100:
+                min_year = year if min_year is None else min(min_year, year)
+                max_year = year if max_year is None else max(max_year, year)
     
     return {
-        'categories': sorted(list(categories)),
-        'productionLines': sorted(list(lines)),
-        'workTypes': sorted(list(work_types)),
-        'equipment1s': sorted(list(equipment1s)),
-        'equipment2s': sorted(list(equipment2s)),
-        'equipment3s': sorted(list(equipment3s)),
+        'categories': sorted(categories),
+        'productionLines': sorted(lines),
+        'workTypes': sorted(work_types),
+        'equipment1s': sorted(equipment1s),
+        'equipment2s': sorted(equipment2s),
+        'equipment3s': sorted(equipment3s),
         'yearRange': {
-            'startYear': min(years) if years else 2020,
-            'endYear': max(years) if years else 2024
+            'startYear': min_year if min_year is not None else 2020,
+            'endYear': max_year if max_year is not None else 2024
         },
         'totalDocuments': len(metadata),
-        'hierarchy': hierarchy
+        'hierarchy': _top_level_nodes(hierarchy or HierarchyIndex(metadata))
     }
 
+def _precompute_responses(generation: IndexGeneration):
+    """
+    世代ごとに変わらないレスポンスを読み込み時に作っておく（executorで呼ばれる）
+
+    フィルター用メタデータはページを開くたびに取得されるので、
+    JSONのバイト列・gzip・ETagまで作っておいて、リクエスト時は返すだけにする。
+    """
+    filter_metadata = FilterMetadata(**_get_filter_metadata(generation.metadata, generation.hierarchy))
+    generation.cache['filter_metadata'] = PrecomputedResponse.from_json(
+        filter_metadata.model_dump_json().encode('utf-8')
+    )
+    # 検索結果のキャッシュ。世代ごとに持つので、差し替えたら古い結果は使われない
+    generation.cache['results'] = LRUCache(settings.SEARCH_CACHE_SIZE)
+
+def _prewarm(generation: IndexGeneration, query_log: Optional[QueryLog]):
+    """
+    よく来るクエリを差し替え前に実行しておく（executorで呼ばれる）
+
+    検索結果は世代のキャッシュに入れる。クエリの埋め込みとリランクのスコアは
+    HybridSearcher / Reranker側のキャッシュに入る（こちらは世代をまたいで使われる）。
+    PREWARM_BUDGET_SECONDSを超えたら残りはやめる（1件の途中では止めない）。
+    """
+    cache: Optional[LRUCache] = generation.cache.get('results')
+    if query_log is None or cache is None or cache.maxsize <= 0 or settings.PREWARM_TOP_N <= 0:
+        return
+    start_time = time.perf_counter()
+    deadline = start_time + settings.PREWARM_BUDGET_SECONDS
+    try:
+        popular = query_log.top_queries(settings.PREWARM_TOP_N, settings.PREWARM_WINDOW_HOURS * 3600)
+    except Exception as e:
+        logger.warning(f"Failed to read query log for prewarming: {e}")
+        return
+
+    warmed = 0
+    for entry in popular:
+        if time.perf_counter() >= deadline:
+            break
+        try:
+            if entry["facets"]:
+                response = generation.searcher.search_with_facets(entry["query"], filters=entry["filters"])
+                value = (response["results"], response["facets"])
+            else:
+                value = (generation.searcher.search(entry["query"], filters=entry["filters"]), None)
+        except Exception as e:
+            logger.warning(f"Prewarm query failed: {e}")
+            continue
+        key = search_key(generation.generation, entry["query"], entry["k"], entry["filters"], facets=entry["facets"])
+        cache.put(key, value)
+        warmed += 1
+    if popular:
+        logger.info(
+            f"Prewarmed {warmed}/{len(popular)} popular queries for generation {generation.generation} "
+            f"in {time.perf_counter() - start_time:.1f}s"
+        )
+
 async def run_async_search(
     request: Request,
     query: str,
     k: int,
-    filters: Optional[Dict[str, Any]] = None
-) -> List[Dict[str, Any]]:
+    filters: Optional[Dict[str, Any]] = None,
+    facets: bool = False,
+    timings: Optional[Dict[str, float]] = None,
+    profile: Optional[List[Dict[str, Any]]] = None
+) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]:
     """
     非同期で検索を実行
     
     検索処理はCPUバウンドなので、run_in_executorで別スレッドに逃がす。
     そうしないと検索中に他のリクエストがブロックされる。
+    facets=Trueならファセットの件数も一緒に返す（なければNone）。
+    timingsを渡すとステージごとの処理時間（ミリ秒）を書き込む
+    （相乗りした検索なら、実際に実行した検索の時間）。
+    profileにリストを渡すと、検索をcProfileで計測して上位の関数を入れる（相乗りはしない）。
     """
-    if not hasattr(request.app.state, 'searcher') or not request.app.state.searcher:
+    index_manager: Optional[IndexManager] = getattr(request.app.state, 'index_manager', None)
+    if not index_manager or not index_manager.current:
         logger.error("Searcher not initialized")
-        return []
+        return [], None
+
+    async def execute() -> Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]], Dict[str, float]]:
+        loop = asyncio.get_running_loop()
+        stage_timings: Dict[str, float] = {}
+
+        # 検索中にインデックスが差し替わっても、この世代は解放されない
+        async with index_manager.acquire() as generation:
+            # 同じ検索の結果が世代のキャッシュにあればそれを返す（プロファイル時は実際に実行する）
+            cache: Optional[LRUCache] = generation.cache.get('results') if profile is None else None
+            cache_key = search_key(generation.generation, query, k, filters, facets=facets)
+            if cache is not None:
+                cached = cache.get(cache_key)
+                if cached is not None:
+                    return cached[0], cached[1], {}
+
+            if facets:
+                call = partial(
+                    generation.searcher.search_with_facets,
+                    query=query,
+                    filters=filters,
+                    timings=stage_timings
+                )
+            else:
+                call = partial(
+                    generation.searcher.search,
+                    query=query,
+                    filters=filters,
+                    timings=stage_timings
+                )
+            if profile is not None:
+                response, entries = await loop.run_in_executor(None, partial(profile_call, call))
+                profile.extend(entries)
+            else:
+                response = await loop.run_in_executor(None, call)
 
-    loop = asyncio.get_running_loop()
-    
-    return await loop.run_in_executor(
-        None,
-        partial(
-            request.app.state.searcher.search,
-            query=query,
-            filters=filters
-        )
-    )
+            if facets:
+                results, facet_counts = response["results"], response["facets"]
+            else:
+                results, facet_counts = response, None
+            if cache is not None:
+                cache.put(cache_key, (results, facet_counts))
+            return results, facet_counts, stage_timings
+
+    # 障害時は同じエラーコードの検索が集中するので、実行中の同じ検索があればその結果を使う
+    # （結果は_to_search_resultで新しい辞書にしてから返すので、共有・キャッシュしても書き換えられない）
+    flight: Optional[SingleFlight] = getattr(request.app.state, 'search_flight', None)
+    if flight is None or not settings.SEARCH_COALESCING or profile is not None:
+        results, facet_counts, stage_timings = await execute()
+    else:
+        key = search_key(index_manager.current.generation, query, k, filters, facets=facets)
+        results, facet_counts, stage_timings = await flight.run(key, execute)
+
+    if timings is not None:
+        timings.update(stage_timings)
+    return results, facet_counts
+
+
+def _to_search_result(res: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    検索結果1件をレスポンスの形（SearchResultと同じキー）にする
+
+    pydanticのモデルを経由せずに辞書を直接作る。
+    """
+    meta = res.get('metadata', res)
+
+    # rerank_scoreがあればそれを優先
+    raw_score = res.get('rerank_score')
+    if raw_score is None:
+        raw_score = res.get('score', 0.0)
+    raw_score = float(raw_score)
+
+    # NaN チェック (JSON serialization エラー回避)
+    if math.isnan(raw_score):
+        score = 0.0
+    elif raw_score > 1.0 or raw_score < 0.0:
+        # 必要に応じて正規化（もしRe-rankerのスコアが0-1の範囲外なら）
+        # 簡易的な正規化（実際にはモデルの出力を確認して調整すべき）
+        score = max(0.0, min(1.0, (raw_score + 10) / 20))
+    else:
+        score = raw_score
+
+    snippet = res.get('text', '')[:200]
+    return {
+        "doc_id": meta.get('doc_id', ''),
+        "title": meta.get('title', '故障対応記録'),
+        "summary": snippet[:150] + '...',
+        "score": score,
+        "confidence": int(score * 100),  # UI表示用 (0-100%)
+        "snippet": snippet + '...',
+        "date": meta.get('date', ''),
+        "machine": meta.get('machine'),
+        "line": meta.get('line'),
+        "category": meta.get('category', 'その他'),
+        "match_fields": {"text": score},
+        "location": meta.get('location'),
+        "symptom": meta.get('symptom'),
+        "action_taken": meta.get('action_taken'),
+        "parts_replaced": meta.get('parts_replaced'),
+        "operator": meta.get('operator'),
+        "chunk_id": res.get('chunk_id'),
+        "duplicate_count": res.get('duplicate_count', 0),
+    }
+
+
+def require_admin(x_admin_token: Optional[str] = Header(default=None)):
+    """管理用APIの認証。ADMIN_TOKENが未設定なら管理用APIは使えない"""
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin API is disabled.")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, settings.ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token.")
 
 
 # ==================== アプリケーションライフサイクル ====================
@@ -237,16 +415,75 @@ async def lifespan(app: FastAPI):
     """起動時と終了時の処理"""
     logger.info("Starting RAG service...")
     
+    def on_swap(generation: IndexGeneration):
+        # 新しい世代に差し替え（イベントループ上の代入なのでアトミック）
+        app.state.searcher = generation.searcher
+        app.state.metadata = generation.metadata
+        app.state.doc_index = generation.doc_index
+
+    app.state.searcher = None
+    app.state.metadata = []
+    app.state.doc_index = DocIndex([])
+    app.state.search_flight = SingleFlight()
+    app.state.profile_lock = asyncio.Lock()
+
+    # 検索用のexecutor。待ち行列の長さを/metricsで見えるようにする
+    executor = InstrumentedExecutor(max_workers=settings.SEARCH_WORKERS, thread_name_prefix="search")
+    asyncio.get_running_loop().set_default_executor(executor)
+    runtime_stats.executor = executor
+    runtime_stats.single_flight = app.state.search_flight
+    add_observer(observe_stage)
+    lag_task = None
+    if settings.LOOP_LAG_INTERVAL > 0:
+        lag_task = asyncio.create_task(runtime_stats.monitor_loop_lag(settings.LOOP_LAG_INTERVAL))
+
+    # フィードバックの書き込みキュー（インデックスが読めなくても受け付ける）
+    app.state.feedback_store = None
+    feedback_store = FeedbackStore(
+        settings.FEEDBACK_DB_PATH,
+        queue_size=settings.FEEDBACK_QUEUE_SIZE,
+        batch_size=settings.FEEDBACK_BATCH_SIZE,
+    )
+    try:
+        await feedback_store.start()
+        app.state.feedback_store = feedback_store
+        runtime_stats.feedback_store = feedback_store
+    except Exception as e:
+        logger.error(f"Failed to open feedback store {settings.FEEDBACK_DB_PATH}: {e}")
+
+    # 検索クエリのログ（次の起動・世代の切り替えでウォームアップに使う）
+    app.state.query_log = None
+    if settings.QUERY_LOG_PATH:
+        query_log = QueryLog(settings.QUERY_LOG_PATH, max_bytes=settings.QUERY_LOG_MAX_BYTES)
+        try:
+            await query_log.start()
+            app.state.query_log = query_log
+        except Exception as e:
+            logger.error(f"Failed to open query log {settings.QUERY_LOG_PATH}: {e}")
+
+    def on_load(generation: IndexGeneration):
+        _precompute_responses(generation)
+        _prewarm(generation, app.state.query_log)
+
+    app.state.index_manager = IndexManager(
+        drain_timeout=settings.INDEX_DRAIN_TIMEOUT,
+        on_swap=on_swap,
+        on_load=on_load,
+    )
+    watcher_task = None
+    
     try:
         # HybridSearcherの初期化
         # 初回起動時はモデルのダウンロードで時間かかる
         logger.info("Initializing HybridSearcher (this may take a while on first run)...")
-        app.state.searcher = HybridSearcher()
+        generation = await app.state.index_manager.load_initial()
         
-        # メタデータへのショートカット
-        app.state.metadata = app.state.searcher.dense_searcher.metadata
-        
-        logger.info(f"✅ Search system ready. Docs: {len(app.state.metadata)}")
+        logger.info(f"✅ Search system ready. Generation: {generation.generation}, Docs: {len(app.state.metadata)}")
+
+        if settings.INDEX_WATCH_INTERVAL > 0:
+            watcher_task = asyncio.create_task(
+                app.state.index_manager.watch(settings.INDEX_WATCH_INTERVAL)
+            )
             
     except Exception as e:
         logger.error(f"Initialization error: {e}", exc_info=True)
@@ -256,6 +493,18 @@ async def lifespan(app: FastAPI):
     yield
     
     logger.info("Shutting down...")
+    if watcher_task:
+        watcher_task.cancel()
+    if lag_task:
+        lag_task.cancel()
+    remove_observer(observe_stage)
+    if app.state.query_log:
+        await app.state.query_log.close()
+    if app.state.feedback_store:
+        # キューに残っているフィードバックを書き切ってから終わる
+        await app.state.feedback_store.close()
+        runtime_stats.feedback_store = None
+    executor.shutdown(wait=False)
 
 
 # ==================== FastAPIアプリ ====================
@@ -289,91 +538,233 @@ async def health_check(request: Request):
         "status": "healthy" if searcher else "degraded",
         "timestamp": datetime.now().isoformat(),
         "index_loaded": searcher is not None,
+        "generation": searcher.generation if searcher else None,
         "documents": len(request.app.state.metadata) if hasattr(request.app.state, 'metadata') else 0,
         "reranker_ready": searcher.reranker.is_available if searcher and searcher.reranker else False
     }
 
 
 @app.post("/api/search", response_model=SearchResponse)
-async def search_endpoint(req: SearchRequest, request: Request):
-    """メインの検索エンドポイント"""
-    start_time = time.time()
+async def search_endpoint(
+    req: SearchRequest,
+    request: Request,
+    profile: bool = False,
+    x_admin_token: Optional[str] = Header(default=None)
+):
+    """
+    メインの検索エンドポイント
+
+    Server-Timingヘッダーでステージごとの処理時間を返す。
+    ?profile=1 を付けると、この検索をcProfileで計測した結果も返す（要 X-Admin-Token）。
+    """
+    start_time = time.perf_counter()
     if not hasattr(request.app.state, 'searcher') or not request.app.state.searcher:
         raise HTTPException(status_code=503, detail="Search service not fully initialized.")
+    if profile:
+        require_admin(x_admin_token)
 
     try:
         filters_dict = req.filters.model_dump(exclude_none=True) if req.filters else None
         if filters_dict:
             logger.info(f"Applying filters: {filters_dict}")
         
-        search_results = await run_async_search(request, req.query, req.k, filters=filters_dict)
-        
-        results = []
-        for res in search_results:
-            meta = res.get('metadata', res)
-            date_str = meta.get('date', '')
-            
-            # スコア取得ロジックを修正: rerank_scoreがあればそれを優先
-            raw_score = res.get('rerank_score')
-            if raw_score is None:
-                raw_score = res.get('score', 0.0)
-            
-            # NaN チェック (JSON serialization エラー回避)
-            if isinstance(raw_score, float) and math.isnan(raw_score):
-                raw_score = 0.0
-            
-            # 必要に応じて正規化（もしRe-rankerのスコアが0-1の範囲外なら）
-            if raw_score > 1.0 or raw_score < 0.0:
-                # 簡易的な正規化（実際にはモデルの出力を確認して調整すべき）
-                score = max(0.0, min(1.0, (raw_score + 10) / 20))
-            else:
-                score = raw_score
-            
-            # 念のための最終チェック
-            if isinstance(score, float) and math.isnan(score):
-                score = 0.0
-
-            results.append(
-                SearchResult(
-                    doc_id=meta.get('doc_id', ''),
-                    title=meta.get('title', '故障対応記録'),
-                    summary=res.get('text', '')[:150] + '...',
-                    score=score,
-                    confidence=int(score * 100), # UI表示用 (0-100%)
-                    snippet=res.get('text', '')[:200] + '...',
-                    date=date_str,
-                    machine=meta.get('machine'),
-                    line=meta.get('line'),
-                    category=meta.get('category', 'その他'),
-                    match_fields={"text": score},
-                    location=meta.get('location'),
-                    symptom=meta.get('symptom'),
-                    action_taken=meta.get('action_taken'),
-                    parts_replaced=meta.get('parts_replaced'),
-                    operator=meta.get('operator')
-                )
-            )
+        timings: Dict[str, float] = {}
+        profile_entries: Optional[List[Dict[str, Any]]] = [] if profile else None
+        search_results, facets = await run_async_search(
+            request, req.query, req.k, filters=filters_dict, facets=req.facets,
+            timings=timings, profile=profile_entries
+        )
         
-        processing_time = int((time.time() - start_time) * 1000)
+        with collect(timings), stage("serialize"):
+            results = [_to_search_result(res) for res in search_results]
+            processing_time = int((time.perf_counter() - start_time) * 1000)
+            payload = {
+                "results": results,
+                "total": len(results),
+                "processingTime": processing_time,
+                "facets": facets,
+            }
+            if profile_entries is not None:
+                payload["profile"] = profile_entries
+            # 自前で組み立てた辞書なので、response_modelの検証は通さずにそのままエンコードする
+            response = encode_response(request, payload)
+
+        elapsed = time.perf_counter() - start_time
+        SEARCH_SECONDS.labels(endpoint="search").observe(elapsed)
+        response.headers["Server-Timing"] = server_timing(timings, elapsed * 1000)
+        query_log: Optional[QueryLog] = getattr(request.app.state, 'query_log', None)
+        if query_log is not None and not profile:
+            query_log.record(req.query, req.k, filters_dict, req.facets, elapsed * 1000)
         logger.info(f"Search completed: query='{req.query[:30]}...', results={len(results)}, time={processing_time}ms")
-        
-        return SearchResponse(results=results, total=len(results), processingTime=processing_time)
+        return response
         
     except Exception as e:
         logger.error(f"Search endpoint error: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+async def _progressive_search_events(
+    request: Request,
+    index_manager: IndexManager,
+    query: str,
+    filters: Optional[Dict[str, Any]]
+):
+    """
+    検索結果を段階的に返すイベント列
+
+    fused: RRFで統合した時点の上位（リランク前）
+    reranked: Cross-Encoderで並べ替えた上位（リランクが無効か、コードだけのクエリなら出さない）
+    done: 全体の処理時間
+
+    各イベントのtimingsにはそこまでのステージごとの処理時間（ミリ秒）が入る。
+    """
+    start_time = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    timings: Dict[str, float] = {}
+
+    try:
+        async with index_manager.acquire() as generation:
+            searcher = generation.searcher
+            candidates = await loop.run_in_executor(
+                None, partial(searcher.retrieve, query, filters, timings=timings)
+            )
+            fused = searcher.finalize(query, candidates, rerank=False)
+            results = [_to_search_result(res) for res in fused]
+            yield sse_event("fused", {
+                "results": results,
+                "total": len(results),
+                "timings": dict(timings),
+                "elapsed": int((time.perf_counter() - start_time) * 1000),
+            })
+
+            # もう読まれていないならリランクは無駄なのでやめる
+            if searcher.should_rerank(candidates) and not await request.is_disconnected():
+                reranked = await loop.run_in_executor(
+                    None, partial(searcher.finalize, query, candidates, timings=timings)
+                )
+                results = [_to_search_result(res) for res in reranked]
+                yield sse_event("reranked", {
+                    "results": results,
+                    "total": len(results),
+                    "timings": dict(timings),
+                    "elapsed": int((time.perf_counter() - start_time) * 1000),
+                })
+
+        SEARCH_SECONDS.labels(endpoint="stream").observe(time.perf_counter() - start_time)
+        processing_time = int((time.perf_counter() - start_time) * 1000)
+        logger.info(f"Streaming search completed: query='{query[:30]}...', time={processing_time}ms, timings={timings}")
+        yield sse_event("done", {"processingTime": processing_time, "timings": timings})
+
+    except Exception as e:
+        # ヘッダーはもう送ってしまっているので、エラーもイベントで返す
+        logger.error(f"Streaming search error: {e}", exc_info=True)
+        yield sse_event("error", {"detail": str(e)})
+
+
+@app.post("/api/search/stream")
+async def search_stream_endpoint(req: SearchRequest, request: Request):
+    """
+    検索結果をServer-Sent Eventsで段階的に返す
+
+    RRFの結果をすぐに返して、リランクが終わったら並べ替えた結果を送り直す。
+    体感の待ち時間がリランクの分だけ短くなる。
+    """
+    index_manager: Optional[IndexManager] = getattr(request.app.state, 'index_manager', None)
+    if not index_manager or not index_manager.current:
+        raise HTTPException(status_code=503, detail="Search service not fully initialized.")
+
+    filters_dict = req.filters.model_dump(exclude_none=True) if req.filters else None
+    return StreamingResponse(
+        _progressive_search_events(request, index_manager, req.query, filters_dict),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # nginxのバッファリングを止める（止めないと全部終わるまで届かない）
+            "X-Accel-Buffering": "no",
+        },
+    )
+
 @app.get("/api/search/metadata", response_model=FilterMetadata)
 async def get_filter_metadata(request: Request):
-    """フィルター用のメタデータを返す"""
-    if not hasattr(request.app.state, 'metadata') or not request.app.state.metadata:
+    """
+    フィルター用のメタデータを返す
+
+    世代の読み込み時に作ったJSONをそのまま返す。ETagが一致すれば304。
+    """
+    index_manager: Optional[IndexManager] = getattr(request.app.state, 'index_manager', None)
+    if not index_manager or not index_manager.current or not index_manager.current.metadata:
         raise HTTPException(status_code=503, detail="Metadata not loaded")
-    try:
-        metadata_dict = _get_filter_metadata(request.app.state.metadata)
-        return FilterMetadata(**metadata_dict)
-    except Exception as e:
-        logger.error(f"Failed to get filter metadata: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail=str(e))
+    cached: Optional[PrecomputedResponse] = index_manager.current.cache.get('filter_metadata')
+    if cached is None:
+        raise HTTPException(status_code=503, detail="Metadata not loaded")
+    return cached.to_response(request)
+
+
+@app.get("/api/search/hierarchy", response_model=HierarchyChildren)
+async def get_hierarchy_children(
+    request: Request,
+    path: List[str] = Query(default=[], description="開くノードのラベル（工場, ライン, 設備1, ...）。空なら最上位"),
+    node: Optional[int] = Query(default=None, ge=0, description="ノード番号（同じ世代ならpathの代わりに使える）"),
+    offset: int = Query(default=0, ge=0),
+    limit: int = Query(default=200, ge=1, le=1000),
+):
+    """
+    設備階層の1つのノードの子を、文書数付きで返す
+
+    フィルターパネルで枝を開いたときに呼ぶ。木は世代の読み込み時に作ってあるので、
+    ここでは子の範囲を切り出すだけ。
+    """
+    index_manager: Optional[IndexManager] = getattr(request.app.state, 'index_manager', None)
+    if not index_manager or not index_manager.current:
+        raise HTTPException(status_code=503, detail="Metadata not loaded")
+    generation = index_manager.current
+    hierarchy = generation.hierarchy
+
+    if node is None:
+        node = hierarchy.find(path)
+        if node is None:
+            raise HTTPException(status_code=404, detail="Hierarchy node not found")
+    elif node >= len(hierarchy):
+        raise HTTPException(status_code=404, detail="Hierarchy node not found")
+
+    return HierarchyChildren(
+        generation=generation.generation,
+        nodeId=node,
+        path=hierarchy.path(node),
+        count=int(hierarchy.count[node]),
+        total=hierarchy.num_children(node),
+        offset=offset,
+        children=[
+            HierarchyChild(
+                id=hierarchy.label(child),
+                label=hierarchy.label(child),
+                nodeId=int(child),
+                count=int(hierarchy.count[child]),
+                hasChildren=hierarchy.num_children(child) > 0,
+            )
+            for child in hierarchy.children(node, offset, limit)
+        ],
+    )
+
+
+@app.get("/api/suggest", response_model=SuggestResponse)
+async def suggest(
+    request: Request,
+    q: str = Query(..., max_length=100, description="入力中の文字列（前方一致）"),
+    limit: int = Query(default=8, ge=1, le=20),
+):
+    """
+    検索ボックスの入力補完（設備名・エラーコード・よく出てくる単語）
+
+    キー入力のたびに呼ばれるので、埋め込みモデルは使わずに世代の読み込み時に作った索引を引くだけ。
+    executorにも回さず、イベントループの上でそのまま返す。
+    """
+    index_manager: Optional[IndexManager] = getattr(request.app.state, 'index_manager', None)
+    if not index_manager or not index_manager.current:
+        raise HTTPException(status_code=503, detail="Index not loaded")
+    return encode_response(
+        request,
+        {"query": q, "suggestions": index_manager.current.suggest.suggest(q, limit)},
+    )
 
 
 @app.get("/api/docs/{doc_id}", response_model=DocumentDetail)
@@ -382,41 +773,102 @@ async def get_document(doc_id: str, request: Request):
     if not hasattr(request.app.state, 'metadata') or not request.app.state.metadata:
         raise HTTPException(status_code=503, detail="Metadata service not initialized.")
 
-    # 線形探索だけど8000件程度なら問題ない
-    doc = next((
-        m for m in request.app.state.metadata 
-        if m.get('metadata', {}).get('doc_id') == doc_id or m.get('doc_id') == doc_id
-    ), None)
-
-    if not doc:
+    # 読み込み時に作った索引から引く（件数によらず一定時間）
+    chunks = request.app.state.doc_index.chunks(doc_id)
+    if not chunks:
         raise HTTPException(status_code=404, detail="Document not found")
 
+    doc = chunks[0]
     meta = doc.get('metadata', doc)
+    full_text = merge_chunk_texts([chunk.get('text', '') for chunk in chunks])
     
     return DocumentDetail(
         doc_id=doc_id,
         title=meta.get('title', 'N/A'),
-        content=doc.get('text', ''),
+        content=full_text,
         metadata=doc,
-        full_text=doc.get('text', ''),
-        chunks=[{"chunk_id": f"{doc_id}_chunk_0", "text": doc.get('text', ''), "chunk_index": 0, "source_doc_id": doc_id}],
+        full_text=full_text,
+        chunks=[
+            {
+                "chunk_id": chunk.get('chunk_id', f"{doc_id}_chunk_{i}"),
+                "text": chunk.get('text', ''),
+                "chunk_index": chunk.get('chunk_index', i),
+                "source_doc_id": doc_id,
+            }
+            for i, chunk in enumerate(chunks)
+        ],
         attachments=[],
         action_taken=meta.get('action_taken'),
         parts_replaced=meta.get('parts_replaced'),
     )
 
 
+@app.get("/api/docs/{doc_id}/duplicates", response_model=DuplicatesResponse)
+async def get_document_duplicates(doc_id: str, request: Request):
+    """
+    インデックス構築時にこの文書と同じグループにまとめた記録を返す
+
+    号機違いで同じ処置をした記録など。検索結果ではduplicate_countだけ返しているので、
+    「似た記録N件」を開いたときにここで展開する。
+    """
+    index_manager: Optional[IndexManager] = getattr(request.app.state, 'index_manager', None)
+    if not index_manager or not index_manager.current:
+        raise HTTPException(status_code=503, detail="Index not loaded")
+    generation = index_manager.current
+    chunks = generation.doc_index.chunks(doc_id)
+    if not chunks:
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    results = []
+    seen = {doc_id}
+    for chunk in chunks:
+        for member in generation.searcher.duplicates.group(chunk):
+            if member.get('doc_id') not in seen:
+                seen.add(member.get('doc_id'))
+                results.append(_to_search_result(member))
+    return {"doc_id": doc_id, "results": results}
+
+
 @app.post("/api/feedback")
-async def submit_feedback(doc_id: str, rating: int, helpful: bool, comment: Optional[str] = None):
-    """フィードバック受付。今はログに出すだけ、将来的にはDBに保存したい"""
-    logger.info(f"Feedback received: doc_id={doc_id}, rating={rating}, helpful={helpful}, comment='{comment}'")
+async def submit_feedback(req: FeedbackRequest, request: Request):
+    """
+    フィードバック受付
+
+    キューに積むだけで、SQLiteへの書き込みは後でまとめて行う（FeedbackStore）。
+    書き込みが追いつかずキューが一杯なら503を返すので、クライアントは少し待って再送する。
+    """
+    store: Optional[FeedbackStore] = getattr(request.app.state, 'feedback_store', None)
+    if store is None:
+        raise HTTPException(status_code=503, detail="Feedback store is not available.")
+    try:
+        store.submit(req.doc_id, req.rating, req.helpful, req.comment)
+    except FeedbackQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     return {"success": True, "message": "フィードバックを受け付けました"}
 
 
+def _cache_stats(state) -> Dict[str, Any]:
+    """結果・クエリの埋め込み・リランクスコアのキャッシュの件数とヒット数"""
+    stats: Dict[str, Any] = {}
+    index_manager: Optional[IndexManager] = getattr(state, 'index_manager', None)
+    if index_manager and index_manager.current:
+        results: Optional[LRUCache] = index_manager.current.cache.get('results')
+        if results is not None:
+            stats["results"] = results.stats()
+        searcher = index_manager.current.searcher
+        stats["query_vectors"] = searcher.query_vectors.stats()
+        if searcher.reranker is not None:
+            stats["rerank_scores"] = searcher.reranker.score_cache.stats()
+    return stats
+
+
 @app.get("/api/stats")
 async def get_stats(request: Request):
     """統計情報"""
     searcher = getattr(request.app.state, 'searcher', None)
+    flight: Optional[SingleFlight] = getattr(request.app.state, 'search_flight', None)
+    feedback_store: Optional[FeedbackStore] = getattr(request.app.state, 'feedback_store', None)
+    index_manager: Optional[IndexManager] = getattr(request.app.state, 'index_manager', None)
     embedding_config = core_settings.get("embedding", {})
     model_name = embedding_config.get("model_name", "unknown")
     
@@ -424,6 +876,115 @@ async def get_stats(request: Request):
         "total_documents": len(request.app.state.metadata) if hasattr(request.app.state, 'metadata') else 0,
         "model": model_name,
         "status": "operational" if searcher else "initializing",
+        "search_coalescing": flight.stats() if flight else None,
+        "feedback": feedback_store.stats() if feedback_store else None,
+        "caches": _cache_stats(request.app.state),
+        "suggest": index_manager.current.suggest.stats() if index_manager and index_manager.current else None,
+    }
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheusのスクレイプ用（ステージごとの処理時間、executorの待ち行列、イベントループの遅れ）"""
+    return metrics_response()
+
+
+@app.get("/admin/index", response_model=IndexGenerationInfo, dependencies=[Depends(require_admin)])
+async def get_index_generation(request: Request):
+    """現在のインデックス世代"""
+    index_manager: IndexManager = request.app.state.index_manager
+    if not index_manager.current:
+        raise HTTPException(status_code=503, detail="Index not loaded")
+    return IndexGenerationInfo(**index_manager.current.info())
+
+
+@app.post("/admin/index/reload", response_model=IndexGenerationInfo, dependencies=[Depends(require_admin)])
+async def reload_index(req: IndexReloadRequest, request: Request):
+    """
+    インデックスを再起動なしで切り替える
+
+    読み込み中も古い世代で検索は続けられる。
+    generationを省略するとCURRENTが指す世代を読み込む。
+    """
+    index_manager: IndexManager = request.app.state.index_manager
+    if not index_manager.current:
+        raise HTTPException(status_code=503, detail="Index not loaded")
+    try:
+        generation = await index_manager.reload(req.generation, force=req.force)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        logger.error(f"Index reload failed: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+    return IndexGenerationInfo(**generation.info())
+
+
+@app.get("/admin/feedback", response_model=FeedbackPage, dependencies=[Depends(require_admin)])
+async def export_feedback(
+    request: Request,
+    after_id: int = Query(default=0, ge=0, description="このidより後を返す（前回のnext_after_id）"),
+    limit: int = Query(default=1000, ge=1, le=50000),
+    doc_id: Optional[str] = None,
+):
+    """
+    保存済みのフィードバックをid順にまとめて返す（分析用）
+
+    コミット済みの分だけ返すので、受け付けた直後のものはまだ入っていないことがある。
+    """
+    store: Optional[FeedbackStore] = getattr(request.app.state, 'feedback_store', None)
+    if store is None:
+        raise HTTPException(status_code=503, detail="Feedback store is not available.")
+    loop = asyncio.get_running_loop()
+    items = await loop.run_in_executor(None, partial(store.read, after_id, limit, doc_id))
+    return encode_response(
+        request,
+        {"items": items, "next_after_id": items[-1]["id"] if len(items) == limit else None},
+    )
+
+
+@app.post("/admin/profile", response_model=ProfileResult, dependencies=[Depends(require_admin)])
+async def profile_process(
+    request: Request,
+    seconds: float = Query(default=10.0, gt=0, le=120),
+    interval_ms: float = Query(default=5.0, ge=1, le=1000),
+    memory: bool = False,
+    include_idle: bool = False,
+    format: str = Query(default="json", pattern="^(json|collapsed)$"),
+):
+    """
+    動いているプロセスをseconds秒だけサンプリングする
+
+    その間に来たリクエストも含めて、全スレッドのスタックを数える。
+    format=collapsed ならcollapsed形式のテキストだけ返す（flamegraph.plにそのまま渡せる）。
+    memory=true ならtracemallocで前後のメモリの差分も取る（計測中は遅くなる）。
+    """
+    lock: asyncio.Lock = request.app.state.profile_lock
+    if lock.locked():
+        raise HTTPException(status_code=409, detail="Profiling is already running.")
+
+    async with lock:
+        loop = asyncio.get_running_loop()
+        memory_diff = MemoryDiff() if memory else None
+        if memory_diff:
+            await loop.run_in_executor(None, memory_diff.start)
+
+        profiler = SamplingProfiler(interval=interval_ms / 1000, include_idle=include_idle)
+        profiler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.stop()
+            allocations = await loop.run_in_executor(None, memory_diff.stop) if memory_diff else None
+
+    logger.info(f"Profiled for {profiler.duration:.1f}s: samples={profiler.samples}, stacks={len(profiler.stacks)}")
+    if format == "collapsed":
+        return PlainTextResponse(profiler.collapsed())
+    return {
+        "seconds": profiler.duration,
+        "interval_ms": interval_ms,
+        "samples": profiler.samples,
+        "collapsed": profiler.collapsed(),
+        "memory": allocations,
     }
 
 
@@ -435,3 +996,4 @@ if __name__ == "__main__":
         log_level=settings.LOG_LEVEL.lower(),
         reload=True,
     )
+
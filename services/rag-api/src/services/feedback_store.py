@@ -0,0 +1,163 @@
+'''
+フィードバックの保存（SQLite、write-behind）
+
+リクエストの中でDBに書くとfsyncの分だけ応答が遅くなるので、
+エンドポイントはキューに積むだけにして、書き込みは専用のスレッドでまとめて行う。
+
+- 書き込み中に溜まった分を1トランザクションでまとめてコミットする（group commit）。
+  負荷が低いときは1件ずつ、バーストのときは最大batch_size件ずつになる。
+- キューが一杯なら受け付けない（FeedbackQueueFull → 503）。メモリを際限なく使わないため。
+- 終了時はclose()でキューに残っている分を書き切ってから閉じる。
+  プロセスが落ちた場合は、キューに残っていた分（最大queue_size件）は失われる。
+
+読み出しはWALなので書き込みと並行してできる（別の接続で読む）。
+'''
+
+import asyncio
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS feedback (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    received_at REAL NOT NULL,
+    doc_id TEXT NOT NULL,
+    rating INTEGER NOT NULL,
+    helpful INTEGER NOT NULL,
+    comment TEXT
+);
+CREATE INDEX IF NOT EXISTS feedback_doc_id ON feedback (doc_id);
+"""
+
+COLUMNS = ["id", "received_at", "doc_id", "rating", "helpful", "comment"]
+
+# 1行分: (received_at, doc_id, rating, helpful, comment)
+Row = Tuple[float, str, int, int, Optional[str]]
+
+
+class FeedbackQueueFull(Exception):
+    """書き込みが追いついていない"""
+
+
+def _connect(path: Path) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # WALならNORMALでもDBは壊れない（電源断で直近のコミットが消えることはある）
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class FeedbackStore:
+    """フィードバックをSQLiteに後から書き込むキュー"""
+
+    def __init__(self, path: str, queue_size: int = 10000, batch_size: int = 500):
+        self.path = Path(path)
+        self.batch_size = batch_size
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        # SQLiteの接続はスレッドをまたげないので、書き込みは1本のスレッドで行う
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="feedback-writer")
+        self._conn: Optional[sqlite3.Connection] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self.written = 0
+        self.rejected = 0
+        self.batches = 0
+        self.failed = 0
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._open)
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Feedback store ready: {self.path}")
+
+    def _open(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = _connect(self.path)
+        self._conn.executescript(SCHEMA)
+
+    def submit(self, doc_id: str, rating: int, helpful: bool, comment: Optional[str] = None):
+        """キューに積むだけ（待たない）。一杯ならFeedbackQueueFull"""
+        if self._closing:
+            raise FeedbackQueueFull("Feedback store is shutting down")
+        try:
+            self._queue.put_nowait((time.time(), doc_id, rating, int(helpful), comment))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise FeedbackQueueFull("Feedback queue is full") from None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch: List[Row] = [await self._queue.get()]
+            # 前のコミットの間に溜まった分をまとめて書く
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                await loop.run_in_executor(self._executor, self._write, batch)
+            except Exception as e:
+                self.failed += len(batch)
+                logger.error(f"Failed to write {len(batch)} feedback rows: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write(self, batch: List[Row]):
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO feedback (received_at, doc_id, rating, helpful, comment) VALUES (?, ?, ?, ?, ?)",
+                batch,
+            )
+        self.written += len(batch)
+        self.batches += 1
+
+    async def close(self, timeout: float = 10.0):
+        """新しい受け付けを止めて、キューに残っている分を書き切ってから閉じる"""
+        self._closing = True
+        if self._task is not None:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout=timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Dropped {self._queue.qsize()} queued feedback rows on shutdown")
+            self._task.cancel()
+        loop = asyncio.get_running_loop()
+        if self._conn is not None:
+            await loop.run_in_executor(self._executor, self._conn.close)
+        self._executor.shutdown(wait=True)
+        logger.info(f"Feedback store closed ({self.written} rows written)")
+
+    def read(
+        self, after_id: int = 0, limit: int = 1000, doc_id: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """id順にafter_idより後を読む（executorで呼ぶ）。コミット済みの分だけ見える"""
+        query = f"SELECT {', '.join(COLUMNS)} FROM feedback WHERE id > ?"
+        params: List[Any] = [after_id]
+        if doc_id is not None:
+            query += " AND doc_id = ?"
+            params.append(doc_id)
+        query += " ORDER BY id LIMIT ?"
+        params.append(limit)
+
+        conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, timeout=30)
+        try:
+            rows = conn.execute(query, params).fetchall()
+        finally:
+            conn.close()
+        return [
+            {**dict(zip(COLUMNS, row)), "helpful": bool(row[4])}
+            for row in rows
+        ]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "batches": self.batches,
+            "rejected": self.rejected,
+            "failed": self.failed,
+        }
@@ -0,0 +1,203 @@
+'''
+インデックス世代の管理（ホットリロード）
+
+新しい世代はバックグラウンド（executor）で読み込んで、その間は古い世代で検索を続ける。
+読み込みが終わったら参照を差し替えて、古い世代は処理中のリクエストが
+全部終わってから解放する。モデルは古い世代のSearcherから引き継ぐので再読み込みしない。
+'''
+
+import asyncio
+import gc
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from rag_core import HybridSearcher
+from rag_core.config import settings
+from rag_core.doc_index import DocIndex
+from rag_core.hierarchy import HierarchyIndex
+from rag_core.suggest import SuggestIndex, build_suggest_index
+from rag_core.generations import current_generation
+
+logger = logging.getLogger(__name__)
+
+
+class IndexGeneration:
+    """
+    1世代分の検索状態。処理中のリクエスト数を数えておく
+
+    メタデータから作る索引（doc_id → チャンク）もここで持つ。
+    件数に比例して時間がかかるので、executor側で作る。
+    """
+
+    def __init__(self, searcher: HybridSearcher):
+        self.searcher = searcher
+        self.generation = searcher.generation
+        # 代表にまとめたチャンクも入れる（文書の詳細・件数・階層はまとめる前の全文書で見る）
+        self.metadata: List[Dict[str, Any]] = (
+            searcher.dense_searcher.live_metadata() + searcher.duplicates.chunks
+        )
+        self.doc_index = DocIndex(self.metadata)
+        # 設備階層の木（/api/search/hierarchyで子を返す）
+        self.hierarchy = HierarchyIndex(self.metadata)
+        # 入力補完の候補（/api/suggest）
+        self.suggest = build_suggest_index(self.metadata, **settings["suggest"])
+        # ファセット集計用の列も先に作っておく（最初の検索で待たせないように）
+        searcher.facet_index
+        # 世代ごとに1回だけ作ればいいもの（フィルター用メタデータのレスポンスなど）
+        self.cache: Dict[str, Any] = {}
+        self.loaded_at = time.time()
+        self.inflight = 0
+        self.retired = False
+        self._drained = asyncio.Event()
+
+    def acquire(self):
+        self.inflight += 1
+
+    def release(self):
+        self.inflight -= 1
+        if self.retired and self.inflight == 0:
+            self._drained.set()
+
+    async def drain(self, timeout: float) -> bool:
+        """処理中のリクエストが終わるのを待つ。タイムアウトしたらFalse"""
+        self.retired = True
+        if self.inflight == 0:
+            return True
+        try:
+            await asyncio.wait_for(self._drained.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "generation": self.generation,
+            "documents": len(self.metadata),
+            "loaded_at": self.loaded_at,
+            "inflight": self.inflight,
+        }
+
+
+class IndexManager:
+    """
+    現在の世代を持っておいて、リロード時にアトミックに差し替える
+
+    差し替えはイベントループ上での代入だけなので、リクエストから見ると
+    必ず古い世代か新しい世代のどちらか一方になる。
+    """
+
+    def __init__(
+        self,
+        index_dir: Optional[str] = None,
+        drain_timeout: float = 30.0,
+        on_swap: Optional[Callable[[IndexGeneration], None]] = None,
+        on_load: Optional[Callable[[IndexGeneration], None]] = None,
+    ):
+        """
+        on_load: 新しい世代を読み込んだ直後、差し替える前にexecutorで呼ぶ。
+                 世代ごとの派生データ（generation.cache）をここで作っておく
+        on_swap: 差し替えたときにイベントループ上で呼ぶ
+        """
+        self.index_dir = index_dir
+        self.drain_timeout = drain_timeout
+        self.on_swap = on_swap
+        self.on_load = on_load
+        self.current: Optional[IndexGeneration] = None
+        self._reload_lock = asyncio.Lock()
+
+    async def load_initial(self) -> IndexGeneration:
+        """起動時の読み込み。モデルの読み込みもここで行う"""
+        loop = asyncio.get_running_loop()
+        generation = await loop.run_in_executor(
+            None, lambda: self._prepare(HybridSearcher(index_dir=self.index_dir))
+        )
+        self._swap(generation)
+        return generation
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[IndexGeneration]:
+        """リクエスト処理中は世代を掴んでおく（解放されないように）"""
+        generation = self.current
+        if generation is None:
+            raise RuntimeError("Index not loaded")
+        generation.acquire()
+        try:
+            yield generation
+        finally:
+            generation.release()
+
+    async def reload(self, generation: Optional[str] = None, force: bool = False) -> IndexGeneration:
+        """
+        新しい世代を読み込んで差し替える
+
+        generationを省略するとCURRENTが指す世代を読み込む。
+        同じ世代がすでに使われていれば何もしない（force=Trueなら読み直す）。
+        """
+        async with self._reload_lock:
+            old = self.current
+            if old is None:
+                raise RuntimeError("Index not loaded")
+
+            target = generation or current_generation(old.searcher.index_dir) or old.generation
+            if target == old.generation and not force:
+                logger.info(f"Index generation {target} is already active")
+                return old
+
+            logger.info(f"Loading index generation {target} in background...")
+            start_time = time.time()
+            loop = asyncio.get_running_loop()
+            new = await loop.run_in_executor(
+                None, lambda: self._prepare(old.searcher.load_generation(target))
+            )
+            self._swap(new)
+            logger.info(
+                f"Swapped index generation {old.generation} -> {new.generation} "
+                f"({len(new.metadata)} docs, {time.time() - start_time:.1f}s)"
+            )
+
+            # 古い世代は処理中のリクエストが終わってから解放
+            if await old.drain(self.drain_timeout):
+                old.searcher.close()
+                old.metadata = []
+                old.doc_index = DocIndex([])
+                old.hierarchy = HierarchyIndex([])
+                old.suggest = SuggestIndex([])
+                old.cache.clear()
+                gc.collect()
+                logger.info(f"Released index generation {old.generation}")
+            else:
+                # 強制的に解放すると処理中の検索が壊れるので、参照を手放すだけにしてGCに任せる
+                logger.warning(
+                    f"Generation {old.generation} still has {old.inflight} in-flight requests "
+                    f"after {self.drain_timeout}s; leaving it to GC"
+                )
+            return new
+
+    async def watch(self, interval: float):
+        """CURRENTファイルを定期的に見て、変わっていたらリロードする"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if self.current is None:
+                    continue
+                latest = current_generation(self.current.searcher.index_dir)
+                if latest and latest != self.current.generation:
+                    await self.reload(latest)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Index watcher error: {e}", exc_info=True)
+
+    def _prepare(self, searcher: HybridSearcher) -> IndexGeneration:
+        """executor側で世代を組み立てる"""
+        generation = IndexGeneration(searcher)
+        if self.on_load:
+            self.on_load(generation)
+        return generation
+
+    def _swap(self, generation: IndexGeneration):
+        self.current = generation
+        if self.on_swap:
+            self.on_swap(generation)
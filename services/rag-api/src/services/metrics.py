@@ -0,0 +1,180 @@
+'''
+Prometheusのメトリクス
+
+検索が遅くなったときに、埋め込み・FAISS・BM25・RRF・フィルター・リランク・シリアライズの
+どこで時間がかかっているかを見るためのもの。
+ステージの時間はrag_core.instrumentationのobserverとして受け取ってヒストグラムに入れる。
+
+executorの待ち行列の長さとイベントループの遅れはスクレイプのたびに読む値なので、
+Collectorで返す（値を持っているのはRuntimeStats）。
+'''
+
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from fastapi import Response
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from src.services.feedback_store import FeedbackStore
+from src.services.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# 0.5ms〜5s。BM25やRRFは1ms以下、リランクは数百msになる
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+)
+
+STAGE_SECONDS = Histogram(
+    "rag_stage_duration_seconds",
+    "Duration of each search stage",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+
+SEARCH_SECONDS = Histogram(
+    "rag_search_duration_seconds",
+    "End-to-end duration of search requests",
+    ["endpoint"],
+    buckets=LATENCY_BUCKETS,
+)
+
+
+def observe_stage(name: str, seconds: float):
+    """rag_core.instrumentationのobserver"""
+    STAGE_SECONDS.labels(stage=name).observe(seconds)
+
+
+def server_timing(timings: Dict[str, float], total_ms: Optional[float] = None) -> str:
+    """Server-Timingヘッダーの値（ブラウザの開発者ツールでステージごとの時間が見える）"""
+    entries = [f"{name};dur={ms:.2f}" for name, ms in timings.items()]
+    if total_ms is not None:
+        entries.append(f"total;dur={total_ms:.2f}")
+    return ", ".join(entries)
+
+
+class InstrumentedExecutor(ThreadPoolExecutor):
+    """待っているタスクと実行中のタスクの数を数えるThreadPoolExecutor"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._count_lock = threading.Lock()
+        self.queued = 0
+        self.active = 0
+
+    def submit(self, fn, /, *args, **kwargs):
+        def run():
+            with self._count_lock:
+                self.queued -= 1
+                self.active += 1
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._count_lock:
+                    self.active -= 1
+
+        with self._count_lock:
+            self.queued += 1
+        try:
+            return super().submit(run)
+        except Exception:
+            with self._count_lock:
+                self.queued -= 1
+            raise
+
+
+class RuntimeStats:
+    """
+    スクレイプ時に読む値
+
+    ライフスパンの開始時にexecutorとsingle-flightを登録する。
+    """
+
+    def __init__(self):
+        self.executor: Optional[InstrumentedExecutor] = None
+        self.single_flight: Optional[SingleFlight] = None
+        self.feedback_store: Optional[FeedbackStore] = None
+        self.loop_lag = 0.0
+
+    async def monitor_loop_lag(self, interval: float = 0.5):
+        """
+        イベントループの遅れを測る
+
+        sleepから戻ってくるのが予定より遅れた分が、ループが他の処理で塞がっていた時間。
+        """
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.loop_lag = max(0.0, time.perf_counter() - start - interval)
+
+    def collect(self):
+        yield GaugeMetricFamily(
+            "rag_event_loop_lag_seconds",
+            "Delay of the event loop measured by a periodic sleep",
+            value=self.loop_lag,
+        )
+        if self.executor is not None:
+            yield GaugeMetricFamily(
+                "rag_executor_queue_depth",
+                "Tasks waiting for a thread in the search executor",
+                value=self.executor.queued,
+            )
+            yield GaugeMetricFamily(
+                "rag_executor_active_tasks",
+                "Tasks running in the search executor",
+                value=self.executor.active,
+            )
+        if self.single_flight is not None:
+            stats = self.single_flight.stats()
+            yield CounterMetricFamily(
+                "rag_search_executions",
+                "Searches actually executed",
+                value=stats["executed"],
+            )
+            yield CounterMetricFamily(
+                "rag_search_coalesced",
+                "Searches that shared an identical in-flight search",
+                value=stats["coalesced"],
+            )
+            yield GaugeMetricFamily(
+                "rag_search_inflight",
+                "Distinct searches currently in flight",
+                value=stats["inflight"],
+            )
+        if self.feedback_store is not None:
+            stats = self.feedback_store.stats()
+            yield GaugeMetricFamily(
+                "rag_feedback_queue_depth",
+                "Feedback rows waiting to be written",
+                value=stats["queued"],
+            )
+            yield CounterMetricFamily(
+                "rag_feedback_written",
+                "Feedback rows committed to the store",
+                value=stats["written"],
+            )
+            yield CounterMetricFamily(
+                "rag_feedback_commits",
+                "Group commits of feedback rows",
+                value=stats["batches"],
+            )
+            yield CounterMetricFamily(
+                "rag_feedback_rejected",
+                "Feedback rejected because the write queue was full",
+                value=stats["rejected"],
+            )
+
+
+runtime_stats = RuntimeStats()
+REGISTRY.register(runtime_stats)
+
+
+def metrics_response() -> Response:
+    """/metricsのレスポンス（Prometheusのテキスト形式）"""
+    return Response(content=generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
+
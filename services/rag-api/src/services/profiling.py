@@ -0,0 +1,149 @@
+'''
+動いているプロセスのプロファイリング（管理用）
+
+本番のインスタンスが遅くなったときに、コンテナにデバッガを繋がずに
+どこでCPUを使っているかを見るためのもの。
+
+- SamplingProfiler: 別スレッドから一定間隔で全スレッドのスタックを覗いて数える。
+  結果はcollapsed形式（"関数;関数;関数 回数"）で、flamegraph.plやspeedscopeにそのまま渡せる。
+- tracemallocのスナップショットを前後で取って、増えたメモリを行ごとに出す。
+- profile_call: 1回の検索だけcProfileで計測する（?profile=1）。
+
+どれも呼ばれたときだけ動くので、使っていないときのオーバーヘッドはない。
+'''
+
+import cProfile
+import logging
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 何もしていないスレッドの末端の関数（ファイル名, 関数名）。既定ではサンプルから除く
+IDLE_LEAVES = {
+    ("selectors.py", "select"),   # イベントループの待ち
+    ("threading.py", "wait"),     # ロック・Conditionの待ち
+    ("thread.py", "_worker"),     # executorのスレッドがタスクを待っている
+    ("queue.py", "get"),
+}
+
+MAX_STACK_DEPTH = 128
+
+
+def _frame_label(frame) -> Tuple[str, str]:
+    code = frame.f_code
+    filename = Path(code.co_filename).name
+    name = getattr(code, "co_qualname", code.co_name)
+    return filename, f"{Path(code.co_filename).stem}:{name}"
+
+
+class SamplingProfiler:
+    """全スレッドのスタックを一定間隔で数えるサンプリングプロファイラ"""
+
+    def __init__(self, interval: float = 0.005, include_idle: bool = False):
+        self.interval = interval
+        self.include_idle = include_idle
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._started_at = 0.0
+        self.duration = 0.0
+
+    def start(self):
+        self._started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.duration = time.perf_counter() - self._started_at
+
+    def _run(self):
+        own = threading.get_ident()
+        thread_names: Dict[int, str] = {}
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            if frames.keys() - thread_names.keys():
+                thread_names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in frames.items():
+                if ident == own:
+                    continue
+                leaf_file, _ = _frame_label(frame)
+                if not self.include_idle and (leaf_file, frame.f_code.co_name) in IDLE_LEAVES:
+                    continue
+                labels: List[str] = []
+                while frame is not None and len(labels) < MAX_STACK_DEPTH:
+                    labels.append(_frame_label(frame)[1])
+                    frame = frame.f_back
+                labels.append(thread_names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(labels))] += 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        """collapsed形式（多い順）"""
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+
+class MemoryDiff:
+    """tracemallocのスナップショットの差分。既に動いていればそれを使う"""
+
+    def __init__(self, frames: int = 25):
+        self.frames = frames
+        self._started_here = False
+        self._before: Optional[tracemalloc.Snapshot] = None
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._started_here = True
+        self._before = tracemalloc.take_snapshot()
+
+    def stop(self, top: int = 30) -> List[Dict[str, Any]]:
+        after = tracemalloc.take_snapshot()
+        if self._started_here:
+            tracemalloc.stop()
+        stats = after.compare_to(self._before, "lineno")[:top]
+        return [
+            {
+                "location": str(stat.traceback[0]),
+                "size_diff": stat.size_diff,
+                "count_diff": stat.count_diff,
+                "size": stat.size,
+            }
+            for stat in stats
+        ]
+
+
+def profile_call(fn: Callable[[], Any], top: int = 30) -> Tuple[Any, List[Dict[str, Any]]]:
+    """
+    fnをcProfileで計測して、結果と累積時間の上位の関数を返す
+
+    cProfileは呼んだスレッドだけを計測するので、executorのスレッドの中で呼ぶ。
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        result = fn()
+    finally:
+        profiler.disable()
+
+    stats = pstats.Stats(profiler)
+    rows = []
+    for (filename, line, name), (_, calls, total, cumulative, _) in stats.stats.items():
+        rows.append({
+            "function": f"{Path(filename).name}:{line}({name})",
+            "calls": calls,
+            "total_ms": round(total * 1000, 3),
+            "cumulative_ms": round(cumulative * 1000, 3),
+        })
+    rows.sort(key=lambda row: row["cumulative_ms"], reverse=True)
+    return result, rows[:top]
@@ -0,0 +1,122 @@
+'''
+検索クエリのログ（ウォームアップ用）
+
+再起動やインデックスの切り替えのあと、しばらくは同じよくあるクエリが毎回コールドで実行される。
+どのクエリがよく来るかを残しておいて、新しい世代を使い始める前に上位を実行しておく。
+
+記録するのは正規化したクエリ・フィルター・k・facets・レイテンシ・時刻だけで、
+誰が検索したか（IPやユーザー）は残さない。
+
+record()はバッファに積むだけで、flush_intervalごとに専用スレッドでJSON Linesに追記する。
+ファイルがmax_bytesを超えたら .1 に回す（古い方は1つだけ残す）。
+'''
+
+import asyncio
+import json
+import logging
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from rag_core.text import normalize_filters, normalize_text
+
+logger = logging.getLogger(__name__)
+
+
+class QueryLog:
+    """検索クエリを追記していくログ"""
+
+    def __init__(self, path: str, max_bytes: int = 50_000_000, flush_interval: float = 1.0):
+        self.path = Path(path)
+        self.rotated_path = self.path.with_name(self.path.name + ".1")
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self._buffer: List[str] = []
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="query-log")
+        self._task: Optional[asyncio.Task] = None
+        self.recorded = 0
+
+    async def start(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._task = asyncio.create_task(self._run())
+
+    def record(
+        self,
+        query: str,
+        k: int,
+        filters: Optional[Dict[str, Any]],
+        facets: bool,
+        latency_ms: float
+    ):
+        """1件分をバッファに積む（待たない）"""
+        entry = {
+            "ts": round(time.time(), 3),
+            "query": normalize_text(query),
+            "k": k,
+            "filters": normalize_filters(filters),
+            "facets": facets,
+            "latency_ms": round(latency_ms, 2),
+        }
+        self._buffer.append(json.dumps(entry, ensure_ascii=False) + "\n")
+        self.recorded += 1
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        if not self._buffer:
+            return
+        lines, self._buffer = self._buffer, []
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._executor, self._append, lines)
+        except Exception as e:
+            logger.warning(f"Failed to write {len(lines)} query log entries: {e}")
+
+    def _append(self, lines: List[str]):
+        if self.path.exists() and self.path.stat().st_size >= self.max_bytes:
+            self.path.replace(self.rotated_path)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.writelines(lines)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+        await self.flush()
+        self._executor.shutdown(wait=True)
+
+    def top_queries(self, limit: int, window_seconds: float) -> List[Dict[str, Any]]:
+        """
+        直近window_seconds秒でよく来た検索（同じクエリ・フィルター・k・facetsごと）の上位
+
+        ファイルを読むので、executorで呼ぶこと。まだ書き出していないバッファの分は入らない。
+        """
+        since = time.time() - window_seconds
+        counts: Counter = Counter()
+        for path in (self.rotated_path, self.path):
+            if not path.exists():
+                continue
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 書きかけで落ちた行
+                        continue
+                    if entry.get("ts", 0) < since or not entry.get("query"):
+                        continue
+                    key = (
+                        entry["query"],
+                        entry.get("k", 5),
+                        json.dumps(entry.get("filters") or {}, sort_keys=True, ensure_ascii=False),
+                        bool(entry.get("facets")),
+                    )
+                    counts[key] += 1
+        return [
+            {"query": query, "k": k, "filters": json.loads(filters) or None, "facets": facets, "count": count}
+            for (query, k, filters, facets), count in counts.most_common(limit)
+        ]
@@ -0,0 +1,129 @@
+'''
+レスポンスのシリアライズまわり
+
+中身がインデックスの世代ごとにしか変わらないレスポンスは、JSONのバイト列と
+gzip版、ETagを世代の読み込み時に作っておいて、リクエストのたびには何も計算しない。
+ブラウザがIf-None-Matchを送ってきたら304を返すので、本文も送らずに済む。
+
+検索結果のように毎回変わるレスポンスは、pydanticの検証を通さずに
+orjsonで直接バイト列にする（自分で組み立てた辞書なので検証は不要）。
+社内の他サービス向けに、Acceptでmsgpackも選べる。
+
+段階的に返す検索（SSE）のイベントもここで組み立てる。
+'''
+
+import gzip
+import hashlib
+import json
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from fastapi import Request, Response
+
+try:
+    import orjson
+except ImportError:  # 無ければ標準のjsonで動く（遅いだけ）
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack")
+
+# gzipしても小さくならないサイズ
+GZIP_MIN_SIZE = 1024
+
+
+@dataclass(frozen=True)
+class PrecomputedResponse:
+    """シリアライズ済みのJSONレスポンス"""
+    body: bytes
+    gzip_body: Optional[bytes]
+    etag: str
+
+    @property
+    def gzip_etag(self) -> str:
+        # 表現ごとにETagを分ける（同じETagで中身のバイト列が違うとキャッシュが混乱する）
+        return self.etag[:-1] + '-gzip"'
+
+    @classmethod
+    def from_json(cls, body: bytes) -> "PrecomputedResponse":
+        etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+        gzip_body = gzip.compress(body, compresslevel=9, mtime=0) if len(body) >= GZIP_MIN_SIZE else None
+        return cls(body=body, gzip_body=gzip_body, etag=etag)
+
+    def to_response(self, request: Request) -> Response:
+        """If-None-Matchが一致すれば304、gzipを受け付けるなら圧縮版を返す"""
+        use_gzip = self.gzip_body is not None and "gzip" in request.headers.get("accept-encoding", "")
+        headers = {
+            "ETag": self.gzip_etag if use_gzip else self.etag,
+            # キャッシュしてもいいが、使う前に毎回ETagで確認してもらう
+            "Cache-Control": "no-cache",
+            "Vary": "Accept-Encoding",
+        }
+        if_none_match = request.headers.get("if-none-match")
+        if etag_matches(if_none_match, self.etag) or etag_matches(if_none_match, self.gzip_etag):
+            return Response(status_code=304, headers=headers)
+
+        if use_gzip:
+            headers["Content-Encoding"] = "gzip"
+            return Response(content=self.gzip_body, media_type="application/json", headers=headers)
+        return Response(content=self.body, media_type="application/json", headers=headers)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Matchヘッダー（カンマ区切り、W/付き、* もありうる）とETagを比べる"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def dumps_json(payload: Any) -> bytes:
+    """JSONのバイト列にする。orjsonがあればそれを使う（NaNはnullになる）"""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def wants_msgpack(request: Request) -> bool:
+    """Acceptでmsgpackを指定されたか（msgpackが入っていなければJSONで返す）"""
+    if msgpack is None:
+        return False
+    accept = request.headers.get("accept", "")
+    return any(media_type in accept for media_type in MSGPACK_MEDIA_TYPES)
+
+
+def encode_response(
+    request: Request,
+    payload: Dict[str, Any],
+    headers: Optional[Dict[str, str]] = None
+) -> Response:
+    """
+    組み立て済みの辞書をそのままレスポンスにする
+
+    FastAPIはResponseを返すとresponse_modelの検証とjsonable_encoderを飛ばすので、
+    ここでエンコードした1回だけで済む。
+    """
+    headers = {**(headers or {}), "Vary": "Accept"}
+    if wants_msgpack(request):
+        return Response(
+            content=msgpack.packb(payload, use_bin_type=True),
+            media_type="application/msgpack",
+            headers=headers,
+        )
+    return Response(content=dumps_json(payload), media_type="application/json", headers=headers)
+
+
+def sse_event(event: str, payload: Any) -> bytes:
+    """Server-Sent Eventsの1イベント分（dataは1行のJSON）"""
+    return b"event: " + event.encode("utf-8") + b"\ndata: " + dumps_json(payload) + b"\n\n"
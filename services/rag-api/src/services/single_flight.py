@@ -0,0 +1,76 @@
+'''
+同じ内容の検索をまとめる（single-flight）
+
+ラインが止まると、何人ものオペレーターが数秒のうちに同じエラーコードで検索する。
+それぞれが検索をexecutorで最初から実行すると、一番混んでいるときに同じ計算を何回もやることになる。
+実行中の検索と同じキーのリクエストが来たら、新しく実行せずにその結果を待って共有する。
+
+計算は1つのタスクとして走らせて、待つ側はshieldで包んで待つ。
+最初のリクエストが切断（キャンセル）されても、後から来たリクエストの計算は止まらない。
+'''
+
+import asyncio
+import json
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from rag_core.text import normalize_filters, normalize_text
+
+logger = logging.getLogger(__name__)
+
+
+def search_key(
+    generation: Optional[str],
+    query: str,
+    k: int,
+    filters: Optional[Dict[str, Any]] = None,
+    **options: Any
+) -> Hashable:
+    """
+    検索をまとめるためのキー
+
+    クエリは正規化（NFKC・空白の整理）して、フィルターはnormalize_filtersで揃える。
+    世代が違えば結果も違うのでキーに入れる。
+    """
+    return (
+        generation,
+        normalize_text(query),
+        k,
+        json.dumps(normalize_filters(filters), sort_keys=True, ensure_ascii=False),
+        tuple(sorted(options.items())),
+    )
+
+
+class SingleFlight:
+    """キーごとに実行中の計算を1つだけにする"""
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    async def run(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """同じキーの計算が実行中ならその結果を待つ。なければfnを実行する"""
+        task = self._inflight.get(key)
+        if task is None:
+            self.executed += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            self.coalesced += 1
+        # 待っている側がキャンセルされても計算は続ける（他のリクエストも待っている）
+        return await asyncio.shield(task)
+
+    def _finish(self, key: Hashable, task: asyncio.Future):
+        self._inflight.pop(key, None)
+        # 待っている側が全員キャンセルされていても「例外が取り出されていない」警告を出さない
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "inflight": len(self._inflight),
+        }
@@ -0,0 +1,488 @@
+"""
+rag_coreの部品ごとのマイクロベンチマーク
+
+FAISS・BM25・トークナイズ・チャンク分割・RRF・フィルター・ファセット・リランクを
+合成データ（1k〜1Mチャンク）で動かして、レイテンシのパーセンタイル・スループット・
+ピークメモリをJSONに保存する。前回のJSON（ベースライン）と比べて、遅くなった部品を数字で出す。
+
+件数でスケールする部品（dense / sparse / facets）は件数ごとに、それ以外は決まった入力で1回だけ測る。
+表も「件数ごと」と「固定入力」に分けて出す（固定入力の部品を件数の列に並べると、件数で変わったように見えるので）。
+
+文章はgenerate_demo_data.pyのテンプレートから作る。MeCabで数百万回トークナイズすると
+それだけで時間がかかるので、現象・原因・処置の文をプールしておいて、その組み合わせで文書を作る。
+
+メモリを部品・件数ごとに測るため、1ケースずつ別プロセスで実行する（ru_maxrssがそのケースのピーク）。
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import generate_demo_data as demo  # noqa: E402  (importするとlogging.basicConfigされるので下でforce)
+
+from rag_core.chunking import TextChunker  # noqa: E402
+from rag_core.config import settings  # noqa: E402
+from rag_core.dense_index import FaissIndexManager  # noqa: E402
+from rag_core.facets import FacetIndex  # noqa: E402
+from rag_core.search import HybridSearcher  # noqa: E402
+from rag_core.sparse_index import BM25IndexManager  # noqa: E402
+from rag_core.tokenization import tokenizer  # noqa: E402
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', force=True)
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+# 文のプールの大きさ（この組み合わせで文書を作る）
+POOL_SIZE = 2_000
+
+
+# ==================== 合成データ ====================
+
+class SyntheticCorpus:
+    """
+    テンプレートから作った文のプール
+
+    文書は (現象, 原因, 処置) の組み合わせなので、プールが2000件でも
+    ほぼ重複しない文書を何百万件でも作れる。トークン列はプールのものを使い回す。
+    """
+
+    def __init__(self, seed: int = 42, pool_size: int = POOL_SIZE):
+        random.seed(seed)
+        self.rng = np.random.default_rng(seed)
+        self.records = [demo.generate_record(i) for i in range(pool_size)]
+        self.sections = {
+            name: [record[name] for record in self.records]
+            for name in ("symptom", "root_cause", "action_taken")
+        }
+        self.section_tokens = {
+            name: [tokenizer.tokenize(text) for text in texts]
+            for name, texts in self.sections.items()
+        }
+
+    def _picks(self, size: int) -> np.ndarray:
+        return self.rng.integers(0, len(self.records), size=(size, 3))
+
+    def texts(self, size: int) -> List[str]:
+        picks = self._picks(size)
+        symptoms, causes, actions = (self.sections[name] for name in ("symptom", "root_cause", "action_taken"))
+        return [
+            f"【現象】\n{symptoms[a]}\n\n【原因】\n{causes[b]}\n\n【処置】\n{actions[c]}"
+            for a, b, c in picks
+        ]
+
+    def tokens(self, size: int) -> List[List[str]]:
+        picks = self._picks(size)
+        symptoms, causes, actions = (self.section_tokens[name] for name in ("symptom", "root_cause", "action_taken"))
+        return [symptoms[a] + causes[b] + actions[c] for a, b, c in picks]
+
+    def metadata(self, size: int) -> List[Dict[str, Any]]:
+        """チャンクのメタデータ（階層・カテゴリはプールの記録から取る）"""
+        keys = ("location", "line", "category", "work_type", "equipment1", "equipment2", "equipment3")
+        rows = self.rng.integers(0, len(self.records), size=size)
+        return [
+            {
+                "chunk_id": f"doc_{i:07d}_chunk_0",
+                "doc_id": f"doc_{i:07d}",
+                "chunk_index": 0,
+                "text": "",
+                "metadata": {key: self.records[row][key] for key in keys},
+            }
+            for i, row in enumerate(rows)
+        ]
+
+    def queries(self, count: int) -> List[str]:
+        """クエリは現象の文の一部（実際の検索に近い長さ）"""
+        return [text[:30] for text in self.rng.choice(self.sections["symptom"], size=count)]
+
+
+# ==================== ベンチマークのケース ====================
+# setup(size, corpus, opts) → run(i)。使えない部品（モデルが読めないなど）はNoneを返す
+
+def setup_tokenize(size, corpus: SyntheticCorpus, opts) -> Callable[[int], Any]:
+    texts = corpus.texts(opts.iterations)
+    return lambda i: tokenizer.tokenize(texts[i])
+
+
+def setup_chunk(size, corpus: SyntheticCorpus, opts) -> Callable[[int], Any]:
+    chunker = TextChunker()
+    # 保全記録はほとんど1チャンクに収まるので、長い文書も混ぜる
+    texts = ["\n".join(corpus.texts(int(n))) for n in corpus.rng.integers(1, 8, size=opts.iterations)]
+    return lambda i: chunker.chunk_text(texts[i], doc_id=f"doc_{i}")
+
+
+def setup_dense(size, corpus: SyntheticCorpus, opts) -> Callable[[int], Any]:
+    tmp = Path(tempfile.mkdtemp(prefix="bench_dense_"))
+    manager = FaissIndexManager(str(tmp / "bench.faiss"), str(tmp / "bench.meta.json"), autoload=False)
+    manager.create(opts.dim)
+    # IVFなど学習が要るタイプ（設定のindex_type）は先に学習する。ベクトルは乱数なのでどこから取っても同じ
+    if manager.needs_training:
+        sample_size = min(size, settings["indexing"]["train_sample_size"])
+        manager.train(corpus.rng.standard_normal((sample_size, opts.dim), dtype=np.float32))
+    # 1Mx768でも一度に乱数を作らないように分けて足す
+    for start in range(0, size, 100_000):
+        count = min(100_000, size - start)
+        manager.add_batch(corpus.rng.standard_normal((count, opts.dim), dtype=np.float32))
+    manager.metadata = corpus.metadata(size)
+    queries = corpus.rng.standard_normal((opts.iterations, opts.dim), dtype=np.float32)
+    top_k = settings["retrieval"]["dense_top_k"]
+    return lambda i: manager.search(queries[i], top_k=top_k)
+
+
+def setup_sparse(size, corpus: SyntheticCorpus, opts) -> Callable[[int], Any]:
+    tmp = Path(tempfile.mkdtemp(prefix="bench_sparse_"))
+    manager = BM25IndexManager(str(tmp / "bench.bm25"), str(tmp / "bench.bm25.meta.json"), autoload=False)
+    manager.build(corpus.tokens(size))
+    manager.metadata = corpus.metadata(size)
+    queries = [tokenizer.tokenize(query) for query in corpus.queries(opts.iterations)]
+    top_k = settings["retrieval"]["sparse_top_k"]
+    return lambda i: manager.search(queries[i], top_k=top_k)
+
+
+def _candidate_lists(corpus: SyntheticCorpus, opts, size: int) -> List[Tuple[Dict[str, float], Dict[str, float]]]:
+    """Dense/Sparseの上位k件っぽい (chunk_id → スコア) の組（半分くらい重なる）"""
+    dense_k = settings["retrieval"]["dense_top_k"]
+    sparse_k = settings["retrieval"]["sparse_top_k"]
+    lists = []
+    for _ in range(opts.iterations):
+        ids = corpus.rng.integers(0, size, size=dense_k + sparse_k)
+        dense = {f"doc_{i:07d}_chunk_0": float(s) for i, s in zip(ids[:dense_k], corpus.rng.random(dense_k))}
+        shared = ids[dense_k // 2:dense_k]
+        sparse_ids = np.concatenate([shared, ids[dense_k:]])[:sparse_k]
+        sparse = {f"doc_{i:07d}_chunk_0": float(s) * 20 for i, s in zip(sparse_ids, corpus.rng.random(sparse_k))}
+        lists.append((dense, sparse))
+    return lists
+
+
+def setup_fusion(size, corpus: SyntheticCorpus, opts) -> Callable[[int], Any]:
+    searcher = HybridSearcher.__new__(HybridSearcher)  # インデックスもモデルも読まない
+    lists = _candidate_lists(corpus, opts, opts.candidate_pool)
+    return lambda i: searcher._reciprocal_rank_fusion(list(lists[i]))
+
+
+def setup_filter(size, corpus: SyntheticCorpus, opts) -> Callable[[int], Any]:
+    searcher = HybridSearcher.__new__(HybridSearcher)
+    candidate_count = settings["retrieval"]["dense_top_k"] + settings["retrieval"]["sparse_top_k"]
+    candidates = corpus.metadata(candidate_count * 10)
+    filters = _sample_filters(corpus, opts.iterations)
+
+    def run(i):
+        start = (i * candidate_count) % len(candidates)
+        return [c for c in candidates[start:start + candidate_count] if searcher._apply_filters(c, filters[i])]
+    return run
+
+
+def setup_facets(size, corpus: SyntheticCorpus, opts) -> Callable[[int], Any]:
+    facet_index = FacetIndex(corpus.metadata(size))
+    filters = _sample_filters(corpus, opts.iterations)
+    return lambda i: facet_index.counts(mask=facet_index.mask(filters[i]))
+
+
+def setup_rerank(size, corpus: SyntheticCorpus, opts) -> Optional[Callable[[int], Any]]:
+    from rag_core.reranker import Reranker
+
+    reranker = Reranker(model_name=opts.reranker_model)
+    if not reranker.is_available:
+        return None
+    count = settings["retrieval"]["rerank_candidates"]
+    queries = corpus.queries(opts.iterations)
+    texts = corpus.texts(count * 10)
+    candidates = [{"chunk_id": str(i), "text": text, "score": 0.0} for i, text in enumerate(texts)]
+
+    def run(i):
+        start = (i * count) % len(candidates)
+        return reranker.rerank(queries[i], candidates[start:start + count])
+    return run
+
+
+def _sample_filters(corpus: SyntheticCorpus, count: int) -> List[Dict[str, List[str]]]:
+    """ライン1つ＋カテゴリ1つ、くらいのよくある絞り込み"""
+    filters = []
+    for row in corpus.rng.integers(0, len(corpus.records), size=count):
+        record = corpus.records[row]
+        filters.append({"productionLines": [record["line"]], "categories": [record["category"]]})
+    return filters
+
+
+# (setup, 件数でスケールするか)。スケールしない部品は件数ごとに回さない
+COMPONENTS: Dict[str, Tuple[Callable, bool]] = {
+    "tokenize": (setup_tokenize, False),
+    "chunk": (setup_chunk, False),
+    "dense": (setup_dense, True),
+    "sparse": (setup_sparse, True),
+    "fusion": (setup_fusion, False),
+    "filter": (setup_filter, False),
+    "facets": (setup_facets, True),
+    "rerank": (setup_rerank, False),
+}
+
+
+def fixed_input(component: str) -> str:
+    """件数でスケールしない部品の入力（表とJSONに出す）"""
+    retrieval = settings["retrieval"]
+    return {
+        "tokenize": "1文書",
+        "chunk": "1〜7件分の長さの文書",
+        "fusion": f"Dense {retrieval['dense_top_k']}件 + Sparse {retrieval['sparse_top_k']}件",
+        "filter": f"候補{retrieval['dense_top_k'] + retrieval['sparse_top_k']}件",
+        "rerank": f"候補{retrieval['rerank_candidates']}件",
+    }.get(component, "-")
+
+
+# ==================== 計測 ====================
+
+def _peak_rss_mb() -> float:
+    # Linuxはキロバイト、macOSはバイト
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _current_rss_mb() -> Optional[float]:
+    """今のRSS（Linuxのみ）。torchなどのimport分を差し引くのに使う"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except OSError:
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+def run_case(component: str, size: Optional[int], opts: argparse.Namespace) -> Dict[str, Any]:
+    """1ケース分。別プロセスで呼ばれる"""
+    setup, _ = COMPONENTS[component]
+    corpus = SyntheticCorpus(seed=opts.seed)
+    rss_before = _current_rss_mb()
+
+    start = time.perf_counter()
+    run = setup(size, corpus, opts)
+    setup_seconds = time.perf_counter() - start
+    result: Dict[str, Any] = {"component": component, "size": size}
+    if size is None:
+        result["input"] = fixed_input(component)
+    if run is None:
+        result["skipped"] = "not available"
+        return result
+
+    for i in range(min(opts.warmup, opts.iterations)):
+        run(i)
+
+    durations = np.empty(opts.iterations, dtype=np.float64)
+    for i in range(opts.iterations):
+        start = time.perf_counter()
+        run(i)
+        durations[i] = time.perf_counter() - start
+
+    ms = durations * 1000
+    result.update({
+        "iterations": opts.iterations,
+        "setup_s": round(setup_seconds, 3),
+        "mean_ms": round(float(ms.mean()), 4),
+        "p50_ms": round(float(np.percentile(ms, 50)), 4),
+        "p95_ms": round(float(np.percentile(ms, 95)), 4),
+        "p99_ms": round(float(np.percentile(ms, 99)), 4),
+        "throughput": round(float(opts.iterations / durations.sum()), 1),
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+    })
+    rss_after = _current_rss_mb()
+    if rss_before is not None and rss_after is not None:
+        # インデックスなど、このケースで増えた分（importの分を含まない）
+        result["rss_growth_mb"] = round(rss_after - rss_before, 1)
+    return result
+
+
+def run_suite(opts: argparse.Namespace) -> List[Dict[str, Any]]:
+    cases: List[Tuple[str, Optional[int]]] = []
+    for component in opts.components:
+        _, scales = COMPONENTS[component]
+        for size in (opts.sizes if scales else [None]):
+            cases.append((component, size))
+
+    results = []
+    for component, size in cases:
+        label = f"{component} (n={size:,})" if size else component
+        logger.info(f"計測中: {label}")
+        if opts.no_isolate:
+            result = run_case(component, size, opts)
+        else:
+            # ケースごとにプロセスを分ける（ピークメモリを分けて測るため）
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+                result = pool.submit(run_case, component, size, opts).result()
+        if "skipped" in result:
+            logger.info(f"  スキップ: {result['skipped']}")
+        else:
+            logger.info(
+                f"  p50={result['p50_ms']:.3f}ms p95={result['p95_ms']:.3f}ms "
+                f"{result['throughput']:,.0f} ops/s peak={result['peak_rss_mb']:.0f}MB "
+                f"(+{result.get('rss_growth_mb', 0):.0f}MB) setup={result['setup_s']:.1f}s"
+            )
+        results.append(result)
+    return results
+
+
+def print_results(results: List[Dict[str, Any]]):
+    """結果を「件数ごと」と「固定入力」の2つの表で出す"""
+    measured = [r for r in results if "skipped" not in r]
+    scaled = [r for r in measured if r.get("size")]
+    fixed = [r for r in measured if not r.get("size")]
+
+    print("\n" + "=" * 86)
+    print("件数ごと")
+    print("=" * 86)
+    print(f"{'Component':<12} {'Size':>10} {'p50':>10} {'p95':>10} {'Throughput':>12} {'Memory':>10}")
+    print("-" * 86)
+    for r in scaled:
+        print(
+            f"{r['component']:<12} {r['size']:>10,} {r['p50_ms']:>8.3f}ms {r['p95_ms']:>8.3f}ms "
+            f"{r['throughput']:>8,.0f}op/s {r.get('rss_growth_mb', r['peak_rss_mb']):>8.0f}MB"
+        )
+
+    print("\n" + "=" * 86)
+    print("固定入力（コーパスの件数によらない）")
+    print("=" * 86)
+    print(f"{'Component':<12} {'Input':<30} {'p50':>10} {'p95':>10} {'Throughput':>12}")
+    print("-" * 86)
+    for r in fixed:
+        print(
+            f"{r['component']:<12} {r['input']:<30} {r['p50_ms']:>8.3f}ms {r['p95_ms']:>8.3f}ms "
+            f"{r['throughput']:>8,.0f}op/s"
+        )
+    print("=" * 86 + "\n")
+
+
+def environment() -> Dict[str, Any]:
+    import faiss
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "faiss": getattr(faiss, "__version__", "unknown"),
+    }
+
+
+# ==================== 比較 ====================
+
+def _key(result: Dict[str, Any]) -> Tuple[str, Optional[int]]:
+    return result["component"], result.get("size")
+
+
+def compare(current: List[Dict[str, Any]], baseline: List[Dict[str, Any]], threshold: float) -> List[Dict[str, Any]]:
+    """
+    ベースラインとの差（%）。p95かスループットがthreshold以上悪くなったらregression
+
+    メモリは参考値（同じマシンでないと比べられないので判定には使わない）。
+    """
+    baseline_by_key = {_key(r): r for r in baseline if "skipped" not in r}
+    rows = []
+    for result in current:
+        before = baseline_by_key.get(_key(result))
+        if before is None or "skipped" in result:
+            continue
+        def change(name):
+            return (result[name] - before[name]) / before[name] * 100 if before[name] else 0.0
+        row = {
+            "component": result["component"],
+            "size": result.get("size"),
+            "input": result.get("input"),
+            "p50": change("p50_ms"),
+            "p95": change("p95_ms"),
+            "throughput": change("throughput"),
+            # importの分を除いた増加量があればそちらで比べる
+            "memory": change("rss_growth_mb" if "rss_growth_mb" in result and "rss_growth_mb" in before else "peak_rss_mb"),
+        }
+        row["regression"] = row["p95"] > threshold or row["throughput"] < -threshold
+        rows.append(row)
+    return rows
+
+
+def print_comparison(rows: List[Dict[str, Any]]):
+    print("\n" + "=" * 86)
+    print("ベースラインとの比較（+は遅くなった / スループットは-が悪化）")
+    print("=" * 86)
+    sections = [
+        ("件数ごと", [row for row in rows if row["size"]]),
+        ("固定入力", [row for row in rows if not row["size"]]),
+    ]
+    for title, section in sections:
+        if not section:
+            continue
+        print(f"[{title}]")
+        print(f"{'Component':<12} {'Size / Input':>24} {'p50':>10} {'p95':>10} {'Throughput':>12} {'Memory':>10}")
+        print("-" * 86)
+        for row in section:
+            size = f"{row['size']:,}" if row["size"] else (row["input"] or "-")
+            mark = "  ← REGRESSION" if row["regression"] else ""
+            print(
+                f"{row['component']:<12} {size:>24} {row['p50']:>+9.1f}% {row['p95']:>+9.1f}% "
+                f"{row['throughput']:>+11.1f}% {row['memory']:>+9.1f}%{mark}"
+            )
+        print()
+    print("=" * 86 + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='rag_coreのマイクロベンチマーク')
+    parser.add_argument('--components', nargs='+', default=list(COMPONENTS), choices=list(COMPONENTS),
+                        help='計測する部品')
+    parser.add_argument('--sizes', nargs='+', type=int, default=DEFAULT_SIZES,
+                        help='コーパスの件数（dense / sparse / facets）')
+    parser.add_argument('--iterations', type=int, default=200, help='1ケースあたりの計測回数')
+    parser.add_argument('--warmup', type=int, default=10, help='計測前に捨てる回数')
+    parser.add_argument('--dim', type=int, default=768, help='ベクトルの次元数')
+    parser.add_argument('--candidate-pool', type=int, default=100_000,
+                        help='fusionの候補のchunk_idを取る範囲')
+    parser.add_argument('--reranker-model', type=str, default=settings["retrieval"]["reranker_model"])
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', type=str, default=str(Path(__file__).parent / "benchmark_results.json"),
+                        help='結果のJSON')
+    parser.add_argument('--baseline', type=str, default=None, help='比較するJSON（前回の結果）')
+    parser.add_argument('--threshold', type=float, default=10.0, help='regressionとみなす悪化率（%%）')
+    parser.add_argument('--no-isolate', action='store_true',
+                        help='ケースごとにプロセスを分けない（速いがピークメモリは累積になる）')
+    opts = parser.parse_args()
+
+    results = run_suite(opts)
+    print_results(results)
+    report = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "environment": environment(),
+        "config": {
+            "iterations": opts.iterations,
+            "dim": opts.dim,
+            "seed": opts.seed,
+            "index_type": settings["indexing"]["index_type"],
+        },
+        "results": results,
+    }
+    output_path = Path(opts.output)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    logger.info(f"Results saved to {output_path}")
+
+    if opts.baseline:
+        with open(opts.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        rows = compare(results, baseline["results"], opts.threshold)
+        print_comparison(rows)
+        if any(row["regression"] for row in rows):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,20 +3,30 @@ RAG検索の精度評価スクリプト
 
 MRRとかRecall@Kとか計算する。
 ハイブリッド検索がどれくらい効いてるか数字で見たかったから作った。
+
+実際のインデックスに対して、検索モード（dense / sparse / hybrid / rerank）ごとに
+精度とレイテンシ（p50/p95/p99）を測る。クエリは並列に投げる。
+パラメータ（dense_top_kなど）やインデックスを変えた組み合わせも一緒に測って、
+レイテンシと精度のパレートフロンティアに乗る設定に印を付ける。
 """
 
 import argparse
+import itertools
 import json
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
 from typing import List, Dict, Any, Optional
-from dataclasses import dataclass
+from dataclasses import dataclass, asdict
 import numpy as np
 
 # rag_coreがインストールされてる場合だけインポート
 # ローカルで動かすときはインストールしてないことが多いのでtry-except
 try:
-    from rag_core import HybridSearcher  # noqa: F401
+    from rag_core import HybridSearcher
+    from rag_core.config import settings
     RAG_CORE_AVAILABLE = True
 except ImportError:
     RAG_CORE_AVAILABLE = False
@@ -26,6 +36,9 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 logger = logging.getLogger(__name__)
 
 
+MODES = ['dense', 'sparse', 'hybrid', 'rerank']
+
+
 @dataclass
 class EvaluationResult:
     """評価結果をまとめるやつ"""
@@ -36,6 +49,15 @@ class EvaluationResult:
     recall_at_5: float
     precision_at_5: float
     num_queries: int
+    # どのインデックス・パラメータで測ったか
+    config: str = "default"
+    # レイテンシ（シミュレーションのときはNone）
+    p50_ms: Optional[float] = None
+    p95_ms: Optional[float] = None
+    p99_ms: Optional[float] = None
+    qps: Optional[float] = None
+    # レイテンシと精度のパレートフロンティアに乗っているか
+    pareto: bool = False
 
 
 def load_test_queries(path: str = "sample_queries.json") -> List[Dict[str, Any]]:
@@ -133,29 +155,63 @@ def simulate_search_results(
     return results
 
 
+def search_by_mode(searcher: Any, query: str, mode: str) -> List[Dict[str, Any]]:
+    """
+    モードごとに検索する
+
+    dense / sparse は片方のインデックスだけ、hybrid はRRFまで（リランクなし）、
+    rerank はHybridSearcher.searchと同じ流れ。
+    """
+    if mode == "dense":
+        query_vector = searcher.embedding_service.encode(query, show_progress=False)
+        hits = searcher.dense_searcher.search(query_vector, top_k=settings["retrieval"]["dense_top_k"])
+        return [meta for meta, _ in hits]
+    if mode == "sparse":
+        hits = searcher.sparse_searcher.search(
+            searcher.tokenizer.tokenize(query), top_k=settings["retrieval"]["sparse_top_k"]
+        )
+        return [meta for meta, _ in hits]
+    candidates = searcher.retrieve(query)
+    return searcher.finalize(query, candidates, rerank=(mode == "rerank"))
+
+
 def evaluate_search_method(
     queries: List[Dict[str, Any]],
     mode: str,
-    searcher: Optional[Any] = None
+    searcher: Optional[Any] = None,
+    workers: int = 1,
+    config: str = "default"
 ) -> EvaluationResult:
-    """指定した検索手法を評価"""
+    """
+    指定した検索手法を評価
+
+    searcherがあればクエリをworkers並列で実際に検索して、1件ごとの時間も測る。
+    """
+    use_searcher = searcher is not None and RAG_CORE_AVAILABLE
+
+    def run_query(q: Dict[str, Any]):
+        start = time.perf_counter()
+        if use_searcher:
+            results = search_by_mode(searcher, q['query'], mode)
+        else:
+            # シミュレーションモード
+            results = simulate_search_results(q['query'], list(q['relevant_docs']), mode)
+        return results, time.perf_counter() - start
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        outputs = list(pool.map(run_query, queries))
+    wall_time = time.perf_counter() - wall_start
+
     rankings = []
     hits_at_1 = []
     hits_at_3 = []
     hits_at_5 = []
     relevant_counts_at_5 = []
     
-    for q in queries:
-        query_text = q['query']
+    for q, (results, _) in zip(queries, outputs):
         relevant_docs = set(q['relevant_docs'])
         
-        # 検索実行（実際のシステムがあるか、シミュレーションか）
-        if searcher and RAG_CORE_AVAILABLE:
-            results = searcher.search(query_text)
-        else:
-            # シミュレーションモード
-            results = simulate_search_results(query_text, list(relevant_docs), mode)
-        
         # 結果からdoc_idを取り出す
         result_doc_ids = []
         for r in results[:10]:
@@ -178,6 +234,16 @@ def evaluate_search_method(
         # Precision@5用（上位5件中に正解がいくつあるか）
         relevant_in_top5 = sum(1 for doc_id in result_doc_ids[:5] if doc_id in relevant_docs)
         relevant_counts_at_5.append(relevant_in_top5)
+
+    latency = {}
+    if use_searcher and outputs:
+        ms = np.array([elapsed for _, elapsed in outputs]) * 1000
+        latency = {
+            "p50_ms": float(np.percentile(ms, 50)),
+            "p95_ms": float(np.percentile(ms, 95)),
+            "p99_ms": float(np.percentile(ms, 99)),
+            "qps": len(queries) / wall_time if wall_time > 0 else None,
+        }
     
     return EvaluationResult(
         method=mode,
@@ -186,23 +252,83 @@ def evaluate_search_method(
         recall_at_3=calculate_recall_at_k(hits_at_3, 3),
         recall_at_5=calculate_recall_at_k(hits_at_5, 5),
         precision_at_5=calculate_precision_at_k(relevant_counts_at_5, 5),
-        num_queries=len(queries)
+        num_queries=len(queries),
+        config=config,
+        **latency
     )
 
 
+def mark_pareto(results: List[EvaluationResult]):
+    """
+    p95レイテンシが小さく、MRRが大きい方が良いとして、
+    他のどの組み合わせにも負けていない（両方で劣るものがない）結果に印を付ける
+    """
+    measured = [r for r in results if r.p95_ms is not None]
+    for r in measured:
+        r.pareto = not any(
+            other.p95_ms <= r.p95_ms and other.mrr >= r.mrr
+            and (other.p95_ms < r.p95_ms or other.mrr > r.mrr)
+            for other in measured
+        )
+
+
+def parse_grid(items: List[str]) -> List[Dict[str, int]]:
+    """
+    "dense_top_k=10,20" のような指定を組み合わせに展開する
+
+    ["dense_top_k=10,20", "rerank_candidates=5,10"] → 4通り
+    """
+    axes = []
+    for item in items:
+        name, _, values = item.partition("=")
+        axes.append([(name, int(value)) for value in values.split(",")])
+    return [dict(combo) for combo in itertools.product(*axes)] if axes else [{}]
+
+
+@contextmanager
+def override_retrieval(params: Dict[str, int]):
+    """settings["retrieval"]を一時的に書き換える（組み合わせは順番に測るので並列では使わない）"""
+    original = dict(settings["retrieval"])
+    settings["retrieval"].update(params)
+    try:
+        yield
+    finally:
+        settings["retrieval"].clear()
+        settings["retrieval"].update(original)
+
+
+def config_label(index_dir: Optional[str], params: Dict[str, int], multiple_indices: bool) -> str:
+    parts = [Path(index_dir).name] if multiple_indices and index_dir else []
+    parts += [f"{name}={value}" for name, value in params.items()]
+    return ",".join(parts) or "default"
+
+
 def print_results(results: List[EvaluationResult]):
     """結果を表形式で出力"""
-    print("\n" + "=" * 80)
+    has_latency = any(r.p95_ms is not None for r in results)
+    width = 120 if has_latency else 80
+    print("\n" + "=" * width)
     print("RAG検索の評価結果")
-    print("=" * 80)
-    print(f"\n{'Method':<25} {'MRR@5':>10} {'R@1':>10} {'R@3':>10} {'R@5':>10} {'P@5':>10}")
-    print("-" * 80)
+    print("=" * width)
+    header = f"{'Method':<25} {'MRR@5':>10} {'R@1':>10} {'R@3':>10} {'R@5':>10} {'P@5':>10}"
+    if has_latency:
+        header = f"{'Config':<28} " + header + f" {'p50':>8} {'p95':>8} {'QPS':>8}"
+    print(header)
+    print("-" * width)
     
     for r in results:
-        print(f"{r.method:<25} {r.mrr:>10.3f} {r.recall_at_1:>10.3f} {r.recall_at_3:>10.3f} {r.recall_at_5:>10.3f} {r.precision_at_5:>10.3f}")
+        line = f"{r.method:<25} {r.mrr:>10.3f} {r.recall_at_1:>10.3f} {r.recall_at_3:>10.3f} {r.recall_at_5:>10.3f} {r.precision_at_5:>10.3f}"
+        if has_latency:
+            latency = (
+                f" {r.p50_ms:>8.1f} {r.p95_ms:>8.1f} {r.qps:>8.1f}" if r.p95_ms is not None else ""
+            )
+            line = f"{r.config[:28]:<28} " + line + latency + ("  *" if r.pareto else "")
+        print(line)
     
-    print("-" * 80)
+    print("-" * width)
     print(f"\n評価したクエリ数: {results[0].num_queries if results else 0}")
+    if has_latency:
+        print("* = p95レイテンシとMRRのパレートフロンティア（どちらかを良くするにはもう片方を犠牲にする組み合わせ）")
     
     # 改善率を計算
     if len(results) >= 2:
@@ -211,18 +337,28 @@ def print_results(results: List[EvaluationResult]):
         improvement = ((best - baseline) / baseline) * 100 if baseline > 0 else 0
         print(f"MRR改善率（ベースライン → ベスト）: +{improvement:.1f}%")
     
-    print("=" * 80 + "\n")
+    print("=" * width + "\n")
 
 
 def main():
     parser = argparse.ArgumentParser(description='RAG検索の精度評価')
     parser.add_argument('--mode', type=str, default='all',
-                        choices=['all', 'dense', 'sparse', 'hybrid', 'rerank'],
+                        choices=['all'] + MODES,
                         help='評価する検索モード')
     parser.add_argument('--queries', type=str, default='sample_queries.json',
                         help='テストクエリファイル')
     parser.add_argument('--simulate', action='store_true',
                         help='シミュレーションモード（実際の検索なし）')
+    parser.add_argument('--index-dir', type=str, nargs='+', default=None,
+                        help='評価するインデックス（複数指定すると比較する）。省略時は設定のindex_path')
+    parser.add_argument('--generation', type=str, default=None,
+                        help='インデックスの世代（省略時はCURRENT）')
+    parser.add_argument('--grid', type=str, nargs='*', default=[],
+                        help='試すパラメータ（例: dense_top_k=10,20 rerank_candidates=5,10）')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='クエリを並列に投げる数')
+    parser.add_argument('--output', type=str, default=str(Path(__file__).parent / "evaluation_results.json"),
+                        help='結果のJSON')
     args = parser.parse_args()
     
     # シミュレーションモード（実際の検索システムなしで動かす）
@@ -238,28 +374,66 @@ def main():
     
     # 評価実行
     results = []
-    modes = ['dense', 'sparse', 'hybrid', 'rerank'] if args.mode == 'all' else [args.mode]
-    
-    for mode in modes:
-        logger.info(f"{mode}検索を評価中...")
-        result = evaluate_search_method(queries, mode)
-        results.append(result)
-        logger.info(f"  MRR@5: {result.mrr:.3f}, Recall@5: {result.recall_at_5:.3f}")
+    modes = MODES if args.mode == 'all' else [args.mode]
+
+    if not RAG_CORE_AVAILABLE:
+        for mode in modes:
+            logger.info(f"{mode}検索を評価中...")
+            result = evaluate_search_method(queries, mode)
+            results.append(result)
+            logger.info(f"  MRR@5: {result.mrr:.3f}, Recall@5: {result.recall_at_5:.3f}")
+    else:
+        # キャッシュが効くと2回目以降の組み合わせだけ速く見えるので切っておく
+        settings["retrieval"]["query_cache_size"] = 0
+        settings["retrieval"]["rerank_cache_size"] = 0
+        index_dirs = args.index_dir or [None]
+        grid = parse_grid(args.grid)
+        shared: Optional[Any] = None
+        for index_dir in index_dirs:
+            # モデルは最初のSearcherのものを使い回す
+            if shared is None:
+                searcher = HybridSearcher(index_dir=index_dir, generation=args.generation)
+                shared = searcher
+            else:
+                searcher = HybridSearcher(
+                    index_dir=index_dir,
+                    generation=args.generation,
+                    embedding_service=shared.embedding_service,
+                    reranker=shared.reranker,
+                )
+            for params in grid:
+                label = config_label(index_dir, params, len(index_dirs) > 1)
+                with override_retrieval(params):
+                    for mode in modes:
+                        if mode == "rerank" and not searcher.can_rerank:
+                            logger.warning("Re-rankerが使えないので、rerankモードはスキップします")
+                            continue
+                        logger.info(f"{mode}検索を評価中... ({label})")
+                        result = evaluate_search_method(
+                            queries, mode, searcher=searcher, workers=args.workers, config=label
+                        )
+                        results.append(result)
+                        logger.info(
+                            f"  MRR@5: {result.mrr:.3f}, Recall@5: {result.recall_at_5:.3f}, "
+                            f"p95: {result.p95_ms:.1f}ms"
+                        )
+        mark_pareto(results)
     
     # 結果を出力
     print_results(results)
     
     # JSONファイルにも保存しておく
-    output_path = Path(__file__).parent / "evaluation_results.json"
+    output_path = Path(args.output)
+    rounded = []
+    for r in results:
+        row = {
+            key: round(value, 3) if isinstance(value, float) else value
+            for key, value in asdict(r).items()
+            if key != "num_queries" and value is not None
+        }
+        rounded.append(row)
     with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump([{
-            "method": r.method,
-            "mrr": round(r.mrr, 3),
-            "recall_at_1": round(r.recall_at_1, 3),
-            "recall_at_3": round(r.recall_at_3, 3),
-            "recall_at_5": round(r.recall_at_5, 3),
-            "precision_at_5": round(r.precision_at_5, 3)
-        } for r in results], f, indent=2, ensure_ascii=False)
+        json.dump(rounded, f, indent=2, ensure_ascii=False)
     logger.info(f"Results saved to {output_path}")
 
 
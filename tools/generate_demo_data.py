@@ -2,13 +2,27 @@
 ポートフォリオ用のデモデータ生成スクリプト
 実際の保全記録っぽいダミーデータを作る
 工場 → ライン → 設備の階層構造をちゃんと守る
+
+スケールテスト用に、数百万件をブロックごとに複数プロセスで作って
+CSV / Parquetに書き足していくモードもある（generate_corpus）。
+シードを指定すれば何回作っても同じデータになる。
+語彙の偏り・エラーコードの出やすさ・似た記録の割合も変えられる。
 """
 
+import argparse
+import bisect
+import csv
+import io
+import os
 import pandas as pd
 import random
+import re
 import logging
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
-from typing import List, Dict
+from typing import Any, List, Dict, Optional
 from pathlib import Path
 
 # ログ設定（デバッグ用）
@@ -113,76 +127,131 @@ PARTS_DB = {
 
 MODELS = ["6204ZZ", "6005DDU", "MY2N-D2", "G3NA-210B", "E3Z-T61", "CV-X100", "FX5U-32MT", "GT2710", "CR-700"]
 
+PREVENTIONS = ["", "定期点検項目への追加。", "保全カレンダーへの登録。", "オペレーターへの清掃指導。", "予備品の在庫発注点見直し。"]
+
+# エラーコードが出てくる現象のテンプレートと、出てこないもの
+CODE_SYMPTOM_TEMPLATES = [t for t in SYMPTOM_TEMPLATES if "{code}" in t]
+PLAIN_SYMPTOM_TEMPLATES = [t for t in SYMPTOM_TEMPLATES if "{code}" not in t]
+
+# エラーコードの候補。偏りを付けるときに100番台ばかり出ないように順番を混ぜておく
+ERROR_CODES = list(range(100, 1000))
+random.Random(0).shuffle(ERROR_CODES)
+
+# 似た記録の元にする、直近の記録の数
+NEAR_DUP_WINDOW = 1000
+
 # ==================== データ生成のヘルパー関数 ====================
 
-def generate_date(start_year=2021, end_year=2025) -> str:
+class Vocabulary:
+    """
+    テンプレート・部品・型式・エラーコードの選び方
+
+    skew: 0なら一様。大きいほど一部の語ばかり出る（Zipf分布の指数、実データは1前後）
+    error_code_rate: 現象にエラーコードが出てくる記録の割合。Noneならテンプレートの比率のまま
+    """
+
+    def __init__(self, skew: float = 0.0, error_code_rate: Optional[float] = None):
+        self.skew = skew
+        self.error_code_rate = error_code_rate
+        self._cum_weights: Dict[int, List[float]] = {}
+
+    def _weights(self, n: int) -> List[float]:
+        if n not in self._cum_weights:
+            total = 0.0
+            cum = []
+            for rank in range(1, n + 1):
+                total += 1.0 / rank ** self.skew
+                cum.append(total)
+            self._cum_weights[n] = cum
+        return self._cum_weights[n]
+
+    def pick(self, rng, items: List[Any]) -> Any:
+        if not self.skew:
+            return rng.choice(items)
+        cum = self._weights(len(items))
+        return items[bisect.bisect(cum, rng.random() * cum[-1])]
+
+    def symptom_template(self, rng) -> str:
+        if self.error_code_rate is None:
+            return self.pick(rng, SYMPTOM_TEMPLATES)
+        if rng.random() < self.error_code_rate:
+            return self.pick(rng, CODE_SYMPTOM_TEMPLATES)
+        return self.pick(rng, PLAIN_SYMPTOM_TEMPLATES)
+
+
+UNIFORM = Vocabulary()
+
+def generate_date(start_year=2021, end_year=2025, rng=random) -> str:
     start = datetime(start_year, 1, 1)
     end = datetime(end_year, 5, 30)
     delta = end - start
-    random_days = random.randrange(delta.days)
+    random_days = rng.randrange(delta.days)
     return (start + timedelta(days=random_days)).strftime("%Y-%m-%d")
 
-def format_template(template, category):
-    part = random.choice(PARTS_DB[category])
-    model = random.choice(MODELS)
-    value = random.randint(10, 200)
-    spec = random.randint(value, value + 50)
-    code = random.randint(100, 999)
-    feature = random.choice(["外径", "全長", "内径", "厚み"])
+def format_template(template, category, rng=random, vocab: Vocabulary = UNIFORM):
+    part = vocab.pick(rng, PARTS_DB[category])
+    model = vocab.pick(rng, MODELS)
+    value = rng.randint(10, 200)
+    spec = rng.randint(value, value + 50)
+    code = vocab.pick(rng, ERROR_CODES)
+    feature = rng.choice(["外径", "全長", "内径", "厚み"])
     
     return template.format(
         part=part, model=model, value=value, spec=spec, code=code, feature=feature
     )
 
-def generate_record(index: int) -> Dict:
+def build_text(symptom: str, cause: str, action: str, prevention: str) -> str:
+    return f"""【現象】
+{symptom}
+
+【原因】
+{cause}
+
+【処置】
+{action}
+
+【備考】
+{prevention if prevention else '特になし。'}"""
+
+def generate_record(index: int, rng=random, vocab: Vocabulary = UNIFORM) -> Dict:
     # 1. 階層構造をランダムに選ぶ
-    location = random.choice(list(FACTORY_LINE_MAP.keys()))
-    line = random.choice(FACTORY_LINE_MAP[location])
+    location = rng.choice(list(FACTORY_LINE_MAP.keys()))
+    line = rng.choice(FACTORY_LINE_MAP[location])
     
     # ラインからカテゴリを選ぶ（簡略版）
-    category = random.choice(LINE_CATEGORY_MAP[line])
+    category = rng.choice(LINE_CATEGORY_MAP[line])
     
     # 設備の階層を選ぶ
     eq1_list = list(EQUIPMENT_TREE[category].keys())
-    equipment1 = random.choice(eq1_list)
-    equipment2 = random.choice(EQUIPMENT_TREE[category][equipment1])
-    equipment3 = f"{equipment2} #{random.randint(1, 4)}" # 例：操作盤 #2
+    equipment1 = rng.choice(eq1_list)
+    equipment2 = rng.choice(EQUIPMENT_TREE[category][equipment1])
+    equipment3 = f"{equipment2} #{rng.randint(1, 4)}" # 例：操作盤 #2
     
-    work_type = random.choices(WORK_TYPES, weights=WORK_TYPE_WEIGHTS)[0]
+    work_type = rng.choices(WORK_TYPES, weights=WORK_TYPE_WEIGHTS)[0]
     
     # 2. テンプレートから文章を生成
-    symptom = format_template(random.choice(SYMPTOM_TEMPLATES), category)
-    cause = format_template(random.choice(CAUSE_TEMPLATES), category)
-    action = format_template(random.choice(ACTION_TEMPLATES), category)
+    symptom = format_template(vocab.symptom_template(rng), category, rng, vocab)
+    cause = format_template(vocab.pick(rng, CAUSE_TEMPLATES), category, rng, vocab)
+    action = format_template(vocab.pick(rng, ACTION_TEMPLATES), category, rng, vocab)
     
     # 3. その他の詳細情報
-    prevention = random.choice(["", "定期点検項目への追加。", "保全カレンダーへの登録。", "オペレーターへの清掃指導。", "予備品の在庫発注点見直し。"])
+    prevention = rng.choice(PREVENTIONS)
     
-    full_text = f"""【現象】
-{symptom}
-
-【原因】
-{cause}
-
-【処置】
-{action}
-
-【備考】
-{prevention if prevention else '特になし。'}"""
+    full_text = build_text(symptom, cause, action, prevention)
 
     # 作業時間とダウンタイム
-    work_time = random.randint(30, 300)
+    work_time = rng.randint(30, 300)
     downtime = 0
     if work_type == "重大故障":
-        downtime = work_time + random.randint(0, 120)
+        downtime = work_time + rng.randint(0, 120)
     elif work_type == "修理票":
-        downtime = random.randint(0, 60)
+        downtime = rng.randint(0, 60)
 
     return {
         "doc_id": f"doc_{index:06d}",
         "source_number": f"Rpt-{index:04d}",
         "work_type": work_type,
-        "date": generate_date(),
+        "date": generate_date(rng=rng),
         "location": location,
         "line": line,
         "category": category,
@@ -199,6 +268,29 @@ def generate_record(index: int) -> Dict:
         "text": full_text
     }
 
+def near_duplicate(original: Dict, index: int, rng=random) -> Dict:
+    """
+    originalとほとんど同じ記録（同じ故障を別の人が書いた・票を二重に起票した想定）
+
+    設備の号機・数値・備考だけ変える。duplicate_ofに元のdoc_idを入れておく（重複除去の評価用）。
+    """
+    record = dict(original)
+    symptom = re.sub(r"\d+", lambda m: str(int(m.group()) + rng.randint(1, 9)), original["symptom"], count=1)
+    prevention = rng.choice(PREVENTIONS)
+    equipment3 = f"{original['equipment2']} #{rng.randint(1, 4)}"
+    record.update({
+        "doc_id": f"doc_{index:06d}",
+        "source_number": f"Rpt-{index:04d}",
+        "date": generate_date(rng=rng),
+        "equipment3": equipment3,
+        "equipment_full": f"{original['equipment1']} > {original['equipment2']} > {equipment3}",
+        "symptom": symptom,
+        "prevention": prevention,
+        "text": build_text(symptom, original["root_cause"], original["action_taken"], prevention),
+        "duplicate_of": original.get("duplicate_of") or original["doc_id"],
+    })
+    return record
+
 def generate_demo_data(count: int = 500, output_path: str = "data/demo/demo_logs.csv"):
     logger.info(f"Generating {count} realistic demo records...")
     
@@ -214,5 +306,173 @@ def generate_demo_data(count: int = 500, output_path: str = "data/demo/demo_logs
     df.to_csv(path, index=False, encoding='utf-8')
     logger.info(f"Saved to {path}")
 
+# ==================== スケールテスト用（ストリーミング生成） ====================
+
+CORPUS_COLUMNS = [
+    "doc_id", "source_number", "work_type", "date", "location", "line", "category",
+    "equipment1", "equipment2", "equipment3", "equipment_full",
+    "work_duration_minutes", "downtime_minutes",
+    "symptom", "root_cause", "action_taken", "prevention", "text", "duplicate_of",
+]
+INT_COLUMNS = {"work_duration_minutes", "downtime_minutes"}
+
+def _generate_block(
+    block_index: int,
+    start: int,
+    count: int,
+    seed: int,
+    skew: float,
+    error_code_rate: Optional[float],
+    near_dup_rate: float,
+    format: str
+) -> Any:
+    """
+    1ブロック分の記録を作る（ワーカープロセスで実行）
+
+    乱数はシードとブロック番号から作るので、プロセス数を変えても同じ内容になる。
+    dictのリストのまま返すとpickleが重いので、CSVなら書き出す文字列、
+    ParquetならArrowのテーブルにしてから返す。
+    """
+    rng = random.Random(f"{seed}:{block_index}")
+    vocab = Vocabulary(skew=skew, error_code_rate=error_code_rate)
+    recent: deque = deque(maxlen=NEAR_DUP_WINDOW)
+    records = []
+    for index in range(start, start + count):
+        if recent and rng.random() < near_dup_rate:
+            record = near_duplicate(rng.choice(recent), index, rng)
+        else:
+            record = generate_record(index, rng, vocab)
+            record["duplicate_of"] = ""
+            recent.append(record)
+        records.append(record)
+
+    if format == "parquet":
+        pa, _ = _pa()
+        return pa.table({
+            column: pa.array(
+                [r[column] for r in records], type=pa.int32() if column in INT_COLUMNS else pa.string()
+            )
+            for column in CORPUS_COLUMNS
+        })
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerows([r[column] for column in CORPUS_COLUMNS] for r in records)
+    return buffer.getvalue()
+
+def _pa():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("Parquetで出力するにはpyarrowが必要です: pip install pyarrow") from e
+    return pa, pq
+
+def generate_corpus(
+    count: int,
+    output_path: str,
+    seed: int = 0,
+    workers: Optional[int] = None,
+    block_size: int = 50000,
+    skew: float = 0.0,
+    error_code_rate: Optional[float] = None,
+    near_dup_rate: float = 0.0
+):
+    """
+    スケールテスト用に大量の記録を作る
+
+    block_size件ずつワーカープロセスで作り、作った順ではなくブロックの順に書き足す。
+    処理中のブロックはワーカー数の2倍までなので、件数が増えてもメモリは増えない。
+    拡張子が.parquet / .pqならParquet（zstd圧縮）、それ以外はCSV。
+    同じseedとblock_sizeなら、何回作っても（プロセス数を変えても）同じ出力になる。
+    """
+    path = Path(output_path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    format = "parquet" if path.suffix in (".parquet", ".pq") else "csv"
+    workers = workers or os.cpu_count() or 2
+
+    logger.info(
+        f"Generating {count} records into {path} "
+        f"({workers} workers, blocks of {block_size}, seed={seed}, skew={skew}, "
+        f"error_code_rate={error_code_rate}, near_dup_rate={near_dup_rate})"
+    )
+    started = time.perf_counter()
+    written = 0
+
+    if format == "parquet":
+        pa, pq = _pa()
+        schema = pa.schema([
+            (column, pa.int32() if column in INT_COLUMNS else pa.string()) for column in CORPUS_COLUMNS
+        ])
+        parquet_writer = pq.ParquetWriter(tmp_path, schema, compression="zstd")
+        write_block = parquet_writer.write_table
+    else:
+        csv_file = open(tmp_path, 'w', encoding='utf-8', newline='')
+        csv_file.write(",".join(CORPUS_COLUMNS) + "\n")
+        write_block = csv_file.write
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+
+            def write_oldest():
+                nonlocal written
+                start, size, future = pending.popleft()
+                write_block(future.result())
+                written = start + size
+
+            for block_index, start in enumerate(range(0, count, block_size)):
+                size = min(block_size, count - start)
+                future = executor.submit(
+                    _generate_block, block_index, start, size, seed,
+                    skew, error_code_rate, near_dup_rate, format
+                )
+                pending.append((start, size, future))
+                if len(pending) >= workers * 2:
+                    write_oldest()
+                    elapsed = time.perf_counter() - started
+                    logger.info(f"{written}/{count} records ({written / elapsed:,.0f} records/s)")
+            while pending:
+                write_oldest()
+    finally:
+        if format == "parquet":
+            parquet_writer.close()
+        else:
+            csv_file.close()
+
+    # 途中で落ちたときに中途半端なファイルが残らないように、最後に差し替える
+    tmp_path.replace(path)
+    elapsed = time.perf_counter() - started
+    logger.info(f"Saved {count} records to {path} in {elapsed:.1f}s ({count / elapsed:,.0f} records/s)")
+
 if __name__ == "__main__":
-    generate_demo_data()
+    parser = argparse.ArgumentParser(description="保全記録のデモデータを作る")
+    parser.add_argument("--count", type=int, default=500, help="作る記録の数")
+    parser.add_argument("--output", default="data/demo/demo_logs.csv",
+                        help="出力先（.parquet / .pqならParquet、それ以外はCSV）")
+    parser.add_argument("--stream", action="store_true",
+                        help="ブロックごとに複数プロセスで作って書き足す（大量に作るとき用）")
+    parser.add_argument("--seed", type=int, default=0, help="乱数のシード（--stream時）")
+    parser.add_argument("--workers", type=int, default=None, help="プロセス数（デフォルトはCPUコア数）")
+    parser.add_argument("--block-size", type=int, default=50000, help="1プロセスが一度に作る件数")
+    parser.add_argument("--skew", type=float, default=0.0,
+                        help="語彙の偏り（Zipfの指数。0で一様、1前後で実データに近い）")
+    parser.add_argument("--error-code-rate", type=float, default=None,
+                        help="現象にエラーコードが出てくる記録の割合（0〜1）")
+    parser.add_argument("--near-dup-rate", type=float, default=0.0,
+                        help="直前の記録とほぼ同じ内容の記録の割合（0〜1）")
+    args = parser.parse_args()
+
+    if args.stream:
+        generate_corpus(
+            args.count,
+            args.output,
+            seed=args.seed,
+            workers=args.workers,
+            block_size=args.block_size,
+            skew=args.skew,
+            error_code_rate=args.error_code_rate,
+            near_dup_rate=args.near_dup_rate,
+        )
+    else:
+        generate_demo_data(args.count, args.output)
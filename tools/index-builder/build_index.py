@@ -5,72 +5,669 @@
 
 import logging
 from pathlib import Path
+import os
 import sys
 import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List
+
+import numpy as np
 
 # rag_coreをインポートできるようにパスを追加
 project_root = Path(__file__).parent.parent.parent
 sys.path.append(str(project_root / "packages" / "rag-core"))
 
-from rag_core.dense_index import FaissIndexManager
+from rag_core.dense_index import FaissIndexManager, MetadataWriter
 from rag_core.sparse_index import BM25IndexManager
 from rag_core.embeddings import EmbeddingService
-from rag_core.tokenization import tokenizer
+from rag_core.embedding_store import EmbeddingStore
+from rag_core.tokenization import tokenizer, tokenize_parallel
 from rag_core.chunking import Chunk
+from rag_core.dedup import DuplicateGroups, deduplicate, save_duplicates
+from rag_core.segments import remove_files
+from rag_core.columnar import (
+    count_chunks_parquet,
+    is_parquet,
+    iter_chunk_batches_parquet,
+    iter_texts_parquet,
+    load_chunk_dicts_parquet,
+)
+from rag_core.config import settings
+from rag_core.generations import (
+    DEFAULT_FILES,
+    LEGACY_GENERATION,
+    IndexManifest,
+    create_generation_dir,
+    fork_generation,
+    publish_generation,
+    resolve_manifest,
+)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def load_chunks(filepath: Path):
-    chunks = []
+CHECKPOINT_FILE = "build.checkpoint.json"
+
+def _select_metadata(data: Dict[str, Any], metadata_fields: List[str] | None) -> Dict[str, Any]:
+    """JSONLのチャンクのメタデータをmetadata_fieldsの項目だけにする（Parquetは読むときに絞る）"""
+    if metadata_fields is not None:
+        meta = data.get('metadata') or {}
+        data['metadata'] = {key: meta[key] for key in metadata_fields if key in meta}
+    return data
+
+def load_chunk_dicts(
+    filepath: Path,
+    metadata_fields: List[str] | None = settings["indexing"]["metadata_fields"]
+) -> List[Dict[str, Any]]:
+    """
+    チャンクをインデックスのメタデータの形（Chunk.to_dict()）で読む
+
+    ParquetはChunkを経由せずに必要な列だけ読む（rag_core.columnar）。
+    """
+    if is_parquet(filepath):
+        return load_chunk_dicts_parquet(filepath, metadata_fields)
+    with open(filepath, 'r', encoding='utf-8') as f:
+        return [
+            Chunk(**_select_metadata(json.loads(line), metadata_fields)).to_dict()
+            for line in f if line.strip()
+        ]
+
+def iter_chunk_batches(
+    filepath: Path,
+    batch_size: int,
+    skip: int = 0,
+    metadata_fields: List[str] | None = settings["indexing"]["metadata_fields"]
+) -> Iterator[List[Chunk]]:
+    """チャンクをbatch_size件ずつ読む。skip件目までは読み飛ばす（再開用）"""
+    if is_parquet(filepath):
+        yield from iter_chunk_batches_parquet(filepath, batch_size, skip, metadata_fields)
+        return
+    batch: List[Chunk] = []
+    with open(filepath, 'r', encoding='utf-8') as f:
+        for i, line in enumerate(f):
+            if i < skip or not line.strip():
+                continue
+            batch.append(Chunk(**_select_metadata(json.loads(line), metadata_fields)))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+def iter_texts(filepath: Path) -> Iterator[str]:
+    """textだけを1件ずつ読む（Parquetならtextの列しか読まない）"""
+    if is_parquet(filepath):
+        yield from iter_texts_parquet(filepath)
+        return
     with open(filepath, 'r', encoding='utf-8') as f:
         for line in f:
-            data = json.loads(line)
-            chunks.append(Chunk(**data))
-    return chunks
+            if line.strip():
+                yield json.loads(line)['text']
+
+def count_chunks(filepath: Path) -> int:
+    if is_parquet(filepath):
+        return count_chunks_parquet(filepath)
+    with open(filepath, 'r', encoding='utf-8') as f:
+        return sum(1 for line in f if line.strip())
+
+class StageTimer:
+    """
+    ステージごとの処理時間とスループット（chunks/s）を記録する
+
+    ビルドマシンのサイズを決めるときの材料にする。
+    並列モードではステージが重なるので、合計時間は各ステージの和より短くなる。
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str, count: int):
+        start_time = time.perf_counter()
+        yield
+        elapsed = time.perf_counter() - start_time
+        with self._lock:
+            self.stages[name] = {
+                "chunks": count,
+                "seconds": round(elapsed, 3),
+                "chunks_per_sec": round(count / elapsed, 1) if elapsed > 0 else 0.0,
+            }
+
+    def report(self, total_seconds: float) -> Dict[str, Any]:
+        logger.info("ステージ別スループット:")
+        for name, stats in self.stages.items():
+            logger.info(
+                f"  {name:<12} {stats['seconds']:>9.2f}s {stats['chunks_per_sec']:>10.1f} chunks/s"
+            )
+        logger.info(f"  {'total':<12} {total_seconds:>9.2f}s")
+        return {"stages": self.stages, "total_seconds": round(total_seconds, 3)}
+
+
+def open_embedding_store(path: str | None, embedding_service: EmbeddingService) -> EmbeddingStore | None:
+    """埋め込みストアを開く。pathが空なら使わない"""
+    if not path:
+        return None
+    return EmbeddingStore(path, embedding_service.model_name, embedding_service.dimension)
+
+def embed_texts(
+    texts: List[str],
+    embedding_service: EmbeddingService,
+    store: EmbeddingStore | None = None,
+    workers: int | None = None,
+    show_progress: bool = True
+):
+    """エンコードする。ストアがあれば、ストアにないチャンクだけエンコードする"""
+    def encode(batch: List[str]):
+        if workers:
+            return embedding_service.encode_parallel(batch, workers=workers)
+        return embedding_service.encode(batch, show_progress=show_progress)
+
+    if store is None:
+        return encode(texts)
+    return store.get_or_encode(texts, encode)
+
+def _build_dense(
+    texts: List[str],
+    metadata: List[Dict[str, Any]],
+    index_dir: Path,
+    embedding_service: EmbeddingService,
+    timer: StageTimer,
+    workers: int | None = None,
+    store: EmbeddingStore | None = None
+):
+    """Dense Index（FAISS）を構築。workersを指定するとマルチプロセスでエンコード"""
+    logger.info("Dense Index (FAISS) を構築中...")
+    with timer.stage("embed", len(texts)):
+        embeddings = embed_texts(texts, embedding_service, store, workers)
 
-def build_index(input_file: str, output_dir: str):
+    with timer.stage("faiss_build", len(texts)):
+        faiss_manager = FaissIndexManager(
+            str(index_dir / "maintenance.faiss"),
+            str(index_dir / "maintenance.faiss.meta.json")
+        )
+        faiss_manager.build(embeddings)
+        faiss_manager.save(metadata)
+
+
+def _build_sparse(
+    texts: List[str],
+    metadata: List[Dict[str, Any]],
+    index_dir: Path,
+    timer: StageTimer,
+    workers: int | None = None
+):
+    """Sparse Index（BM25）を構築。workersを指定するとMeCabをプロセスプールで並列実行"""
+    logger.info("Sparse Index (BM25) を構築中...")
+    with timer.stage("tokenize", len(texts)):
+        if workers:
+            tokenized_corpus = tokenize_parallel(texts, workers=workers)
+        else:
+            tokenized_corpus = [tokenizer.tokenize(text) for text in texts]
+
+    with timer.stage("bm25_build", len(texts)):
+        bm25_manager = BM25IndexManager(
+            str(index_dir / "maintenance.bm25"),
+            str(index_dir / "maintenance.bm25.meta.pkl")
+        )
+        bm25_manager.build(tokenized_corpus)
+        bm25_manager.save(metadata)
+
+
+def build_index(
+    input_file: str,
+    output_dir: str,
+    as_generation: bool = False,
+    parallel: bool = False,
+    workers: int | None = None,
+    stats_file: str | None = None,
+    embedding_store: str | None = settings["data"]["embedding_store_path"],
+    dedup: bool = settings["indexing"]["dedup"]["enabled"],
+    compact_store: bool = False
+):
+    """
+    インデックスを構築する
+
+    as_generation=Trueなら output_dir/generations/<世代ID>/ に書き出して、
+    最後にCURRENTを切り替える。rag-apiは再起動なしで新しい世代に切り替わる。
+
+    parallel=Trueなら、トークナイズ（プロセスプール）とエンコード（マルチプロセス）を並列化して、
+    Dense側とSparse側の構築を同時に進める。
+
+    embedding_storeを指定すると、前回までに計算した埋め込みを使い回して
+    新しいチャンク・変わったチャンクだけエンコードする（Noneなら全件エンコード）。
+    compact_store=Trueなら、構築後にストアを今回のチャンクの分だけに詰め直す。
+
+    dedup=Trueなら、ほぼ同じチャンクをまとめて代表だけをFAISSとBM25に入れる（rag_core.dedup）。
+    """
+    build_start = time.perf_counter()
+    timer = StageTimer()
     input_path = Path(input_file)
-    index_dir = Path(output_dir)
-    index_dir.mkdir(parents=True, exist_ok=True)
+    index_root = Path(output_dir)
+    index_root.mkdir(parents=True, exist_ok=True)
+
+    if as_generation:
+        generation, index_dir = create_generation_dir(index_root)
+        logger.info(f"新しい世代として構築します: {generation}")
+    else:
+        generation, index_dir = LEGACY_GENERATION, index_root
+    manifest = IndexManifest(generation=generation, base_dir=index_dir)
     
     logger.info(f"チャンクファイルを読み込み中: {input_path}")
-    chunks = load_chunks(input_path)
+    with timer.stage("load", 0):
+        metadata = load_chunk_dicts(input_path)
+    timer.stages["load"]["chunks"] = len(metadata)
     
     # メタデータとテキストを準備
-    metadata = [chunk.to_dict() for chunk in chunks]
-    texts = [chunk.text for chunk in chunks]
-    
-    # 1. Dense Index（FAISS）を構築
-    logger.info("Dense Index (FAISS) を構築中...")
+    duplicates_path = manifest.path("duplicates")
+    if dedup:
+        dedup_config = settings["indexing"]["dedup"]
+        with timer.stage("dedup", len(metadata)):
+            metadata, duplicates = deduplicate(
+                metadata,
+                threshold=dedup_config["threshold"],
+                num_perm=dedup_config["num_perm"],
+                group_by=dedup_config["group_by"],
+            )
+            save_duplicates(duplicates_path, duplicates)
+    else:
+        # 前回まとめたときのファイルが残っていると、まとめていないインデックスに混ざる
+        duplicates_path.unlink(missing_ok=True)
+    texts = [item['text'] for item in metadata]
+
     embedding_service = EmbeddingService()
-    embeddings = embedding_service.encode(texts, show_progress=True)
+    store = open_embedding_store(embedding_store, embedding_service)
+
+    if parallel:
+        # 埋め込みワーカーとMeCabワーカーでコアを分け合う
+        total_workers = workers or os.cpu_count() or 2
+        embed_workers = max(1, total_workers // 2)
+        tokenize_workers = max(1, total_workers - embed_workers)
+        logger.info(f"並列モード: 埋め込み{embed_workers}プロセス, トークナイズ{tokenize_workers}プロセス")
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [
+                executor.submit(
+                    _build_dense, texts, metadata, index_dir, embedding_service, timer, embed_workers, store
+                ),
+                executor.submit(_build_sparse, texts, metadata, index_dir, timer, tokenize_workers),
+            ]
+            for future in futures:
+                future.result()
+    else:
+        # 1. Dense Index（FAISS）を構築
+        _build_dense(texts, metadata, index_dir, embedding_service, timer, store=store)
+        # 2. Sparse Index（BM25）を構築
+        _build_sparse(texts, metadata, index_dir, timer)
+
+    manifest.num_chunks = len(metadata)
+    manifest.embedding_model = embedding_service.model_name
+    if as_generation:
+        publish_generation(index_root, manifest)
+    else:
+        manifest.save()
+
+    if compact_store and store is not None:
+        store.compact(texts)
     
+    stats = timer.report(time.perf_counter() - build_start)
+    if stats_file:
+        with open(stats_file, 'w', encoding='utf-8') as f:
+            json.dump(stats, f, ensure_ascii=False, indent=2)
+
+    logger.info("インデックス構築完了！")
+
+def _iter_tokens(tokens_path: Path) -> Iterator[List[str]]:
+    with open(tokens_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            yield json.loads(line)
+
+def _save_checkpoint(path: Path, state: Dict[str, Any]):
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def _training_sample(embeddings: np.ndarray, count: int) -> np.ndarray:
+    """memmapの先頭count件から、FAISSの学習用のサンプルを全体から無作為に抜き出す"""
+    size = min(count, settings["indexing"]["train_sample_size"])
+    rows = np.sort(np.random.default_rng(0).choice(count, size=size, replace=False))
+    return np.asarray(embeddings[rows])
+
+def _add_from_memmap(faiss_manager: FaissIndexManager, embeddings: np.ndarray, count: int, batch_size: int):
+    """memmapの先頭count件をバッチごとにFAISSへ追加する"""
+    for start in range(0, count, batch_size):
+        faiss_manager.add_batch(np.asarray(embeddings[start:min(start + batch_size, count)]))
+
+def build_index_streaming(
+    input_file: str,
+    output_dir: str,
+    as_generation: bool = False,
+    batch_size: int = 1024,
+    resume: bool = False,
+    embedding_store: str | None = settings["data"]["embedding_store_path"],
+    compact_store: bool = False
+):
+    """
+    メモリ使用量を抑えたストリーミング構築（数百万チャンク向け）
+
+    - チャンクはbatch_size件ずつ読む（全件をリストに載せない）
+    - 埋め込みはバッチごとにディスク上のmemmapとFAISSに追記する
+    - メタデータはJSON配列として1件ずつ書く（BM25とFAISSで同じファイルを共有）
+    - トークン列は一時ファイルに書いて、最後にBM25をファイルから1件ずつ読みながら構築する
+    - バッチごとにチェックポイントを書くので、--resumeで途中から再開できる
+      （再開時、FAISSはmemmapから積み直すだけで再エンコードはしない）
+
+    FAISS（Flat）とBM25の転置情報そのものは件数に比例するので、そこは残る。
+    IVF/PQなど学習が要るindex_typeは、全件をmemmapに書き終えてから全体から抜き出したサンプルで学習し、
+    それからmemmapの順にFAISSへ追加する（最初のバッチだけで学習すると偏るし、nlistより少ないと失敗する）。
+    compact_store=Trueなら、最後に入力を読み直して埋め込みストアを今回のチャンクの分だけに詰め直す。
+    """
+    input_path = Path(input_file).resolve()
+    index_root = Path(output_dir)
+    index_root.mkdir(parents=True, exist_ok=True)
+    checkpoint_path = index_root / CHECKPOINT_FILE
+
+    state: Dict[str, Any] | None = None
+    if resume and checkpoint_path.exists():
+        with open(checkpoint_path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        if state["input"] != str(input_path):
+            raise ValueError(f"チェックポイントの入力ファイルが違います: {state['input']}")
+        logger.info(f"チェックポイントから再開します: {state['processed']}/{state['total']}件")
+    else:
+        if as_generation:
+            generation, index_dir = create_generation_dir(index_root)
+            logger.info(f"新しい世代として構築します: {generation}")
+        else:
+            generation, index_dir = LEGACY_GENERATION, index_root
+        state = {
+            "input": str(input_path),
+            "generation": generation,
+            "index_dir": str(index_dir),
+            "as_generation": as_generation,
+            "total": count_chunks(input_path),
+            "processed": 0,
+            "meta_offset": 0,
+            "tokens_offset": 0,
+        }
+
+    index_dir = Path(state["index_dir"])
+    processed = state["processed"]
+    # BM25はFAISSのメタデータJSONを共有する（同じ内容を2回書かない）
+    manifest = IndexManifest(
+        generation=state["generation"],
+        files={**DEFAULT_FILES, "bm25_meta": DEFAULT_FILES["faiss_meta"]},
+        base_dir=index_dir,
+    )
+    # ストリーミング構築では重複をまとめない（前の構築で書いたファイルが残っていれば消す）
+    manifest.path("duplicates").unlink(missing_ok=True)
+
+    embedding_service = EmbeddingService()
+    dimension = embedding_service.dimension
+    store = open_embedding_store(embedding_store, embedding_service)
+
+    # 埋め込みはディスク上のmemmapに置く（再開時にFAISSを積み直すため）
+    embeddings_path = index_dir / "maintenance.emb.npy"
+    if processed:
+        embeddings = np.lib.format.open_memmap(embeddings_path, mode='r+')
+    else:
+        embeddings = np.lib.format.open_memmap(
+            embeddings_path, mode='w+', dtype=np.float32, shape=(state["total"], dimension)
+        )
+
     faiss_manager = FaissIndexManager(
-        str(index_dir / "maintenance.faiss"),
-        str(index_dir / "maintenance.faiss.meta.json")
+        str(manifest.path("faiss")), str(manifest.path("faiss_meta")), autoload=False
     )
-    faiss_manager.build(embeddings)
-    faiss_manager.save(metadata)
-    
-    # 2. Sparse Index（BM25）を構築
-    logger.info("Sparse Index (BM25) を構築中...")
-    tokenized_corpus = [tokenizer.tokenize(text) for text in texts]
-    
+    faiss_manager.create(dimension)
+    # 学習が要るタイプは最後にまとめて追加する（再開時もここでは積み直さない）
+    deferred = faiss_manager.needs_training
+    if not deferred:
+        _add_from_memmap(faiss_manager, embeddings, processed, batch_size)
+
+    meta_writer = MetadataWriter(manifest.path("faiss_meta"), resume_offset=state["meta_offset"] or None)
+    tokens_path = index_dir / "maintenance.tokens.jsonl"
+    tokens_file = open(tokens_path, 'r+b' if processed else 'wb')
+    tokens_file.truncate(state["tokens_offset"])
+    tokens_file.seek(state["tokens_offset"])
+
+    start_time = time.perf_counter()
+    for batch in iter_chunk_batches(input_path, batch_size, skip=processed):
+        texts = [chunk.text for chunk in batch]
+        vectors = embed_texts(texts, embedding_service, store, show_progress=False)
+        embeddings[processed:processed + len(batch)] = vectors
+        if not deferred:
+            faiss_manager.add_batch(vectors)
+        meta_writer.write(chunk.to_dict() for chunk in batch)
+        for text in texts:
+            tokens_file.write(json.dumps(tokenizer.tokenize(text), ensure_ascii=False).encode('utf-8') + b'\n')
+        processed += len(batch)
+
+        # チェックポイント（埋め込みとファイルを書き切ってから記録する）
+        embeddings.flush()
+        tokens_file.flush()
+        state.update(processed=processed, meta_offset=meta_writer.tell(), tokens_offset=tokens_file.tell())
+        _save_checkpoint(checkpoint_path, state)
+
+        elapsed = time.perf_counter() - start_time
+        logger.info(f"{processed}/{state['total']}件 ({processed / max(elapsed, 1e-9):.1f} chunks/s)")
+
+    meta_writer.close()
+    tokens_file.close()
+    if deferred:
+        faiss_manager.train(_training_sample(embeddings, processed))
+        _add_from_memmap(faiss_manager, embeddings, processed, batch_size)
+    faiss_manager.save_index()
+    del embeddings
+
     bm25_manager = BM25IndexManager(
-        str(index_dir / "maintenance.bm25"),
-        str(index_dir / "maintenance.bm25.meta.pkl")
+        str(manifest.path("bm25")), str(manifest.path("bm25_meta")), autoload=False
+    )
+    bm25_manager.build(_iter_tokens(tokens_path))
+    bm25_manager.save_index()
+
+    manifest.num_chunks = processed
+    manifest.embedding_model = embedding_service.model_name
+    if state["as_generation"]:
+        publish_generation(index_root, manifest)
+    else:
+        manifest.save()
+
+    # 途中経過のファイルは消す
+    checkpoint_path.unlink(missing_ok=True)
+    tokens_path.unlink(missing_ok=True)
+    embeddings_path.unlink(missing_ok=True)
+
+    # 再開した場合は前半のテキストを持っていないので、入力からもう一度読む
+    if compact_store and store is not None:
+        store.compact(iter_texts(input_path))
+    logger.info(f"ストリーミング構築完了: {processed}件")
+
+def _drop_duplicates(
+    duplicates_path: Path,
+    live_metadata: List[Dict[str, Any]],
+    doc_ids: set
+) -> List[Dict[str, Any]]:
+    """
+    消す文書のチャンクを、まとめたチャンクのファイルからも消す
+
+    代表が消える場合、そこにまとめていたチャンクは普通のチャンクとして入れ直す必要があるので返す。
+    """
+    groups = DuplicateGroups.load(duplicates_path)
+    if not len(groups):
+        return []
+    removed_representatives = {
+        item['chunk_id'] for item in live_metadata
+        if item.get('doc_id') in doc_ids and item.get('duplicates')
+    }
+    kept: List[Dict[str, Any]] = []
+    promoted: List[Dict[str, Any]] = []
+    for chunk in groups.chunks:
+        if chunk.get('doc_id') in doc_ids:
+            continue
+        if chunk['representative'] in removed_representatives:
+            promoted.append({k: v for k, v in chunk.items() if k != 'representative'})
+        else:
+            kept.append(chunk)
+    if len(kept) != len(groups.chunks):
+        save_duplicates(duplicates_path, kept)
+        logger.info(f"まとめたチャンクから{len(groups.chunks) - len(kept)}件を外しました（{len(promoted)}件は入れ直し）")
+    return promoted
+
+def update_index(
+    output_dir: str,
+    append_file: str | None = None,
+    delete_doc_ids: list[str] | None = None,
+    merge: bool = False,
+    as_generation: bool = False,
+    embedding_store: str | None = settings["data"]["embedding_store_path"],
+    compact_store: bool = False
+):
+    """
+    差分更新（追加・削除・マージ）
+
+    追加分だけ埋め込んでセグメントとして書き足すので、1日分なら数秒で終わる。
+    すでにあるdoc_idのチャンクが来たら、古いチャンクはtombstoneにしてから追加する（更新扱い）。
+    as_generation=Trueなら今の世代をハードリンクで複製した新しい世代に書いて公開する。
+    compact_store=Trueなら、埋め込みストアを更新後に生きているチャンクの分だけに詰め直す。
+    """
+    index_root = Path(output_dir)
+    if as_generation:
+        manifest = fork_generation(index_root)
+        logger.info(f"新しい世代に差分を書き込みます: {manifest.generation}")
+    else:
+        manifest = resolve_manifest(index_root)
+
+    faiss_manager = FaissIndexManager(str(manifest.path("faiss")), str(manifest.path("faiss_meta")))
+    bm25_manager = BM25IndexManager(str(manifest.path("bm25")), str(manifest.path("bm25_meta")))
+    if faiss_manager.index is None or bm25_manager.index is None:
+        raise RuntimeError(f"ベースのインデックスが見つかりません: {manifest.base_dir}")
+
+    # 削除（と更新される文書の古いチャンク）
+    doc_ids = set(delete_doc_ids or [])
+    metadata = load_chunk_dicts(Path(append_file)) if append_file else []
+    doc_ids.update(item['doc_id'] for item in metadata)
+    if doc_ids:
+        metadata.extend(_drop_duplicates(manifest.path("duplicates"), faiss_manager.live_metadata(), doc_ids))
+        deleted = faiss_manager.delete(doc_ids=doc_ids)
+        bm25_manager.delete(doc_ids=doc_ids)
+        logger.info(f"{deleted}個の古いチャンクにtombstoneを付けました")
+
+    # 追加（追加分どうし・既存との重複はまとめない）
+    store: EmbeddingStore | None = None
+    if metadata or compact_store:
+        embedding_service = EmbeddingService()
+        store = open_embedding_store(embedding_store, embedding_service)
+    if metadata:
+        texts = [item['text'] for item in metadata]
+        logger.info(f"{len(metadata)}個のチャンクをセグメントとして追加中...")
+        embeddings = embed_texts(texts, embedding_service, store)
+        faiss_manager.add_segment(embeddings, metadata)
+        bm25_manager.add_segment([tokenizer.tokenize(text) for text in texts], metadata)
+
+    # セグメントが増えすぎたらマージ（FAISSとBM25は並行して進める）
+    # マージしたベースは新しいファイル名で書かれるので、manifestのファイル名を書き換えて公開する。
+    # manifestを書くまでは古いベース・セグメント・tombstoneが一式残っている（途中で落ちても元のまま）
+    superseded: list[Path] = []
+    max_segments = settings["indexing"].get("max_segments", 8)
+    if merge or len(faiss_manager.segment_log.segments) > max_segments:
+        logger.info("セグメントをマージ中...")
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [executor.submit(faiss_manager.merge_segments), executor.submit(bm25_manager.merge_segments)]
+            superseded = [path for future in futures for path in future.result()]
+        manifest.files.update({
+            "faiss": faiss_manager.index_path.name,
+            "faiss_meta": faiss_manager.metadata_path.name,
+            "bm25": bm25_manager.index_path.name,
+            "bm25_meta": bm25_manager.metadata_path.name,
+        })
+
+    if as_generation:
+        manifest.num_chunks = len(faiss_manager.live_metadata())
+        publish_generation(index_root, manifest)
+    elif superseded:
+        manifest.num_chunks = len(faiss_manager.live_metadata())
+        manifest.save()
+    # 公開した後なら古いファイルは要らない（世代ならこの世代のハードリンクを外すだけ）
+    remove_files(superseded)
+
+    if compact_store and store is not None:
+        store.compact(item['text'] for item in faiss_manager.live_metadata())
+
+    logger.info(
+        f"差分更新完了: {len(faiss_manager.live_metadata())}件, "
+        f"セグメント{len(faiss_manager.segment_log.segments)}個"
     )
-    bm25_manager.build(tokenized_corpus)
-    bm25_manager.save(metadata)
-    
-    logger.info("インデックス構築完了！")
 
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser()
-    parser.add_argument("--input", default="data/processed/chunks.jsonl")
+    parser.add_argument("--input", default="data/processed/chunks.jsonl",
+                        help="チャンクファイル（.jsonl / .parquet）")
     parser.add_argument("--output", default="data/demo/indices")
+    parser.add_argument("--generation", action="store_true",
+                        help="新しい世代として構築し、完了後にCURRENTを切り替える（ホットリロード用）")
+    parser.add_argument("--parallel", action="store_true",
+                        help="トークナイズ・エンコードを複数プロセスで実行し、FAISSとBM25を同時に構築する")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="並列モードで使うプロセス数（デフォルトはCPUコア数）")
+    parser.add_argument("--stats", default=None,
+                        help="ステージ別スループットをJSONで書き出すパス")
+    parser.add_argument("--streaming", action="store_true",
+                        help="バッチごとに読み書きしてメモリ使用量を抑える（大規模コーパス向け）")
+    parser.add_argument("--batch-size", type=int, default=1024,
+                        help="ストリーミング構築のバッチサイズ")
+    parser.add_argument("--resume", action="store_true",
+                        help="ストリーミング構築をチェックポイントから再開する")
+    parser.add_argument("--embedding-store", default=settings["data"]["embedding_store_path"],
+                        help="埋め込みキャッシュの場所（変わったチャンクだけエンコードする）")
+    parser.add_argument("--no-embedding-store", action="store_true",
+                        help="埋め込みキャッシュを使わずに全件エンコードする")
+    parser.add_argument("--compact-embedding-store", action="store_true",
+                        help="構築後に埋め込みキャッシュを今のインデックスのチャンクの分だけに詰め直す")
+    parser.add_argument("--no-dedup", action="store_true",
+                        help="ほぼ同じチャンクをまとめずに全部インデックスに入れる")
+    parser.add_argument("--append", default=None,
+                        help="追加・更新するチャンクのJSONL（差分更新。全件再構築しない）")
+    parser.add_argument("--delete-docs", nargs="*", default=None,
+                        help="削除するdoc_id（差分更新）")
+    parser.add_argument("--merge", action="store_true",
+                        help="セグメントをベースにマージする")
     args = parser.parse_args()
+    embedding_store = None if args.no_embedding_store else args.embedding_store
     
-    build_index(args.input, args.output)
+    if args.append or args.delete_docs or args.merge:
+        update_index(
+            args.output,
+            append_file=args.append,
+            delete_doc_ids=args.delete_docs,
+            merge=args.merge,
+            as_generation=args.generation,
+            embedding_store=embedding_store,
+            compact_store=args.compact_embedding_store,
+        )
+    elif args.streaming or args.resume:
+        build_index_streaming(
+            args.input,
+            args.output,
+            as_generation=args.generation,
+            batch_size=args.batch_size,
+            resume=args.resume,
+            embedding_store=embedding_store,
+            compact_store=args.compact_embedding_store,
+        )
+    else:
+        build_index(
+            args.input,
+            args.output,
+            as_generation=args.generation,
+            parallel=args.parallel,
+            workers=args.workers,
+            stats_file=args.stats,
+            embedding_store=embedding_store,
+            dedup=settings["indexing"]["dedup"]["enabled"] and not args.no_dedup,
+            compact_store=args.compact_embedding_store,
+        )
@@ -5,8 +5,12 @@ CSVの生データをチャンク分割してJSONL形式に変換する
 """
 
 import pandas as pd
+import json
 import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import Any, Dict, List
 import sys
 import os
 
@@ -15,18 +19,33 @@ project_root = Path(__file__).parent.parent.parent
 sys.path.append(str(project_root / "packages" / "rag-core"))
 
 from rag_core.chunking import TextChunker
+from rag_core.columnar import ChunkParquetWriter, chunks_to_table
 from rag_core.config import settings
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def preprocess(input_csv: str, output_dir: str):
+CHUNK_FILES = {"jsonl": "chunks.jsonl", "parquet": "chunks.parquet"}
+
+def read_logs(input_path: Path, **kwargs):
+    """保全記録を読む。CSVでもParquetでもOK（Parquetなら型付きの列をそのまま読める）"""
+    if input_path.suffix in (".parquet", ".pq"):
+        return pd.read_parquet(input_path, **kwargs)
+    return pd.read_csv(input_path, **kwargs)
+
+def _iter_parquet_blocks(input_path: Path, block_size: int):
+    """Parquetの保全記録をblock_size行ずつDataFrameで読む"""
+    import pyarrow.parquet as pq
+    for batch in pq.ParquetFile(input_path).iter_batches(batch_size=block_size):
+        yield batch.to_pandas()
+
+def preprocess(input_csv: str, output_dir: str, format: str = "jsonl"):
     input_path = Path(input_csv)
     output_path = Path(output_dir)
     output_path.mkdir(parents=True, exist_ok=True)
     
     logger.info(f"CSVファイルを読み込み中: {input_path}")
-    df = pd.read_csv(input_path)
+    df = read_logs(input_path)
     
     documents = df.to_dict('records')
     logger.info(f"{len(documents)}件のドキュメントを読み込みました")
@@ -42,16 +61,117 @@ def preprocess(input_csv: str, output_dir: str):
     chunks = chunker.chunk_documents(documents, text_field="text", doc_id_field="doc_id")
     
     # チャンクを保存
-    chunks_file = output_path / "chunks.jsonl"
-    chunker.save_chunks(chunks, chunks_file)
+    chunks_file = output_path / CHUNK_FILES[format]
+    chunker.save_chunks(chunks, chunks_file, format=format)
     logger.info(f"{len(chunks)}個のチャンクを保存しました: {chunks_file}")
 
+def _chunk_block(
+    records: List[Dict[str, Any]],
+    chunk_size: int,
+    chunk_overlap: int,
+    format: str = "jsonl"
+) -> tuple[Any, int]:
+    """
+    1ブロック分をチャンク化する（ワーカープロセスで実行）
+
+    Chunkオブジェクトのまま返すとpickleのコストが大きいので、
+    jsonlなら書き出す文字列、parquetならArrowのテーブルにしてから返す。
+    """
+    chunker = TextChunker(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    chunks = chunker.iter_document_chunks(records, text_field="text", doc_id_field="doc_id")
+    if format == "parquet":
+        table = chunks_to_table(list(chunks))
+        return table, table.num_rows
+    lines = [json.dumps(chunk.to_dict(), ensure_ascii=False) + '\n' for chunk in chunks]
+    return "".join(lines), len(lines)
+
+def preprocess_streaming(
+    input_csv: str,
+    output_dir: str,
+    block_size: int = 10000,
+    workers: int | None = None,
+    format: str = "jsonl"
+):
+    """
+    大きなCSV向けの前処理
+
+    CSVをblock_size行ずつ読んで、ブロックごとにワーカープロセスでチャンク化し、
+    終わった順ではなく読んだ順に書き出す（出力は通常のpreprocessと同じ並び）。
+    同時に処理中のブロックはワーカー数の2倍までにしているので、CSVが大きくてもメモリは増えない。
+
+    注意: pandasの型推論はブロックごとに行われるので、
+    あるブロックだけ数値列に欠損があるとその列がfloatになる（値が1ではなく1.0になる）。
+    """
+    input_path = Path(input_csv)
+    output_path = Path(output_dir)
+    output_path.mkdir(parents=True, exist_ok=True)
+    chunks_file = output_path / CHUNK_FILES[format]
+    tmp_file = chunks_file.with_name(chunks_file.name + ".tmp")
+
+    workers = workers or os.cpu_count() or 2
+    logger.info(f"CSVをストリーミングで前処理中: {input_path} (ブロック{block_size}行, {workers}プロセス)")
+
+    num_docs = 0
+    num_chunks = 0
+    if format == "parquet":
+        parquet_writer = ChunkParquetWriter(tmp_file)
+        write_block = parquet_writer.write_table
+    else:
+        jsonl_file = open(tmp_file, 'w', encoding='utf-8')
+        write_block = jsonl_file.write
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+
+            def write_oldest():
+                nonlocal num_chunks
+                block, count = pending.popleft().result()
+                write_block(block)
+                num_chunks += count
+
+            if input_path.suffix in (".parquet", ".pq"):
+                blocks = _iter_parquet_blocks(input_path, block_size)
+            else:
+                blocks = pd.read_csv(input_path, chunksize=block_size)
+            for block in blocks:
+                records = block.to_dict('records')
+                num_docs += len(records)
+                pending.append(executor.submit(_chunk_block, records, 500, 50, format))
+                if len(pending) >= workers * 2:
+                    write_oldest()
+                    logger.info(f"{num_docs}件のドキュメントを読み込みました ({num_chunks}チャンク書き出し済み)")
+            while pending:
+                write_oldest()
+    finally:
+        if format == "parquet":
+            parquet_writer.close()
+        else:
+            jsonl_file.close()
+
+    # 途中で落ちたときに中途半端な出力ファイルが残らないように、最後に差し替える
+    tmp_file.replace(chunks_file)
+    logger.info(f"{num_docs}件のドキュメントから{num_chunks}個のチャンクを保存しました: {chunks_file}")
+
 if __name__ == "__main__":
     # デモ用のデフォルトパス
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument("--input", default="data/demo/demo_logs.csv")
     parser.add_argument("--output", default="data/processed")
+    parser.add_argument("--format", choices=list(CHUNK_FILES), default="jsonl",
+                        help="チャンクの出力形式（parquetは列指向・辞書エンコードで小さく速い）")
+    parser.add_argument("--streaming", action="store_true",
+                        help="CSVをブロックごとに読み、複数プロセスでチャンク化する（大きなCSV向け）")
+    parser.add_argument("--block-size", type=int, default=10000,
+                        help="ストリーミング時に1回で読む行数")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="ストリーミング時のプロセス数（デフォルトはCPUコア数）")
     args = parser.parse_args()
     
-    preprocess(args.input, args.output)
+    if args.streaming:
+        preprocess_streaming(
+            args.input, args.output, block_size=args.block_size, workers=args.workers, format=args.format
+        )
+    else:
+        preprocess(args.input, args.output, format=args.format)
@@ -0,0 +1,397 @@
+"""
+rag-apiの負荷試験
+
+レプリカ数を勘で決めていたので、1インスタンスがどこで飽和するかを測るために作った。
+asyncioとhttpxだけで動く。
+
+- 並列数スイープ（closed loop）: N個のワーカーが応答を待ってから次を投げる
+- 到着レートスイープ（open loop）: ポアソン到着で決まった時刻に投げる（応答を待たない）。
+  レイテンシは「投げる予定だった時刻」から測るので、サーバーが詰まると素直に悪化する
+
+クエリはtools/evaluation/sample_queries.json、フィルターは/api/search/metadataの値からランダムに作る。
+エンドポイントごと（/api/search, /api/docs/{id}, /api/search/metadata）に
+スループット・p50/p95/p99・エラー率・503率を出して、段階ごとの結果（飽和曲線）をJSON/CSVに保存する。
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+import numpy as np
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+# 1リクエストごとにINFOが出るので黙らせる
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+ROOT = Path(__file__).resolve().parents[2]
+DEFAULT_QUERIES = ROOT / "tools" / "evaluation" / "sample_queries.json"
+ENDPOINTS = ("search", "docs", "metadata")
+
+# フィルターに使う項目（SearchFiltersの名前）
+FILTER_FIELDS = ("categories", "productionLines", "workTypes", "equipment1s", "equipment2s")
+
+
+# ==================== リクエストの組み立て ====================
+
+class Workload:
+    """クエリ・フィルター・doc_idをランダムに組み合わせてリクエストを作る"""
+
+    def __init__(
+        self,
+        queries: List[str],
+        filter_values: Dict[str, List[str]],
+        doc_ids: List[str],
+        mix: Dict[str, float],
+        filter_ratio: float,
+        seed: int,
+    ):
+        self.queries = queries
+        self.filter_values = {name: values for name, values in filter_values.items() if values}
+        self.doc_ids = doc_ids or ["doc_000000"]
+        self.endpoints = list(mix)
+        self.weights = [mix[name] for name in self.endpoints]
+        self.filter_ratio = filter_ratio
+        self.rng = random.Random(seed)
+
+    def random_filters(self) -> Optional[Dict[str, List[str]]]:
+        """1〜2項目を1つずつ選ぶ（画面でよくある絞り込み）"""
+        if not self.filter_values or self.rng.random() >= self.filter_ratio:
+            return None
+        names = self.rng.sample(list(self.filter_values), k=min(len(self.filter_values), self.rng.randint(1, 2)))
+        return {name: [self.rng.choice(self.filter_values[name])] for name in names}
+
+    def next_request(self) -> Dict[str, Any]:
+        endpoint = self.rng.choices(self.endpoints, weights=self.weights)[0]
+        if endpoint == "search":
+            body: Dict[str, Any] = {"query": self.rng.choice(self.queries), "k": 5}
+            filters = self.random_filters()
+            if filters:
+                body["filters"] = filters
+            return {"endpoint": endpoint, "method": "POST", "url": "/api/search", "json": body}
+        if endpoint == "docs":
+            return {"endpoint": endpoint, "method": "GET", "url": f"/api/docs/{self.rng.choice(self.doc_ids)}"}
+        return {"endpoint": endpoint, "method": "GET", "url": "/api/search/metadata"}
+
+
+def load_queries(path: Path) -> List[Dict[str, Any]]:
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)["queries"]
+
+
+async def build_workload(client: httpx.AsyncClient, opts: argparse.Namespace) -> Workload:
+    """サーバーからフィルターの値とdoc_idを集めてWorkloadを作る"""
+    queries = load_queries(Path(opts.queries))
+    texts = [q["query"] for q in queries]
+
+    response = await client.get("/api/search/metadata")
+    response.raise_for_status()
+    metadata = response.json()
+    filter_values = {name: metadata.get(name, []) for name in FILTER_FIELDS}
+
+    # doc_idは実際に検索して出てきたもの（存在しないIDばかりだと404を測ることになる）
+    doc_ids = set()
+    for text in texts:
+        response = await client.post("/api/search", json={"query": text, "k": 5})
+        if response.status_code == 200:
+            doc_ids.update(r["doc_id"] for r in response.json()["results"] if r.get("doc_id"))
+    logger.info(f"Workload: queries={len(texts)}, doc_ids={len(doc_ids)}, filter fields={len(filter_values)}")
+    return Workload(texts, filter_values, sorted(doc_ids), opts.mix, opts.filter_ratio, opts.seed)
+
+
+# ==================== 計測 ====================
+
+@dataclass
+class EndpointStats:
+    latencies: List[float] = field(default_factory=list)  # 成功したリクエストの秒数
+    requests: int = 0
+    errors: int = 0
+    unavailable: int = 0  # 503
+
+    def summary(self, duration: float) -> Dict[str, Any]:
+        ms = np.asarray(self.latencies) * 1000
+        has_latency = len(ms) > 0
+        return {
+            "requests": self.requests,
+            "ok": len(self.latencies),
+            "throughput": round(len(self.latencies) / duration, 2),
+            "p50_ms": round(float(np.percentile(ms, 50)), 2) if has_latency else None,
+            "p95_ms": round(float(np.percentile(ms, 95)), 2) if has_latency else None,
+            "p99_ms": round(float(np.percentile(ms, 99)), 2) if has_latency else None,
+            "error_rate": round(self.errors / self.requests, 4) if self.requests else 0.0,
+            "unavailable_rate": round(self.unavailable / self.requests, 4) if self.requests else 0.0,
+        }
+
+
+class Recorder:
+    def __init__(self):
+        self.stats = {name: EndpointStats() for name in ENDPOINTS}
+        self.dropped = 0  # open loopでクライアント側の上限に引っかかった数
+
+    def record(self, endpoint: str, started: float, status: Optional[int]):
+        stats = self.stats[endpoint]
+        stats.requests += 1
+        if status is not None and 200 <= status < 300:
+            stats.latencies.append(time.perf_counter() - started)
+        elif status == 503:
+            stats.unavailable += 1
+        else:
+            # 4xx/5xx・タイムアウト・接続エラー
+            stats.errors += 1
+
+    def summary(self, duration: float) -> Dict[str, Any]:
+        endpoints = {name: stats.summary(duration) for name, stats in self.stats.items() if stats.requests}
+        total = EndpointStats()
+        for stats in self.stats.values():
+            total.latencies.extend(stats.latencies)
+            total.requests += stats.requests
+            total.errors += stats.errors
+            total.unavailable += stats.unavailable
+        return {"endpoints": endpoints, "total": total.summary(duration), "dropped": self.dropped}
+
+
+async def send(client: httpx.AsyncClient, request: Dict[str, Any], recorder: Recorder, started: float):
+    status: Optional[int] = None
+    try:
+        response = await client.request(request["method"], request["url"], json=request.get("json"))
+        await response.aread()
+        status = response.status_code
+    except httpx.HTTPError:
+        pass
+    recorder.record(request["endpoint"], started, status)
+
+
+async def run_closed_loop(client: httpx.AsyncClient, workload: Workload, concurrency: int, duration: float) -> Recorder:
+    """concurrency個のワーカーが、応答が返ったらすぐ次を投げる"""
+    recorder = Recorder()
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            await send(client, workload.next_request(), recorder, time.perf_counter())
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return recorder
+
+
+async def run_open_loop(
+    client: httpx.AsyncClient,
+    workload: Workload,
+    rate: float,
+    duration: float,
+    max_inflight: int,
+    rng: random.Random,
+) -> Recorder:
+    """
+    ポアソン到着で毎秒rate件を投げる
+
+    遅れは予定時刻から測る（前の応答を待たないので、サーバーが詰まっても投げる間隔は変わらない）。
+    クライアントが先に詰まらないように、同時にmax_inflightを超えたら投げずに数えるだけにする。
+    """
+    recorder = Recorder()
+    inflight = set()
+    start = time.perf_counter()
+    scheduled = start
+    while True:
+        scheduled += rng.expovariate(rate)
+        if scheduled - start >= duration:
+            break
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if len(inflight) >= max_inflight:
+            recorder.dropped += 1
+            continue
+        task = asyncio.create_task(send(client, workload.next_request(), recorder, scheduled))
+        inflight.add(task)
+        task.add_done_callback(inflight.discard)
+    if inflight:
+        await asyncio.gather(*inflight)
+    return recorder
+
+
+# ==================== サーバーの起動 ====================
+
+def launch_server(port: int) -> subprocess.Popen:
+    """services/rag-apiをuvicornで起動する（reloadなし、ワーカー1つ）"""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [
+        str(ROOT / "services" / "rag-api"), str(ROOT / "packages" / "rag-core"), env.get("PYTHONPATH"),
+    ]))
+    command = [sys.executable, "-m", "uvicorn", "src.main:app", "--port", str(port), "--log-level", "warning"]
+    logger.info(f"rag-apiを起動中: port={port}")
+    return subprocess.Popen(command, cwd=ROOT, env=env)
+
+
+async def wait_until_ready(client: httpx.AsyncClient, timeout: float):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            response = await client.get("/health")
+            if response.status_code == 200 and response.json().get("index_loaded"):
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(1.0)
+    raise TimeoutError(f"rag-api did not become ready within {timeout}s")
+
+
+# ==================== 出力 ====================
+
+def print_curve(report: Dict[str, Any]):
+    level_name = "Concurrency" if report["mode"] == "concurrency" else "Rate(req/s)"
+    print("\n" + "=" * 100)
+    print(f"飽和曲線: {report['label']} ({report['mode']})")
+    print("=" * 100)
+    print(f"{level_name:>12} {'Endpoint':<10} {'Req':>7} {'Thru/s':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'Err%':>7} {'503%':>7}")
+    print("-" * 100)
+    for step in report["steps"]:
+        rows = list(step["endpoints"].items()) + [("total", step["total"])]
+        for name, s in rows:
+            def fmt(value):
+                return f"{value:>9.1f}" if value is not None else f"{'-':>9}"
+            print(
+                f"{step['level']:>12} {name:<10} {s['requests']:>7} {s['throughput']:>9.1f} "
+                f"{fmt(s['p50_ms'])} {fmt(s['p95_ms'])} {fmt(s['p99_ms'])} "
+                f"{s['error_rate'] * 100:>6.1f}% {s['unavailable_rate'] * 100:>6.1f}%"
+            )
+        if step.get("dropped"):
+            print(f"{'':>12} (client dropped {step['dropped']} requests)")
+        print("-" * 100)
+
+
+def write_csv(report: Dict[str, Any], path: Path):
+    """グラフにしやすい縦持ちのCSV（ビルドごとのファイルを並べて比べる）"""
+    columns = ["label", "mode", "level", "endpoint", "requests", "throughput",
+               "p50_ms", "p95_ms", "p99_ms", "error_rate", "unavailable_rate"]
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        for step in report["steps"]:
+            for name, s in list(step["endpoints"].items()) + [("total", step["total"])]:
+                writer.writerow({
+                    "label": report["label"], "mode": report["mode"], "level": step["level"], "endpoint": name,
+                    **{key: s[key] for key in columns[4:]},
+                })
+
+
+def default_label() -> str:
+    """ビルドの識別子（gitのコミット。取れなければ日時）"""
+    try:
+        return subprocess.check_output(
+            ["git", "describe", "--always", "--dirty"], cwd=ROOT, text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return datetime.now().strftime("%Y%m%d-%H%M%S")
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        if name not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"unknown endpoint: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+# ==================== メイン ====================
+
+async def run(opts: argparse.Namespace) -> Dict[str, Any]:
+    server = launch_server(opts.port) if opts.launch else None
+    base_url = f"http://127.0.0.1:{opts.port}" if opts.launch else opts.url
+    limits = httpx.Limits(max_connections=opts.max_connections, max_keepalive_connections=opts.max_connections)
+    try:
+        async with httpx.AsyncClient(base_url=base_url, timeout=opts.timeout, limits=limits) as client:
+            await wait_until_ready(client, opts.startup_timeout)
+            workload = await build_workload(client, opts)
+
+            mode = "rate" if opts.rates else "concurrency"
+            levels = opts.rates or opts.concurrency
+            rng = random.Random(opts.seed)
+            steps = []
+            for level in levels:
+                logger.info(f"{mode}={level} を{opts.duration}秒実行中...")
+                if opts.warmup > 0:
+                    await run_closed_loop(client, workload, 1, opts.warmup)
+                started = time.perf_counter()
+                if mode == "rate":
+                    recorder = await run_open_loop(client, workload, level, opts.duration, opts.max_inflight, rng)
+                else:
+                    recorder = await run_closed_loop(client, workload, int(level), opts.duration)
+                # 飽和していると最後の応答が返るまで長引くので、スループットは実際にかかった時間で割る
+                elapsed = time.perf_counter() - started
+                step = {"level": level, "duration": round(elapsed, 2), **recorder.summary(elapsed)}
+                total = step["total"]
+                logger.info(
+                    f"  throughput={total['throughput']:.1f}/s p95={total['p95_ms']}ms "
+                    f"errors={total['error_rate']:.1%} 503={total['unavailable_rate']:.1%}"
+                )
+                steps.append(step)
+    finally:
+        if server:
+            server.terminate()
+            server.wait(timeout=30)
+
+    return {
+        "label": opts.label or default_label(),
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "base_url": base_url,
+        "mode": mode,
+        "mix": opts.mix,
+        "filter_ratio": opts.filter_ratio,
+        "steps": steps,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='rag-apiの負荷試験')
+    parser.add_argument('--url', type=str, default='http://localhost:8001', help='rag-apiのURL')
+    parser.add_argument('--launch', action='store_true', help='rag-apiをこのスクリプトから起動する')
+    parser.add_argument('--port', type=int, default=8011, help='--launchのときのポート')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32],
+                        help='並列数スイープ（closed loop）')
+    parser.add_argument('--rates', type=float, nargs='+', default=None,
+                        help='到着レートスイープ（open loop, req/s）。指定すると並列数スイープの代わりに実行')
+    parser.add_argument('--duration', type=float, default=20.0, help='1段階あたりの秒数')
+    parser.add_argument('--warmup', type=float, default=2.0, help='各段階の前の慣らし（秒）')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix("search=0.8,docs=0.15,metadata=0.05"),
+                        help='エンドポイントの割合（例: search=0.8,docs=0.15,metadata=0.05）')
+    parser.add_argument('--filter-ratio', type=float, default=0.3, help='フィルターを付ける検索の割合')
+    parser.add_argument('--queries', type=str, default=str(DEFAULT_QUERIES), help='クエリのJSON')
+    parser.add_argument('--timeout', type=float, default=30.0, help='1リクエストのタイムアウト（秒）')
+    parser.add_argument('--max-connections', type=int, default=256)
+    parser.add_argument('--max-inflight', type=int, default=1000, help='open loopで同時に待てる数')
+    parser.add_argument('--startup-timeout', type=float, default=300.0, help='起動を待つ秒数（モデルの読み込み込み）')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--label', type=str, default=None, help='ビルドの名前（デフォルトはgit describe）')
+    parser.add_argument('--output', type=str, default=None, help='結果のJSON（デフォルトは loadtest_<label>.json）')
+    parser.add_argument('--csv', type=str, default=None, help='飽和曲線のCSV')
+    opts = parser.parse_args()
+
+    report = asyncio.run(run(opts))
+    print_curve(report)
+
+    output_path = Path(opts.output or Path(__file__).parent / f"loadtest_{report['label']}.json")
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    logger.info(f"Results saved to {output_path}")
+    if opts.csv:
+        write_csv(report, Path(opts.csv))
+        logger.info(f"Saturation curve saved to {opts.csv}")
+
+
+if __name__ == "__main__":
+    main()